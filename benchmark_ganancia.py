@@ -0,0 +1,84 @@
+import logging
+import time
+import lightgbm as lgb
+import numpy as np
+
+from src.gain_function import ganancia_pesos, ganancia_evaluator, crear_ganancia_filas
+from src.ganancia_rapida import (
+    ganancia_pesos_rapida, ganancia_evaluator_rapida, crear_ganancia_topk,
+    preparar_ganancia, ganancia_topk
+)
+from src.config import GANANCIA_ACIERTO, COSTO_ESTIMULO, GANANCIA_TOPE
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+## Micro-benchmark de la métrica de ganancia (src.ganancia_rapida contra src.gain_function)
+# Predicciones de un LightGBM real en varias rondas (las primeras tienen muchos
+# empates), sobre filas del tamaño de un fold de MES_TRAIN y de un mes entero.
+FILAS = [33000, 165000]
+RONDAS = [1, 10, 100, 300]
+REPETICIONES = 20
+SEMILLA = 100343
+
+
+def datos_sinteticos(n, rng):
+    """
+    Features y clase con la proporción de bajas del problema (~0.5% BAJA+1
+    y ~0.5% BAJA+2); las bajas se corren en algunas features.
+    """
+    clase = rng.choice(3, size=n, p=[0.99, 0.005, 0.005])
+    X = rng.normal(size=(n, 20)).astype(np.float32)
+    X[:, :5] += (clase > 0)[:, None] * rng.uniform(0.5, 1.5, size=5)
+    y = (clase > 0).astype(np.int8)
+    peso = np.array([1.0, 1.00001, 1.00002], dtype=np.float32)[clase]
+    ganancia = np.where(clase == 2, GANANCIA_ACIERTO, -COSTO_ESTIMULO).astype(np.int32)
+    return X, y, peso, ganancia
+
+
+def medir(funcion, repeticiones):
+    """Mediana en ms de 'repeticiones' llamadas y el último resultado."""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return float(np.median(tiempos)) * 1000, resultado
+
+
+def main():
+    rng = np.random.default_rng(SEMILLA)
+    logger.info(f"GANANCIA_TOPE: {GANANCIA_TOPE}")
+
+    for n in FILAS:
+        X, y, peso, ganancia = datos_sinteticos(n, rng)
+        params = {'objective': 'binary', 'learning_rate': 0.05, 'num_leaves': 63,
+                  'min_data_in_leaf': 100, 'seed': SEMILLA, 'verbosity': -1}
+        modelo = lgb.train(params, lgb.Dataset(X, label=y, weight=peso), num_boost_round=max(RONDAS))
+
+        for ronda in RONDAS:
+            y_pred = modelo.predict(X, num_iteration=ronda)
+            data = lgb.Dataset(X, label=y, weight=peso)
+            feval_filas, feval_topk = crear_ganancia_filas(ganancia), crear_ganancia_topk(ganancia)
+            corte_directo = ganancia_topk(y_pred, preparar_ganancia(ganancia)) is not None
+
+            pares = {
+                'ganancia_pesos': (lambda: ganancia_pesos(y_pred, data),
+                                   lambda: ganancia_pesos_rapida(y_pred, data)),
+                'ganancia_evaluator': (lambda: ganancia_evaluator(y_pred, data),
+                                       lambda: ganancia_evaluator_rapida(y_pred, data)),
+                'ganancia_filas': (lambda: feval_filas(y_pred, data),
+                                   lambda: feval_topk(y_pred, data)),
+            }
+            for nombre, (actual, rapida) in pares.items():
+                ms_actual, valor_actual = medir(actual, REPETICIONES)
+                ms_rapida, valor_rapida = medir(rapida, REPETICIONES)
+                logger.info(f"{n:>7} filas, ronda {ronda:>4} ({len(np.unique(y_pred)):>6} valores), {nombre:<18}: "
+                            f"{ms_actual:7.2f} ms -> {ms_rapida:7.2f} ms (x{ms_actual / ms_rapida:4.1f}) "
+                            f"{'top-k' if corte_directo else 'orden completo'}, "
+                            f"{'igual' if valor_actual[1] == valor_rapida[1] else 'DISTINTA'} "
+                            f"({valor_actual[1]:,.0f} / {valor_rapida[1]:,.0f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,27 +6,32 @@ import logging
 logging.getLogger("matplotlib").setLevel(logging.WARNING)
 logging.getLogger("matplotlib.font_manager").setLevel(logging.WARNING)
 
-from src.loader import cargar_datos, convertir_clase_ternaria_a_target
-from src.features import feature_engineering_lag, feature_engineering_delta, obtener_columnas_validas
+from src.feature_store import cargar_dataframe
 from src.optimization_cv import optimizar_con_cv
+from src.seleccion import podar_features, guardar_features, seleccion_vigente
 from src.testing import evaluar_en_test
-from src.best_params import cargar_mejores_hiperparametros
+from src.best_params import cargar_mejores_hiperparametros, filas_optimizacion
+from src.esquema import reportar_memoria
 
 from src.config import *
 
 ## config basico logging
-os.makedirs("logs", exist_ok=True)
+# Fuera del import: los procesos spawn (workers de Optuna, buckets del FE)
+# reimportan este script y no deben abrir otro archivo de log
+def configurar_logging():
+    os.makedirs("logs", exist_ok=True)
 
-fecha = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-nombre_log = f"log_{fecha}.log"
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(name)s %(lineno)d - %(message)s',
-    handlers=[
-        logging.FileHandler(f"logs/{nombre_log}", mode="w", encoding="utf-8"),
-        logging.StreamHandler()
-    ]
-)
+    fecha = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    nombre_log = f"log_{fecha}.log"
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='%(asctime)s - %(levelname)s - %(name)s %(lineno)d - %(message)s',
+        handlers=[
+            # En modo append: los workers de Optuna agregan líneas al mismo archivo
+            logging.FileHandler(f"logs/{nombre_log}", mode="a", encoding="utf-8"),
+            logging.StreamHandler()
+        ]
+    )
 
 logger = logging.getLogger(__name__)
 
@@ -35,20 +40,19 @@ def main():
     ##Pipeline principal con optimización usando configuración YAML.
     logger.info("=== INICIANDO OPTIMIZACIÓN CON CONFIGURACIÓN YAML ===")
   
-    # 1. Cargar datos
-    df = cargar_datos(DATA_PATH)
-
-    # 2. Feature Engineering
-    atributos = obtener_columnas_validas(df)
-    cant_lag = 2
-    cant_delta = 2
-    df_fe = feature_engineering_lag(df, atributos, cant_lag)
-    df_fe = feature_engineering_delta(df_fe, atributos, cant_delta)
-
-    logger.info(f"Feature Engineering completado: {df_fe.shape}")
+    # 1. Features de los meses a usar, desde el feature store de workflow A
+    # (no se recalcula el FE)
+    df_fe = cargar_dataframe(FEATURE_STORE, MES_TRAIN + MES_TEST)
+    logger.info(f"Features cargadas del store: {df_fe.shape}")
+    reportar_memoria(df_fe, "feature store")
   
-    #02 Convertir clase_ternaria a target binario
-    df_fe = convertir_clase_ternaria_a_target(df_fe)
+    #02 Poda de features: la lista guardada la usan la optimización, el test y train_final.
+    # Se poda una sola vez por datos y parámetros (ver seleccion_vigente)
+    if seleccion_vigente(df_fe, MES_TRAIN) is None:
+        seleccion = podar_features(df_fe, MES_TRAIN)
+        guardar_features(seleccion)
+
+    # La clase se codifica dentro de la optimización (loader.codificar_clase)
 
     #03 Ejecutar optimizacion de hiperparametros
     study = optimizar_con_cv(df_fe, n_trials=3)
@@ -57,7 +61,7 @@ def main():
     logger.info("=== ANÁLISIS DE RESULTADOS ===")
     trials_df = study.trials_dataframe()
     if len(trials_df) > 0:
-        top_5 = trials_df.nlargest(5, 'value')
+        top_5 = trials_df[trials_df['state'] == 'COMPLETE'].nlargest(5, 'value')
         logger.info("Top 5 mejores trials:")
         for idx, trial in top_5.iterrows():
             logger.info(f"  Trial {trial['number']}: {trial['value']:,.0f}")
@@ -70,7 +74,7 @@ def main():
     mejores_params, best_iter = cargar_mejores_hiperparametros()
   
     # Evaluar en test
-    resultados_test = evaluar_en_test(df_fe, mejores_params, best_iter)
+    resultados_test = evaluar_en_test(df_fe, mejores_params, best_iter, filas_optimizacion())
   
     # Guardar resultados de test
     #guardar_resultados_test(resultados_test)
@@ -108,4 +112,5 @@ def main():
     logger.info(f">>> Ejecución finalizada. Revisar logs para mas detalles.")
 
 if __name__ == "__main__":
+    configurar_logging()
     main()
\ No newline at end of file
@@ -5,6 +5,37 @@ from typing import Tuple, Optional, Dict
 
 logger = logging.getLogger(__name__)
 
+# Parámetros que cuentan filas: dependen del tamaño del set de entrenamiento
+PARAMS_POR_FILAS = ('min_data_in_leaf',)
+
+
+def _datos_vigentes(iteraciones):
+    """
+    Iteraciones de los datos de la corrida más reciente (huella_datos de la
+    última entrada del log). Los trials de estudios sobre otros datos,
+    features o binning quedan en el log pero no compiten.
+    """
+    if not iteraciones:
+        return iteraciones
+    huella = max(iteraciones, key=lambda it: it.get('datetime', '')).get('huella_datos')
+    return [it for it in iteraciones if it.get('huella_datos') == huella]
+
+
+def _mejor_iteracion(iteraciones) -> Optional[Dict]:
+    """
+    Iteración COMPLETE de mayor ganancia. Los trials podados (PRUNED) quedan
+    en el log pero no compiten: su ganancia es la de un CV cortado antes de
+    terminar. Con varias fidelidades (undersampling de CONTINUA) compiten
+    sólo las de la mayor: las menores son estimaciones más ruidosas. Sólo
+    cuentan las de los datos vigentes (ver _datos_vigentes).
+    """
+    iteraciones = [it for it in _datos_vigentes(iteraciones) if it.get('state', 'COMPLETE') == 'COMPLETE']
+    if not iteraciones:
+        return None
+    fidelidad = max(it.get('fidelidad', 1.0) for it in iteraciones)
+    return max((it for it in iteraciones if it.get('fidelidad', 1.0) == fidelidad), key=lambda x: x['value'])
+
+
 def cargar_mejores_hiperparametros(archivo_base: str = None) -> Tuple[Dict, Optional[int]]:
     """
     Carga los mejores hiperparámetros desde el archivo JSON de iteraciones de Optuna.
@@ -24,11 +55,10 @@ def cargar_mejores_hiperparametros(archivo_base: str = None) -> Tuple[Dict, Opti
         with open(archivo, 'r') as f:
             iteraciones = json.load(f)
   
-        if not iteraciones:
-            raise ValueError("No se encontraron iteraciones en el archivo")
-  
         # Encontrar la iteración con mayor ganancia
-        mejor_iteracion = max(iteraciones, key=lambda x: x['value'])
+        mejor_iteracion = _mejor_iteracion(iteraciones)
+        if mejor_iteracion is None:
+            raise ValueError("No se encontraron iteraciones completas en el archivo")
         mejores_params = mejor_iteracion['params']
         mejor_ganancia = mejor_iteracion['value']
         best_iter = mejor_iteracion.get('best_iteration', None)
@@ -38,6 +68,8 @@ def cargar_mejores_hiperparametros(archivo_base: str = None) -> Tuple[Dict, Opti
         logger.info(f"Trial número: {mejor_iteracion['trial_number']}")
         logger.info(f"Parámetros: {mejores_params}")
         logger.info(f"Best Iter: {best_iter}") 
+        if mejor_iteracion.get('fidelidad', 1.0) < 1:
+            logger.info(f"Fidelidad: CONTINUA al {mejor_iteracion['fidelidad']:.0%}")
         return mejores_params, best_iter
   
     except FileNotFoundError:
@@ -65,12 +97,15 @@ def obtener_estadisticas_optuna(archivo_base=None):
   
     try:
         with open(archivo, 'r') as f:
-            iteraciones = json.load(f)
+            iteraciones = _datos_vigentes(json.load(f))
   
+        podados = sum(1 for it in iteraciones if it.get('state', 'COMPLETE') == 'PRUNED')
+        iteraciones = [it for it in iteraciones if it.get('state', 'COMPLETE') == 'COMPLETE']
         ganancias = [iter['value'] for iter in iteraciones]
   
         estadisticas = {
             'total_trials': len(iteraciones),
+            'trials_podados': podados,
             'mejor_ganancia': max(ganancias),
             'peor_ganancia': min(ganancias),
             'ganancia_promedio': sum(ganancias) / len(ganancias),
@@ -78,7 +113,7 @@ def obtener_estadisticas_optuna(archivo_base=None):
         }
   
         logger.info("Estadísticas de optimización:")
-        logger.info(f"  Total trials: {estadisticas['total_trials']}")
+        logger.info(f"  Total trials: {estadisticas['total_trials']} (+{podados} podados)")
         logger.info(f"  Mejor ganancia: {estadisticas['mejor_ganancia']:,.0f}")
         logger.info(f"  Ganancia promedio: {estadisticas['ganancia_promedio']:,.0f}")
 
@@ -87,4 +122,38 @@ def obtener_estadisticas_optuna(archivo_base=None):
   
     except Exception as e:
         logger.error(f"Error al obtener estadísticas: {e}")
-        raise
\ No newline at end of file
+        raise
+
+
+def filas_optimizacion(archivo_base: str = None) -> Optional[int]:
+    """
+    Filas con las que entrenó cada fold del CV en el trial de
+    cargar_mejores_hiperparametros (None si el log no las tiene).
+    """
+    if archivo_base is None:
+        archivo_base = STUDY_NAME
+
+    with open(f"resultados/{archivo_base}_iteraciones.json", 'r') as f:
+        mejor = _mejor_iteracion(json.load(f))
+    return mejor.get('filas_entrenamiento') if mejor else None
+
+
+def reescalar_params(params: Dict, filas_origen: Optional[int], filas_destino: int) -> Dict:
+    """
+    Copia de 'params' con los parámetros de PARAMS_POR_FILAS llevados de
+    'filas_origen' (las de la optimización, ej. un fold con undersampling)
+    a 'filas_destino' (las del entrenamiento), como los notebooks de R con
+    min_data_in_leaf. Sin 'filas_origen' los devuelve sin cambios.
+    """
+    params = dict(params)
+    if not filas_origen or filas_origen == filas_destino:
+        return params
+
+    factor = filas_destino / filas_origen
+    for clave in PARAMS_POR_FILAS:
+        if clave in params:
+            anterior = params[clave]
+            params[clave] = max(1, int(round(anterior * factor)))
+            logger.info(f"{clave}: {anterior} -> {params[clave]} "
+                        f"({filas_origen} filas en la optimización, {filas_destino} en el entrenamiento)")
+    return params
@@ -0,0 +1,322 @@
+import ast
+import hashlib
+import importlib.util
+import inspect
+import json
+import logging
+import os
+import shutil
+import time
+import duckdb
+import numpy as np
+import pandas as pd
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .esquema import ENUM_CLASE_TERNARIA
+from .output_manager import tamanio_en_disco
+
+logger = logging.getLogger(__name__)
+
+ARCHIVO_INDICE = "_indice.json"
+
+# Hash del código fuente por archivo, para no releer el mismo módulo
+_version_archivos: Dict[str, str] = {}
+# Módulos del paquete que importa cada módulo (ver _modulos_importados)
+_imports_modulos: Dict[str, List[str]] = {}
+
+
+def _sha(texto: str) -> str:
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def huella_valor(valor: Any) -> str:
+    """
+    Huella estable de un parámetro de etapa: listas, dicts, escalares,
+    DataFrames (por contenido) y funciones (por su código fuente).
+    """
+    if isinstance(valor, pd.DataFrame):
+        contenido = pd.util.hash_pandas_object(valor, index=True).to_numpy()
+        return _sha(f"df:{list(valor.columns)}:{hashlib.sha256(contenido.tobytes()).hexdigest()}")
+    if isinstance(valor, np.ndarray):
+        return _sha(f"np:{valor.dtype}:{valor.shape}:{hashlib.sha256(valor.tobytes()).hexdigest()}")
+    if isinstance(valor, dict):
+        return _sha(json.dumps({str(k): huella_valor(v) for k, v in sorted(valor.items(), key=lambda kv: str(kv[0]))}))
+    if isinstance(valor, (list, tuple)):
+        return _sha(json.dumps([huella_valor(v) for v in valor]))
+    if callable(valor):
+        return version_codigo([valor])
+    return _sha(repr(valor))
+
+
+def _hash_archivo(archivo: str) -> str:
+    if archivo not in _version_archivos:
+        with open(archivo, "rb") as fh:
+            _version_archivos[archivo] = hashlib.sha256(fh.read()).hexdigest()
+    return _version_archivos[archivo]
+
+
+def _modulos_importados(modulo: str) -> List[str]:
+    """
+    Módulos del mismo paquete (ej. src.*) que importa 'modulo', leídos del
+    código fuente: incluye los imports dentro de funciones.
+    """
+    if modulo in _imports_modulos:
+        return _imports_modulos[modulo]
+    raiz = modulo.split(".")[0]
+    spec = importlib.util.find_spec(modulo)
+    paquete = modulo if spec.submodule_search_locations else modulo.rpartition(".")[0]
+    with open(spec.origin, "rb") as fh:
+        arbol = ast.parse(fh.read())
+
+    nombres = set()
+    for nodo in ast.walk(arbol):
+        if isinstance(nodo, ast.Import):
+            nombres.update(a.name for a in nodo.names)
+        elif isinstance(nodo, ast.ImportFrom):
+            base = importlib.util.resolve_name("." * nodo.level + (nodo.module or ""), paquete) \
+                if nodo.level else nodo.module
+            nombres.add(base)
+            # from . import modulo
+            nombres.update(f"{base}.{a.name}" for a in nodo.names)
+
+    importados = []
+    for nombre in sorted(nombres):
+        if nombre.split(".")[0] != raiz or nombre == modulo:
+            continue
+        try:
+            spec_importado = importlib.util.find_spec(nombre)
+        except ModuleNotFoundError:
+            # from .modulo import funcion: 'src.modulo.funcion' no es un módulo
+            continue
+        if spec_importado is not None and spec_importado.origin and spec_importado.origin.endswith(".py"):
+            importados.append(nombre)
+    _imports_modulos[modulo] = importados
+    return importados
+
+
+def version_codigo(funciones: List[Callable]) -> str:
+    """
+    Versión del código de una etapa: hash del archivo fuente de cada función
+    y de los módulos del paquete que importa, recursivamente. Se usa el
+    módulo completo para que un cambio en un helper del mismo archivo o de
+    otro módulo (ej. esquema.aplicar_esquema en fe_intrames) también
+    invalide la etapa.
+    """
+    partes = []
+    for f in funciones:
+        partes.append(f"{f.__module__}.{f.__qualname__}:{_hash_archivo(inspect.getsourcefile(f))}")
+
+        pendientes, vistos = list(_modulos_importados(f.__module__)), {f.__module__}
+        while pendientes:
+            modulo = pendientes.pop()
+            if modulo in vistos:
+                continue
+            vistos.add(modulo)
+            pendientes.extend(_modulos_importados(modulo))
+        for modulo in sorted(vistos - {f.__module__}):
+            partes.append(f"{modulo}:{_hash_archivo(importlib.util.find_spec(modulo).origin)}")
+    return _sha("|".join(partes))
+
+
+def clave_archivo(path: str) -> str:
+    """
+    Clave de entrada de un archivo crudo: ruta, tamaño y mtime (sin leerlo).
+    """
+    st = os.stat(path)
+    return _sha(f"archivo:{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}")
+
+
+class CacheEtapas:
+    """
+    Cache en disco de las salidas de las etapas de un workflow.
+
+    Cada salida se guarda como Parquet bajo una clave que combina la clave de
+    la entrada, el nombre de la etapa, la versión de su código y sus
+    parámetros. Como la clave de cada etapa entra en la de la siguiente,
+    cambiar una etapa sólo invalida esa y las posteriores (ej. cambiar la
+    cantidad de lags no recalcula el target ni el FE intra-mes).
+
+    El índice (_indice.json) guarda tamaño y último uso de cada entrada; al
+    superar 'max_bytes' se borran las menos usadas recientemente (LRU).
+    """
+
+    def __init__(self,
+                 con: duckdb.DuckDBPyConnection,
+                 directorio: str,
+                 max_bytes: Optional[int] = None):
+        self.con = con
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        os.makedirs(directorio, exist_ok=True)
+        self._indice_path = os.path.join(directorio, ARCHIVO_INDICE)
+        self._indice = self._leer_indice()
+        self._usadas = set()
+
+    def _leer_indice(self) -> Dict[str, dict]:
+        if not os.path.exists(self._indice_path):
+            return {}
+        with open(self._indice_path, "r") as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                logger.warning("Índice del cache corrupto; se reconstruye vacío")
+                return {}
+
+    def _guardar_indice(self):
+        tmp = f"{self._indice_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._indice, f, indent=4)
+        os.replace(tmp, self._indice_path)
+
+    def _ruta(self, nombre: str, clave: str) -> str:
+        return os.path.join(self.directorio, f"{nombre}-{clave[:20]}.parquet")
+
+    def clave(self,
+              nombre: str,
+              clave_entrada: str,
+              parametros: Optional[Dict[str, Any]] = None,
+              codigo: Optional[List[Callable]] = None) -> str:
+        """
+        Clave de la salida de una etapa.
+
+        Args:
+            nombre: Nombre de la etapa
+            clave_entrada: Clave de la entrada (salida de la etapa anterior)
+            parametros: Parámetros que afectan el resultado
+            codigo: Funciones cuyo código define la etapa
+
+        Returns:
+            str: Hash hexadecimal
+        """
+        return _sha("|".join([
+            nombre,
+            clave_entrada,
+            version_codigo(codigo or []),
+            huella_valor(parametros or {}),
+        ]))
+
+    def etapa(self,
+              nombre: str,
+              clave_entrada: str,
+              calcular: Callable[[], Any],
+              parametros: Optional[Dict[str, Any]] = None,
+              codigo: Optional[List[Callable]] = None,
+              persistir: bool = True) -> Tuple[duckdb.DuckDBPyRelation, str]:
+        """
+        Devuelve la salida de la etapa desde el cache o, si no está, la calcula
+        con 'calcular()', la guarda y la devuelve. 'calcular' puede devolver una
+        relación, un DataFrame o la ruta de un directorio Parquet ya escrito
+        (ej. el modo streaming por buckets o un dataset particionado), que se
+        mueve al cache tal cual.
+
+        Con persistir=False la etapa no se guarda (útil para proyecciones
+        baratas) pero igual aporta su clave a las etapas siguientes.
+
+        Args:
+            nombre: Nombre de la etapa
+            clave_entrada: Clave de la entrada
+            calcular: Función sin argumentos que produce la salida
+            parametros: Parámetros que afectan el resultado
+            codigo: Funciones cuyo código define la etapa
+            persistir: Si es False, calcula siempre y no escribe en disco
+
+        Returns:
+            tuple: (relación de salida, clave de la salida)
+        """
+        clave = self.clave(nombre, clave_entrada, parametros, codigo)
+
+        if not persistir:
+            return self._como_relacion(calcular()), clave
+
+        ruta = self._ruta(nombre, clave)
+        entrada = self._indice.get(clave)
+        if entrada is not None and os.path.exists(ruta):
+            logger.info(f"Cache [{nombre}]: reutilizando {os.path.basename(ruta)}")
+            entrada['ultimo_uso'] = time.time()
+            self._usadas.add(clave)
+            self._guardar_indice()
+            return self._leer(ruta), clave
+
+        logger.info(f"Cache [{nombre}]: calculando etapa")
+        inicio = time.time()
+        salida = calcular()
+        tmp = f"{ruta}.tmp"
+        if isinstance(salida, str):
+            shutil.rmtree(ruta, ignore_errors=True)
+            os.replace(salida, ruta)
+        elif isinstance(salida, pd.DataFrame):
+            salida.to_parquet(tmp, index=False)
+            os.replace(tmp, ruta)
+        else:
+            self._como_relacion(salida).write_parquet(tmp, compression="zstd")
+            os.replace(tmp, ruta)
+
+        nbytes = tamanio_en_disco(ruta)
+        self._indice[clave] = {
+            'etapa': nombre,
+            'archivo': os.path.basename(ruta),
+            'bytes': nbytes,
+            'creado': time.time(),
+            'ultimo_uso': time.time(),
+        }
+        self._usadas.add(clave)
+        logger.info(f"Cache [{nombre}]: guardada en {time.time() - inicio:.1f}s "
+                    f"({nbytes / 1024 ** 2:,.1f} MB)")
+        self._desalojar()
+        self._guardar_indice()
+        return self._leer(ruta), clave
+
+    def archivo(self, clave: str) -> Optional[str]:
+        """
+        Ruta en disco de una salida del cache (archivo o directorio Parquet),
+        para etapas que leen su entrada desde otro proceso.
+        """
+        entrada = self._indice.get(clave)
+        if entrada is None:
+            return None
+        return os.path.join(self.directorio, entrada['archivo'])
+
+    def _leer(self, ruta: str) -> duckdb.DuckDBPyRelation:
+        """
+        Lee una salida del cache: un archivo, un directorio de Parquet o un
+        dataset particionado (columna=valor/*.parquet, ver
+        output_manager.guardar_dataset_parquet). Parquet guarda el ENUM de
+        clase_ternaria como texto, así que se vuelve a castear al tipo compacto.
+        """
+        if not os.path.isdir(ruta):
+            rel = self.con.read_parquet(ruta)
+        elif any("=" in d for d in os.listdir(ruta)):
+            rel = self.con.read_parquet(os.path.join(ruta, "*", "*.parquet"), hive_partitioning=True)
+        else:
+            rel = self.con.read_parquet(os.path.join(ruta, "*.parquet"))
+        if 'clase_ternaria' in rel.columns:
+            rel = rel.project(f"* REPLACE (CAST(clase_ternaria AS {ENUM_CLASE_TERNARIA}) AS clase_ternaria)")
+        return rel
+
+    def _como_relacion(self, salida) -> duckdb.DuckDBPyRelation:
+        if isinstance(salida, duckdb.DuckDBPyRelation):
+            return salida
+        return self.con.from_df(salida) if isinstance(salida, pd.DataFrame) else self.con.from_arrow(salida)
+
+    def _desalojar(self):
+        """
+        Borra las entradas menos usadas hasta quedar por debajo de max_bytes.
+        Nunca borra entradas usadas en esta corrida.
+        """
+        if self.max_bytes is None:
+            return
+        total = sum(e['bytes'] for e in self._indice.values())
+        candidatas = sorted(
+            (c for c in self._indice if c not in self._usadas),
+            key=lambda c: self._indice[c]['ultimo_uso']
+        )
+        for c in candidatas:
+            if total <= self.max_bytes:
+                break
+            entrada = self._indice.pop(c)
+            ruta = os.path.join(self.directorio, entrada['archivo'])
+            if os.path.isdir(ruta):
+                shutil.rmtree(ruta)
+            elif os.path.exists(ruta):
+                os.remove(ruta)
+            total -= entrada['bytes']
+            logger.info(f"Cache: desalojada {entrada['archivo']} ({entrada['bytes'] / 1024 ** 2:,.1f} MB)")
@@ -14,14 +14,54 @@ try:
 
         STUDY_NAME = _cfgGeneral.get("STUDY_NAME", "Wednesday")
         DATA_PATH = _cfg.get("DATA_PATH", "../datasets/competencia_01.csv")
+        ETIQUETAS_DB = _cfg.get("ETIQUETAS_DB", "../datasets/clase_ternaria.duckdb")
+        CACHE_DIR = _cfg.get("CACHE_DIR", "../datasets/cache_etapas")
+        CACHE_MAX_GB = _cfg.get("CACHE_MAX_GB", 20)
+        DRIFT_MODO = _cfg.get("DRIFT_MODO", "ipc")
+        OUTPUT_PARQUET = _cfg.get("OUTPUT_PARQUET", "df_parquet")
+        FEATURE_STORE = _cfg.get("FEATURE_STORE", "../datasets/feature_store")
+        PARQUET_ROW_GROUP = _cfg.get("PARQUET_ROW_GROUP", 122880)
+        PARQUET_COMPRESION = _cfg.get("PARQUET_COMPRESION", "zstd")
+        DUCKDB_MEMORIA = _cfg.get("DUCKDB_MEMORIA", None)
+        DUCKDB_TEMP_DIR = _cfg.get("DUCKDB_TEMP_DIR", None)
+        FE_INTRAMES = _cfg.get("FE_INTRAMES", {})
+        FE_INTRAMES_PODAR = _cfg.get("FE_INTRAMES_PODAR", False)
+        FE_HISTORICO = _cfg.get("FE_HISTORICO", {"lags": 2, "deltas": 2})
+        FE_MOTOR = _cfg.get("FE_MOTOR", "sql")
+        FE_VERIFICAR_TENSOR = _cfg.get("FE_VERIFICAR_TENSOR", True)
+        FE_SHARDS = _cfg.get("FE_SHARDS", 1)
+        FE_HILOS = _cfg.get("FE_HILOS", None)
+        FE_BUCKETS = _cfg.get("FE_BUCKETS", 0)
+        FE_PROCESOS = _cfg.get("FE_PROCESOS", None)
+        FE_MEMORIA_PROCESO = _cfg.get("FE_MEMORIA_PROCESO", None)
+        FE_INCREMENTAL = _cfg.get("FE_INCREMENTAL", False)
+        FE_ESTADO = _cfg.get("FE_ESTADO", "../datasets/estado_fe")
+        FE_VERIFICAR_INCREMENTAL = _cfg.get("FE_VERIFICAR_INCREMENTAL", False)
+        SELECCION_FEATURES = {
+            'nulos_max': 0.99, 'correlacion_max': 0.98, 'muestra': 20000,
+            'canarios': 20, 'cuantil_canarios': 1.0, 'rondas': 200,
+            **(_cfg.get("SELECCION_FEATURES") or {})
+        }
         SEMILLA = _cfg.get("SEMILLA", [100343, 100103, 100109, 100129, 100057])
         MES_TRAIN = _cfg.get("MES_TRAIN", 202102)
         MES_TEST = _cfg.get("MES_TEST", 202104)
         GANANCIA_ACIERTO = _cfg.get("GANANCIA_ACIERTO", None)
         COSTO_ESTIMULO = _cfg.get("COSTO_ESTIMULO", None)
+        GANANCIA_TOPE = _cfg.get("GANANCIA_TOPE", 0.2)
         FINAL_TRAIN = _cfg.get("FINAL_TRAIN", [202101, 202102, 202103, 202104])
         FINAL_PREDIC = _cfg.get("FINAL_PREDIC", 202106)
         PARAMETROS_LGB = _cfg.get("PARAMETROS_LGB", {})
+        LGB_UMBRAL_DISPERSO = _cfg.get("LGB_UMBRAL_DISPERSO", 0.8)
+        OPTUNA_STORAGE = _cfg.get("OPTUNA_STORAGE", "journal")
+        OPTUNA_WORKERS = _cfg.get("OPTUNA_WORKERS", 1)
+        OPTUNA_PODA = {
+            'pruner': 'median', 'cada': 50, 'warmup': 200, 'startup': 5,
+            **(_cfg.get("OPTUNA_PODA") or {})
+        }
+        OPTUNA_SUBMUESTREO = {
+            'continua': 1.0, 'fidelidades': [], 'top': 5,
+            **(_cfg.get("OPTUNA_SUBMUESTREO") or {})
+        }
 
 except Exception as e:
     logger.error(f"Error al cargar el archivo de configuracion: {e}")
@@ -1,6 +1,10 @@
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 import duckdb
+from .pipeline import registrar_entrada
 
 logger = logging.getLogger(__name__)
 
@@ -30,9 +34,219 @@ ind = pd.DataFrame({
     'foto_mes': vfoto_mes
 })
 
-def drift_inf(dataset, campos_monetarios, tb_indices):
-    dataset = dataset.merge(tb_indices[['foto_mes', 'IPC']], on='foto_mes', how='left')
-    for campo in campos_monetarios:
-        dataset[campo] *= dataset['IPC']
-    dataset.drop(columns=['IPC'], inplace=True)
+def agregar_indice(tb_indices, nombre, valores, meses=None):
+    """
+    Devuelve una copia de la tabla de índices con una columna nueva
+    (ej. 'dolar' o 'salario'), para deflactar otro grupo de columnas.
+
+    Args:
+        tb_indices: Tabla con foto_mes y los índices existentes
+        nombre: Nombre del índice nuevo
+        valores: Factores por mes (mismo orden que 'meses')
+        meses: foto_mes de cada valor (None = los de tb_indices)
+    """
+    tb = tb_indices.copy()
+    if meses is None:
+        tb[nombre] = valores
+    else:
+        tb[nombre] = tb['foto_mes'].map(dict(zip(meses, valores)))
+    return tb
+
+
+def factores_por_fila(foto_mes, tb_indices, indice='IPC'):
+    """
+    Traduce la columna foto_mes a un array float32 con el factor de 'indice'
+    de cada fila, con una búsqueda por posición (sin merge). Los meses que no
+    están en la tabla quedan en NaN, igual que con un left join.
+    """
+    if indice not in tb_indices.columns:
+        raise KeyError(f"El índice '{indice}' no está en la tabla de índices")
+
+    tb = tb_indices.sort_values('foto_mes')
+    meses = tb['foto_mes'].to_numpy(dtype=np.int64)
+    valores = np.append(tb[indice].to_numpy(dtype=np.float32), np.float32(np.nan))
+
+    foto_mes = np.asarray(foto_mes, dtype=np.int64)
+    pos = np.searchsorted(meses, foto_mes)
+    pos = np.minimum(pos, len(meses) - 1)
+    # Los meses ausentes apuntan al NaN agregado al final
+    pos[meses[pos] != foto_mes] = len(meses)
+    return valores[pos]
+
+
+def deflactar(dataset, grupos, tb_indices, con=None):
+    """
+    Ajusta los montos por uno o varios índices en una sola pasada.
+
+    'grupos' indica qué índice se aplica a cada grupo de columnas, por
+    ejemplo {'IPC': campos_pesos, 'dolar': campos_dolares}. En pandas se
+    calcula una vez el factor por fila de cada índice y se escalan las
+    columnas del DataFrame recibido, columna a columna, sin el merge que
+    copiaba todo el dataset. Con una relación de la sesión es un único
+    SELECT con un join a la tabla de índices.
+
+    Args:
+        dataset: DataFrame o relación DuckDB con foto_mes
+        grupos: {indice: [columnas]}
+        tb_indices: Tabla con foto_mes y una columna por índice
+        con: Conexión de la sesión (obligatoria si dataset es una relación)
+
+    Returns:
+        El mismo DataFrame (modificado) o una relación nueva
+    """
+    grupos = {indice: list(campos) for indice, campos in grupos.items() if campos}
+    faltantes = [indice for indice in grupos if indice not in tb_indices.columns]
+    if faltantes:
+        raise KeyError(f"Índices inexistentes en la tabla de índices: {faltantes}")
+    if not grupos:
+        return dataset
+
+    # Relación de la sesión: se ajusta en la misma consulta, sin pasar por pandas
+    if isinstance(dataset, duckdb.DuckDBPyRelation):
+        if con is None:
+            raise ValueError("Para encadenar relaciones hay que pasar la conexión de la sesión (con)")
+        tabla, _ = registrar_entrada(dataset, con, "drift")
+        indices, _ = registrar_entrada(tb_indices[['foto_mes'] + list(grupos)], con, "indices")
+        reemplazos = ", ".join(
+            f'CAST(d."{c}" * i."{indice}" AS FLOAT) AS "{c}"'
+            for indice, campos in grupos.items() for c in campos
+        )
+        return con.sql(f"""
+            SELECT d.* REPLACE ({reemplazos})
+            FROM {tabla} d
+            LEFT JOIN {indices} i USING (foto_mes)
+        """)
+
+    foto_mes = dataset['foto_mes'].to_numpy()
+    for indice, campos in grupos.items():
+        factor = factores_por_fila(foto_mes, tb_indices, indice)
+        for campo in campos:
+            # float32 para no subir a float64 los montos ya compactados
+            dataset[campo] = np.multiply(dataset[campo].to_numpy(dtype=np.float32, na_value=np.nan), factor)
     return dataset
+
+
+def drift_inf(dataset, campos_monetarios, tb_indices, con=None, indice='IPC'):
+    return deflactar(dataset, {indice: campos_monetarios}, tb_indices, con=con)
+
+
+def _rank_con_signo(v):
+    """
+    Percentil de cada valor dentro de su signo: los positivos van a (0, 1],
+    los negativos a [-1, 0) (el más negativo es -1), los ceros quedan en 0 y
+    los NaN en NaN. Con empates se usa el rango máximo (como cume_dist).
+    """
+    v = np.asarray(v, dtype=np.float32)
+    validos = ~np.isnan(v)
+    ordenados = np.sort(v[validos])
+    n_neg = np.searchsorted(ordenados, 0.0, side='left')
+    n_no_pos = np.searchsorted(ordenados, 0.0, side='right')
+    n_pos = len(ordenados) - n_no_pos
+
+    out = np.full(v.shape, np.nan, dtype=np.float32)
+    x = v[validos]
+    r = np.zeros(x.shape, dtype=np.float32)
+    pos = x > 0
+    neg = x < 0
+    if n_pos:
+        r[pos] = (np.searchsorted(ordenados, x[pos], side='right') - n_no_pos) / n_pos
+    if n_neg:
+        r[neg] = -(n_neg - np.searchsorted(ordenados, x[neg], side='left')) / n_neg
+    out[validos] = r
+    return out
+
+
+def _rank_por_mes(df, campos, n_jobs=None):
+    """
+    Aplica _rank_con_signo a cada columna de 'campos' dentro de cada foto_mes.
+    Las filas se agrupan por mes una sola vez y cada mes va a un thread
+    (np.sort libera el GIL). Modifica df en el lugar.
+    """
+    foto_mes = df['foto_mes'].to_numpy()
+    orden = np.argsort(foto_mes, kind='stable')
+    cortes = np.flatnonzero(np.diff(foto_mes[orden])) + 1
+    grupos = np.split(orden, cortes)
+
+    columnas = {c: df[c].to_numpy(dtype=np.float32, na_value=np.nan) for c in campos}
+    salida = {c: np.empty(len(df), dtype=np.float32) for c in campos}
+
+    def procesar_mes(idx):
+        for c in campos:
+            salida[c][idx] = _rank_con_signo(columnas[c][idx])
+
+    with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count()) as pool:
+        list(pool.map(procesar_mes, grupos))
+
+    for c in campos:
+        df[c] = salida[c]
+    logger.info(f"Drift por ranking aplicado a {len(campos)} columnas en {len(grupos)} meses")
+    return df
+
+
+def drift_rank(dataset, campos_monetarios, con=None, n_jobs=None, motor=None):
+    """
+    Corrige el drift reemplazando cada monto por su percentil dentro del
+    foto_mes, separando signos (ver _rank_con_signo): no depende de ningún
+    índice de precios.
+
+    motor='sql' (default para relaciones) usa una ventana cume_dist() por
+    columna particionada por (foto_mes, signo) y queda todo dentro de
+    DuckDB. motor='numpy' (default para DataFrames) agrupa las filas por mes
+    una vez y procesa cada mes en un thread; con una relación baja a pandas
+    las claves y todos los montos y vuelve a unir el resultado por
+    (numero_de_cliente, foto_mes), así que materializa la etapa más ancha.
+
+    Args:
+        dataset: DataFrame o relación DuckDB con foto_mes
+        campos_monetarios: Columnas a normalizar
+        con: Conexión de la sesión (obligatoria si dataset es una relación)
+        n_jobs: Threads del motor numpy (None = todos los cores)
+        motor: 'numpy' o 'sql' (None = 'sql' para relaciones, 'numpy' para DataFrames)
+
+    Returns:
+        El mismo DataFrame (modificado) o una relación nueva
+    """
+    campos_monetarios = list(campos_monetarios)
+    if not campos_monetarios:
+        return dataset
+
+    if not isinstance(dataset, duckdb.DuckDBPyRelation):
+        if motor == 'sql':
+            raise ValueError("motor='sql' requiere una relación de DuckDB")
+        return _rank_por_mes(dataset, campos_monetarios, n_jobs)
+
+    if con is None:
+        raise ValueError("Para encadenar relaciones hay que pasar la conexión de la sesión (con)")
+    tabla, _ = registrar_entrada(dataset, con, "drift_rank")
+
+    if motor in (None, 'sql'):
+        reemplazos = ", ".join(
+            f'CAST(sign("{c}") * cume_dist() OVER '
+            f'(PARTITION BY foto_mes, sign("{c}") ORDER BY abs("{c}")) AS FLOAT) AS "{c}"'
+            for c in campos_monetarios
+        )
+        return con.sql(f"SELECT * REPLACE ({reemplazos}) FROM {tabla}")
+    if motor != 'numpy':
+        raise ValueError(f"Motor de drift_rank desconocido: {motor} (usar 'sql' o 'numpy')")
+
+    claves = ['numero_de_cliente', 'foto_mes']
+    montos = dataset.project(", ".join(f'"{c}"' for c in claves + campos_monetarios)).df()
+    _rank_por_mes(montos, campos_monetarios, n_jobs)
+    rangos, _ = registrar_entrada(montos, con, "rangos")
+    reemplazos = ", ".join(f'r."{c}" AS "{c}"' for c in campos_monetarios)
+    return con.sql(f"""
+        SELECT d.* REPLACE ({reemplazos})
+        FROM {tabla} d
+        JOIN {rangos} r USING (numero_de_cliente, foto_mes)
+    """)
+
+
+def corregir_drift(dataset, campos_monetarios, modo='ipc', tb_indices=ind, con=None):
+    """
+    Aplica la corrección de drift elegida: 'ipc' (drift_inf) o 'rank' (drift_rank).
+    """
+    if modo == 'ipc':
+        return drift_inf(dataset, campos_monetarios, tb_indices, con=con)
+    if modo == 'rank':
+        return drift_rank(dataset, campos_monetarios, con=con)
+    raise ValueError(f"Modo de drift desconocido: {modo}")
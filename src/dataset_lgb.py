@@ -0,0 +1,198 @@
+import hashlib
+import json
+import logging
+import os
+import warnings
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+from .config import LGB_UMBRAL_DISPERSO
+
+logger = logging.getLogger(__name__)
+
+# Parámetros que definen el binning del Dataset (el resto son del booster
+# y pueden cambiar entre trials sin reconstruirlo)
+PARAMS_BINNING = (
+    'max_bin', 'min_data_in_bin', 'bin_construct_sample_cnt', 'feature_pre_filter',
+    'seed', 'data_random_seed', 'use_missing', 'zero_as_missing',
+)
+
+# Datasets ya construidos en este proceso, por huella
+_datasets: Dict[str, Tuple[lgb.Dataset, List[str], Optional[str]]] = {}
+
+
+def columnas_dispersas(df: pd.DataFrame,
+                       features: List[str],
+                       umbral: float = 0.8) -> List[str]:
+    """
+    Features con una fracción de ceros >= 'umbral' (NaN no cuenta como cero).
+    En formato CSC cada valor distinto de cero ocupa 8 bytes (valor float32 e
+    índice int32) contra 4 bytes por fila en denso, así que sólo conviene
+    por encima de la mitad de ceros.
+    """
+    n = len(df)
+    if n == 0:
+        return []
+    return [c for c in features
+            if np.count_nonzero(df[c].to_numpy(dtype=np.float32, na_value=np.nan) == 0) >= umbral * n]
+
+
+def _matriz_csc(df: pd.DataFrame, columnas: List[str]):
+    """
+    Matriz CSC float32 de las columnas dadas, armada columna por columna sin
+    pasar por la matriz densa. Los NaN se guardan explícitos (LightGBM los
+    trata como faltantes, no como ceros).
+    """
+    import scipy.sparse
+
+    datos, indices = [], []
+    indptr = np.zeros(len(columnas) + 1, dtype=np.int64)
+    for j, c in enumerate(columnas):
+        valores = df[c].to_numpy(dtype=np.float32, na_value=np.nan)
+        filas = np.flatnonzero(valores != 0)
+        datos.append(valores[filas])
+        indices.append(filas.astype(np.int32))
+        indptr[j + 1] = indptr[j] + len(filas)
+
+    return scipy.sparse.csc_matrix(
+        (np.concatenate(datos) if datos else np.zeros(0, np.float32),
+         np.concatenate(indices) if indices else np.zeros(0, np.int32),
+         indptr),
+        shape=(len(df), len(columnas))
+    )
+
+
+def construir_dataset(df: pd.DataFrame,
+                      features: List[str],
+                      label: np.ndarray,
+                      weight: Optional[np.ndarray] = None,
+                      params: Optional[Dict] = None,
+                      umbral: Optional[float] = None) -> Tuple[lgb.Dataset, List[str]]:
+    """
+    Dataset de LightGBM para 'features' de 'df'. Las columnas casi todas en
+    cero (ver columnas_dispersas) se pasan como matriz CSC y el resto como
+    matriz densa: se construye un Dataset por parte con los mismos 'params'
+    y se unen con add_features_from. El binning de LightGBM es el mismo en
+    los dos casos, así que el tiempo de entrenamiento no cambia; baja el
+    pico de memoria de la matriz de entrada.
+
+    El Dataset con partes queda construido con 'params' (sólo pueden variar
+    después los parámetros que no tocan el binning, ej. min_data_in_leaf con
+    feature_pre_filter=False) y sus columnas quedan en el orden densas +
+    dispersas: para predecir hay que usar la lista devuelta.
+
+    Args:
+        df: DataFrame con las features
+        features: Columnas del modelo
+        label: Target alineado con las filas de df
+        weight: Pesos (opcional)
+        params: Parámetros de LightGBM con los que se entrena
+        umbral: Fracción de ceros para ir a CSC (None = LGB_UMBRAL_DISPERSO;
+            sin umbral, todo denso como antes)
+
+    Returns:
+        tuple: (Dataset, features en el orden del Dataset)
+    """
+    umbral = LGB_UMBRAL_DISPERSO if umbral is None else umbral
+    dispersas = columnas_dispersas(df, features, umbral) if umbral else []
+    if not dispersas:
+        return lgb.Dataset(df[features], label=label, weight=weight, params=params), list(features)
+
+    elegidas = set(dispersas)
+    densas = [c for c in features if c not in elegidas]
+    csc = _matriz_csc(df, dispersas)
+    logger.info(f"Dataset LightGBM: {len(densas)} columnas densas y {len(dispersas)} dispersas "
+                f"({csc.nnz / max(1, csc.shape[0] * csc.shape[1]):.1%} no ceros, "
+                f"{(csc.data.nbytes + csc.indices.nbytes) / 1024 ** 2:,.1f} MB en CSC contra "
+                f"{csc.shape[0] * csc.shape[1] * 4 / 1024 ** 2:,.1f} MB en denso)")
+
+    if not densas:
+        return lgb.Dataset(csc, label=label, weight=weight, params=params, feature_name=dispersas), dispersas
+
+    # Matriz densa en un solo paso (con columnas float32 del feature store sale
+    # en orden Fortran y LightGBM la lee sin otra copia)
+    dataset = lgb.Dataset(df[densas].to_numpy(), label=label, weight=weight, params=params, feature_name=densas)
+    parte = lgb.Dataset(csc, params=params, feature_name=dispersas)
+    with warnings.catch_warnings():
+        # add_features_from avisa que libera los datos crudos (ya liberados al construir)
+        warnings.simplefilter("ignore")
+        dataset.construct().add_features_from(parte.construct())
+    return dataset, densas + dispersas
+
+
+def huella_dataset(df: pd.DataFrame,
+                   features: List[str],
+                   label: np.ndarray,
+                   weight: Optional[np.ndarray],
+                   params: Dict,
+                   umbral: Optional[float]) -> str:
+    """
+    Huella del Dataset: contenido de las features (columna por columna, sin
+    armar la matriz), label, pesos, lista de features y parámetros de binning.
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps({
+        'features': list(features),
+        'filas': len(df),
+        'binning': {k: params[k] for k in PARAMS_BINNING if k in params},
+        'umbral': umbral,
+    }, sort_keys=True, default=str).encode("utf-8"))
+    for c in features:
+        h.update(np.ascontiguousarray(df[c].to_numpy(dtype=np.float64, na_value=np.nan)).tobytes())
+    h.update(np.asarray(label).tobytes())
+    if weight is not None:
+        h.update(np.asarray(weight).tobytes())
+    return h.hexdigest()[:16]
+
+
+def dataset_cacheado(df: pd.DataFrame,
+                     features: List[str],
+                     label: np.ndarray,
+                     weight: Optional[np.ndarray] = None,
+                     params: Optional[Dict] = None,
+                     directorio: Optional[str] = None,
+                     umbral: Optional[float] = None,
+                     huella: Optional[str] = None) -> Tuple[lgb.Dataset, List[str], Optional[str]]:
+    """
+    construir_dataset con cache: el Dataset ya binneado se guarda en memoria
+    y, si hay 'directorio', como binario de LightGBM ({huella}.bin, ver
+    huella_dataset). Así se binnea una vez por estudio y lo comparten todos
+    los trials y folds; una corrida posterior con los mismos datos y
+    features lo lee del disco sin volver a binnear.
+
+    El Dataset queda construido: los trials sólo pueden cambiar parámetros
+    del booster (con feature_pre_filter=False también min_data_in_leaf).
+    Si el llamador ya calculó huella_dataset la puede pasar en 'huella'.
+
+    Returns:
+        tuple: (Dataset construido, features en el orden del Dataset, ruta
+        del binario o None), la ruta sirve para abrirlo en otro proceso
+    """
+    params = dict(params or {})
+    umbral = LGB_UMBRAL_DISPERSO if umbral is None else umbral
+    huella = huella or huella_dataset(df, features, label, weight, params, umbral)
+    if huella in _datasets:
+        logger.info(f"Dataset LightGBM {huella}: reutilizado de memoria")
+        return _datasets[huella]
+
+    ruta = os.path.join(directorio, f"{huella}.bin") if directorio else None
+    if ruta and os.path.exists(ruta) and os.path.exists(f"{ruta}.json"):
+        with open(f"{ruta}.json", "r") as f:
+            orden = json.load(f)
+        dataset = lgb.Dataset(ruta, params=params).construct()
+        logger.info(f"Dataset LightGBM {huella}: leído de {ruta}")
+    else:
+        dataset, orden = construir_dataset(df, features, label, weight, params=params, umbral=umbral)
+        dataset.construct()
+        if ruta:
+            os.makedirs(directorio, exist_ok=True)
+            dataset.save_binary(f"{ruta}.tmp")
+            os.replace(f"{ruta}.tmp", ruta)
+            with open(f"{ruta}.json", "w") as f:
+                json.dump(orden, f)
+            logger.info(f"Dataset LightGBM {huella}: guardado en {ruta} "
+                        f"({os.path.getsize(ruta) / 1024 ** 2:,.1f} MB)")
+
+    _datasets[huella] = (dataset, orden, ruta)
+    return _datasets[huella]
@@ -0,0 +1,240 @@
+import logging
+import os
+import duckdb
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+from .output_manager import tamanio_en_disco
+
+logger = logging.getLogger(__name__)
+
+## Tipos compactos del dataset
+COLUMNAS_CLAVE = ['numero_de_cliente', 'foto_mes']
+CATEGORIAS_CLASE = ['CONTINUA', 'BAJA+1', 'BAJA+2']
+ENUM_CLASE_TERNARIA = "ENUM('CONTINUA', 'BAJA+1', 'BAJA+2')"
+PREFIJOS_MONETARIOS = ('m', 'Visa_m', 'Master_m', 'vm_m')
+PREFIJOS_CONTEO = ('c', 'Visa_c', 'Master_c')
+
+# Rangos de enteros de DuckDB, del más chico al más grande
+_ENTEROS_SQL = [
+    ('TINYINT', np.iinfo(np.int8)),
+    ('SMALLINT', np.iinfo(np.int16)),
+    ('INTEGER', np.iinfo(np.int32)),
+]
+
+_TIPOS_NUMERICOS = {
+    'TINYINT', 'SMALLINT', 'INTEGER', 'BIGINT', 'HUGEINT',
+    'UTINYINT', 'USMALLINT', 'UINTEGER', 'UBIGINT', 'FLOAT', 'DOUBLE',
+}
+
+# Tipo al que se ensancha una resta para que el delta no desborde
+_ENSANCHE_DELTA = {
+    'TINYINT': 'SMALLINT',
+    'SMALLINT': 'INTEGER',
+    'INTEGER': 'BIGINT',
+    'BIGINT': 'DOUBLE',
+}
+
+
+def es_monetaria(columna: str) -> bool:
+    """
+    Indica si la columna es un monto (m*, Visa_m*, Master_m*, vm_m*).
+    """
+    return columna.startswith(PREFIJOS_MONETARIOS)
+
+
+def es_conteo(columna: str) -> bool:
+    """
+    Indica si la columna es una cantidad (c*, Visa_c*, Master_c*; no cliente_*).
+    """
+    return columna.startswith(PREFIJOS_CONTEO) and not columna.startswith('cliente_')
+
+
+def _entero_minimo(minimo, maximo) -> str:
+    """
+    Devuelve el entero SQL más chico que contiene el rango [minimo, maximo].
+    """
+    if minimo is None or maximo is None:
+        return 'TINYINT'
+    for tipo, info in _ENTEROS_SQL:
+        if info.min <= minimo and maximo <= info.max:
+            return tipo
+    return 'BIGINT'
+
+
+def inferir_esquema(con: duckdb.DuckDBPyConnection, tabla: str) -> Dict[str, str]:
+    """
+    Infiere el tipo SQL compacto de cada columna de 'tabla' en una sola pasada:
+      - numero_de_cliente / foto_mes: INTEGER
+      - clase_ternaria: ENUM con las tres clases
+      - DOUBLE (montos y demás decimales): FLOAT
+      - enteros (cantidades c*, flags): el entero más chico que contiene su rango
+
+    Args:
+        con: Conexión DuckDB donde existe 'tabla' (tabla o vista)
+        tabla: Nombre de la tabla
+
+    Returns:
+        dict: {columna: tipo SQL}
+    """
+    tipos = con.execute(f"SELECT column_name, column_type FROM (DESCRIBE {tabla})").fetchall()
+
+    enteros = [c for c, t in tipos
+               if c not in COLUMNAS_CLAVE and t in ('TINYINT', 'SMALLINT', 'INTEGER', 'BIGINT', 'HUGEINT')]
+    rangos = {}
+    if enteros:
+        aggs = ", ".join(f'min("{c}"), max("{c}")' for c in enteros)
+        fila = con.execute(f"SELECT {aggs} FROM {tabla}").fetchone()
+        rangos = {c: (fila[2 * i], fila[2 * i + 1]) for i, c in enumerate(enteros)}
+
+    esquema = {}
+    for columna, tipo in tipos:
+        if columna in COLUMNAS_CLAVE:
+            esquema[columna] = 'INTEGER'
+        elif columna == 'clase_ternaria':
+            esquema[columna] = ENUM_CLASE_TERNARIA
+        elif columna in rangos:
+            esquema[columna] = _entero_minimo(*rangos[columna])
+        elif tipo in ('DOUBLE', 'FLOAT') or tipo.startswith('DECIMAL'):
+            esquema[columna] = 'FLOAT'
+        else:
+            esquema[columna] = tipo
+
+    return esquema
+
+
+def select_con_esquema(esquema: Dict[str, str], columnas: Optional[List[str]] = None) -> str:
+    """
+    Arma la lista del SELECT que castea cada columna a su tipo compacto.
+    """
+    if columnas is None:
+        columnas = list(esquema)
+    return ", ".join(
+        f'CAST("{c}" AS {esquema[c]}) AS "{c}"' if c in esquema else f'"{c}"'
+        for c in columnas
+    )
+
+
+def expresion_resta(columna: str, tipo: str, otra: str) -> str:
+    """
+    Expresión SQL de 'columna - otra' ensanchando el tipo cuando la columna
+    es entera (ej. un delta a partir de la columna de lag ya generada), para
+    que el resultado siga siendo compacto sin desbordar.
+    """
+    ancho = _ENSANCHE_DELTA.get(tipo)
+    base = f"CAST({columna} AS {ancho})" if ancho else columna
+    return f"({base} - {otra})"
+
+
+def es_tipo_numerico(tipo: str) -> bool:
+    """
+    Indica si un tipo SQL de DuckDB es numérico.
+    """
+    return tipo in _TIPOS_NUMERICOS or tipo.startswith('DECIMAL')
+
+
+def tipos_columnas(con: duckdb.DuckDBPyConnection, tabla: str) -> Dict[str, str]:
+    """
+    Devuelve {columna: tipo SQL} de una tabla/vista registrada en DuckDB.
+    """
+    return dict(con.execute(f"SELECT column_name, column_type FROM (DESCRIBE {tabla})").fetchall())
+
+
+def aplicar_esquema(df: pd.DataFrame, columnas: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Compacta en el lugar los dtypes de un DataFrame de pandas:
+    int32 para las claves, float32 para los decimales, el entero más chico
+    para los enteros y categórica para clase_ternaria.
+
+    Args:
+        df: DataFrame a compactar (se modifica en el lugar)
+        columnas: Columnas a compactar (None = todas)
+
+    Returns:
+        pd.DataFrame: El mismo DataFrame, con dtypes compactos
+    """
+    if columnas is None:
+        columnas = list(df.columns)
+
+    for c in columnas:
+        serie = df[c]
+        dtype = serie.dtype
+        if c in COLUMNAS_CLAVE:
+            if dtype != np.int32:
+                df[c] = serie.astype(np.int32)
+        elif c == 'clase_ternaria':
+            if not isinstance(dtype, pd.CategoricalDtype):
+                df[c] = pd.Categorical(serie, categories=CATEGORIAS_CLASE)
+        elif pd.api.types.is_float_dtype(dtype):
+            if dtype != np.float32:
+                df[c] = serie.astype(np.float32)
+        elif pd.api.types.is_integer_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+            if serie.isna().all():
+                continue
+            tipo = _entero_minimo(serie.min(), serie.max())
+            destino = {'TINYINT': 'int8', 'SMALLINT': 'int16', 'INTEGER': 'int32', 'BIGINT': 'int64'}[tipo]
+            if isinstance(dtype, pd.api.extensions.ExtensionDtype):
+                destino = destino.capitalize()
+            if str(dtype) != destino:
+                df[c] = serie.astype(destino)
+
+    return df
+
+
+def reportar_memoria(df, etapa: str,
+                     con: Optional[duckdb.DuckDBPyConnection] = None,
+                     archivo: Optional[str] = None) -> int:
+    """
+    Loguea y devuelve los bytes que ocupa el dataset al terminar una etapa.
+
+    Un DataFrame se mide en RAM. Una relación de DuckDB no está entera en
+    memoria: se reportan los bytes del Parquet de la etapa en el cache
+    ('archivo'; 0 si la etapa no se persiste) y, con 'con', la memoria y el
+    disco temporal que usa DuckDB en ese momento (duckdb_memory()). Las
+    filas salen de los metadatos del Parquet: contar sobre la relación
+    ejecutaría de nuevo toda la etapa pendiente.
+    """
+    if isinstance(df, pd.DataFrame):
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        logger.info(f"Memoria [{etapa}]: {nbytes / 1024 ** 2:,.1f} MB "
+                    f"({df.shape[0]} filas x {df.shape[1]} columnas)")
+        return nbytes
+
+    persistido = bool(archivo) and os.path.exists(archivo)
+    nbytes = tamanio_en_disco(archivo) if persistido else 0
+    filas = "? filas"
+    detalle = ""
+    if con is not None:
+        if persistido:
+            patron = os.path.join(archivo, "**", "*.parquet") if os.path.isdir(archivo) else archivo
+            filas = f"{con.execute('SELECT sum(num_rows) FROM parquet_file_metadata(?)', [patron]).fetchone()[0]} filas"
+        memoria, temporal = con.execute(
+            "SELECT sum(memory_usage_bytes), sum(temporary_storage_bytes) FROM duckdb_memory()"
+        ).fetchone()
+        detalle = f", DuckDB {memoria / 1024 ** 2:,.1f} MB en memoria y {temporal / 1024 ** 2:,.1f} MB en disco"
+    logger.info(f"Memoria [{etapa}]: {nbytes / 1024 ** 2:,.1f} MB en Parquet "
+                f"({filas} x {len(df.columns)} columnas){detalle}")
+    return nbytes
+
+
+def columnas_iguales(a: pd.Series, b: pd.Series, tolerancia: float) -> bool:
+    """
+    Compara dos columnas: exacto salvo los decimales, que admiten una
+    diferencia relativa a la escala de la columna. La usan las
+    verificaciones del FE (incremental.verificar_incremental y
+    panel.verificar_motores).
+    """
+    if not (pd.api.types.is_numeric_dtype(a) and pd.api.types.is_numeric_dtype(b)):
+        return a.astype("string").fillna("<NA>").equals(b.astype("string").fillna("<NA>"))
+
+    x = a.to_numpy(dtype=np.float64, na_value=np.nan)
+    y = b.to_numpy(dtype=np.float64, na_value=np.nan)
+    if not np.array_equal(np.isnan(x), np.isnan(y)):
+        return False
+    if pd.api.types.is_integer_dtype(a) or pd.api.types.is_integer_dtype(b):
+        return np.array_equal(x, y, equal_nan=True)
+    validos = ~np.isnan(x)
+    if not validos.any():
+        return True
+    escala = np.abs(x[validos]).max()
+    return bool(np.all(np.abs(x[validos] - y[validos]) <= tolerancia * escala))
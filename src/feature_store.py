@@ -0,0 +1,233 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import duckdb
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional, Tuple
+from .cache import huella_valor
+from .esquema import COLUMNAS_CLAVE, CATEGORIAS_CLASE
+from .loader import codigos_clase
+
+logger = logging.getLogger(__name__)
+
+ARCHIVO_ACTUAL = "version_actual.json"
+ARCHIVO_COLUMNAS = "columnas.json"
+
+## Layout del feature store
+# {directorio}/{version}/columnas.json          nombres de las features (orden de la matriz)
+# {directorio}/{version}/foto_mes=AAAAMM/
+#     features.npy   float32 (filas x features) en orden Fortran: cada
+#                    columna es contigua, así leer k features lee k columnas
+#     claves.npy     int32 (filas x 2): numero_de_cliente, foto_mes
+#     clase.npy      int8: código de clase_ternaria en CATEGORIAS_CLASE (-1 = sin clase)
+# {directorio}/version_actual.json   versión escrita por la última corrida de workflow A
+
+
+def version_fe(definicion: Dict[str, Any]) -> str:
+    """
+    Versión del FE: huella de todo lo que define las features (especificaciones,
+    parámetros y versión del código). Cambiar cualquiera crea otra versión
+    del store en lugar de mezclar meses calculados distinto.
+    """
+    return huella_valor(definicion)[:16]
+
+
+def _dir_mes(directorio: str, version: str, mes: int) -> str:
+    return os.path.join(directorio, version, f"foto_mes={int(mes)}")
+
+
+def version_actual(directorio: str) -> Optional[str]:
+    """
+    Versión marcada como actual (la última escrita por workflow A), o None.
+    """
+    ruta = os.path.join(directorio, ARCHIVO_ACTUAL)
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, "r") as f:
+        return json.load(f)['version']
+
+
+def _resolver_version(directorio: str, version: Optional[str]) -> str:
+    version = version or version_actual(directorio)
+    if version is None or not os.path.isdir(os.path.join(directorio, version)):
+        raise FileNotFoundError(f"No hay feature store en {directorio} (versión {version}); "
+                                f"correr workflow_A.py primero")
+    return version
+
+
+def columnas_store(directorio: str, version: Optional[str] = None) -> List[str]:
+    """
+    Features de una versión del store, en el orden de la matriz.
+    """
+    version = _resolver_version(directorio, version)
+    with open(os.path.join(directorio, version, ARCHIVO_COLUMNAS), "r") as f:
+        return json.load(f)
+
+
+def meses_disponibles(directorio: str, version: Optional[str] = None) -> List[int]:
+    """
+    foto_mes guardados en una versión del store.
+    """
+    version = _resolver_version(directorio, version)
+    return sorted(int(d.split("=")[1]) for d in os.listdir(os.path.join(directorio, version))
+                  if d.startswith("foto_mes="))
+
+
+def escribir_feature_store(rel: duckdb.DuckDBPyRelation,
+                           directorio: str,
+                           version: str,
+                           con: duckdb.DuckDBPyConnection,
+                           meses: Optional[List[int]] = None,
+                           actual: bool = True) -> List[int]:
+    """
+    Guarda en el store los meses de 'rel' (la salida del FE de workflow A),
+    un mes por vez. Cada mes reemplaza su partición, así se puede agregar un
+    mes nuevo o reescribir uno (ej. cuando cambia su clase) sin tocar el resto.
+
+    Args:
+        rel: Relación con claves, features y clase_ternaria
+        directorio: Raíz del feature store
+        version: Versión del FE (ver version_fe)
+        con: Conexión de la relación
+        meses: foto_mes a escribir (None = todos los de rel)
+        actual: Si es True marca 'version' como la versión actual
+
+    Returns:
+        list: foto_mes escritos
+    """
+    if meses is None:
+        meses = [int(m) for (m,) in rel.project("foto_mes").distinct().order("foto_mes").fetchall()]
+
+    base = os.path.join(directorio, version)
+    os.makedirs(base, exist_ok=True)
+    ruta_columnas = os.path.join(base, ARCHIVO_COLUMNAS)
+    columnas = None
+    if os.path.exists(ruta_columnas):
+        with open(ruta_columnas, "r") as f:
+            columnas = json.load(f)
+
+    for mes in meses:
+        df_mes = rel.filter(f"foto_mes = {int(mes)}").df()
+        candidatas = [c for c in df_mes.columns if c not in COLUMNAS_CLAVE and c != 'clase_ternaria']
+        numericas = [c for c in candidatas if pd.api.types.is_numeric_dtype(df_mes[c])]
+        if len(numericas) < len(candidatas):
+            logger.warning(f"Feature store: se omiten columnas no numéricas {sorted(set(candidatas) - set(numericas))}")
+        if columnas is None:
+            columnas = numericas
+            with open(ruta_columnas, "w") as f:
+                json.dump(columnas, f)
+        elif numericas != columnas:
+            raise ValueError(f"Las columnas de {mes} no coinciden con las de la versión {version} del store")
+
+        tmp = f"{_dir_mes(directorio, version, mes)}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        matriz = np.lib.format.open_memmap(os.path.join(tmp, "features.npy"), mode="w+", dtype=np.float32,
+                                           shape=(len(df_mes), len(columnas)), fortran_order=True)
+        for j, c in enumerate(columnas):
+            matriz[:, j] = df_mes[c].to_numpy(dtype=np.float32, na_value=np.nan)
+        matriz.flush()
+        del matriz
+
+        np.save(os.path.join(tmp, "claves.npy"), df_mes[COLUMNAS_CLAVE].to_numpy(dtype=np.int32))
+        np.save(os.path.join(tmp, "clase.npy"), codigos_clase(df_mes).astype(np.int8))
+
+        final = _dir_mes(directorio, version, mes)
+        shutil.rmtree(final, ignore_errors=True)
+        os.replace(tmp, final)
+        logger.info(f"Feature store {version}: {mes} guardado ({len(df_mes)} filas x {len(columnas)} features)")
+
+    if actual:
+        with open(os.path.join(directorio, ARCHIVO_ACTUAL), "w") as f:
+            json.dump({'version': version}, f)
+
+    return [int(m) for m in meses]
+
+
+def cargar_matriz(directorio: str,
+                  meses: List[int],
+                  features: Optional[List[str]] = None,
+                  version: Optional[str] = None,
+                  en_memoria: bool = False) -> Tuple[np.ndarray, List[str], np.ndarray, np.ndarray]:
+    """
+    Matriz float32 de (meses, features) leída del store sin recalcular nada.
+
+    Con un solo mes y todas las features devuelve el memmap del archivo tal
+    cual (sin copia). Si no, arma una matriz en orden Fortran leyendo de
+    cada mes sólo las columnas pedidas (cada una es un bloque contiguo).
+    Esa matriz se arma en un memmap sobre un archivo temporal de la versión
+    del store, que se borra enseguida (el mapeo sigue válido hasta liberar
+    la matriz): así varios meses no necesitan la matriz entera en RAM, el
+    sistema puede bajar páginas a disco. Con en_memoria=True se arma en RAM.
+
+    Args:
+        directorio: Raíz del feature store
+        meses: foto_mes a leer
+        features: Features a leer (None = todas, en el orden del store)
+        version: Versión (None = la actual)
+        en_memoria: Si es True arma la matriz en RAM en lugar de un memmap
+
+    Returns:
+        tuple: (matriz, nombres de columnas, claves int32 (n x 2), códigos de clase int8)
+    """
+    version = _resolver_version(directorio, version)
+    todas = columnas_store(directorio, version)
+    if features is None:
+        features = todas
+    posicion = {c: j for j, c in enumerate(todas)}
+    faltantes = [c for c in features if c not in posicion]
+    if faltantes:
+        raise KeyError(f"Features que no están en la versión {version} del store: {faltantes[:10]}")
+
+    disponibles = set(meses_disponibles(directorio, version))
+    sin_datos = [m for m in meses if int(m) not in disponibles]
+    if sin_datos:
+        raise FileNotFoundError(f"Meses que no están en la versión {version} del store: {sin_datos}")
+
+    mapas = [np.load(os.path.join(_dir_mes(directorio, version, m), "features.npy"), mmap_mode="r") for m in meses]
+    claves = np.concatenate([np.load(os.path.join(_dir_mes(directorio, version, m), "claves.npy")) for m in meses])
+    clase = np.concatenate([np.load(os.path.join(_dir_mes(directorio, version, m), "clase.npy")) for m in meses])
+
+    if len(mapas) == 1 and features == todas:
+        return mapas[0], list(features), claves, clase
+
+    idx = [posicion[c] for c in features]
+    if en_memoria:
+        matriz = np.empty((len(claves), len(idx)), dtype=np.float32, order="F")
+    else:
+        fd, ruta = tempfile.mkstemp(prefix="_matriz_", suffix=".npy", dir=os.path.join(directorio, version))
+        os.close(fd)
+        try:
+            matriz = np.lib.format.open_memmap(ruta, mode="w+", dtype=np.float32,
+                                               shape=(len(claves), len(idx)), fortran_order=True)
+        finally:
+            os.unlink(ruta)
+    fila = 0
+    for mapa in mapas:
+        n = mapa.shape[0]
+        for j, k in enumerate(idx):
+            matriz[fila:fila + n, j] = mapa[:, k]
+        fila += n
+
+    logger.info(f"Feature store {version}: {matriz.shape[0]} filas x {matriz.shape[1]} features de {list(meses)}")
+    return matriz, list(features), claves, clase
+
+
+def cargar_dataframe(directorio: str,
+                     meses: List[int],
+                     features: Optional[List[str]] = None,
+                     version: Optional[str] = None) -> pd.DataFrame:
+    """
+    DataFrame listo para entrenar/evaluar (claves, features y clase_ternaria
+    categórica) armado sobre cargar_matriz, sin copiar la matriz.
+    """
+    matriz, nombres, claves, clase = cargar_matriz(directorio, meses, features, version)
+    df = pd.DataFrame(matriz, columns=nombres, copy=False)
+    df.insert(0, 'numero_de_cliente', claves[:, 0])
+    df.insert(1, 'foto_mes', claves[:, 1])
+    df['clase_ternaria'] = pd.Categorical.from_codes(clase, categories=CATEGORIAS_CLASE)
+    return df
@@ -1,18 +1,68 @@
 import pandas as pd
 import duckdb
 import logging
-from typing import List, Optional
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+from .esquema import expresion_resta, tipos_columnas, es_tipo_numerico, es_monetaria, es_conteo
+from .pipeline import Datos, registrar_entrada, abrir_conexion, columnas_de
 
 logger = logging.getLogger(__name__)
 
-def obtener_columnas_validas(df: pd.DataFrame,
+## Especificación declarativa de las features históricas
+# lags / deltas: cantidad de meses hacia atrás (delta_k = col - col_lag_k)
+# rolling: ventanas N (en meses del cliente) para los 'estadisticos'
+#   (media, min, max, std, pendiente = tendencia lineal por mes,
+#    cv = coeficiente de variación std / |media|)
+# ratio_media: ventanas N para col / media de los últimos N meses
+# Eventos (sólo cantidades c* y montos m*; activo = valor no nulo y <> 0):
+#   recencia: horizonte H en meses del cliente (0 = no) para
+#     col_recencia = meses calendario desde el último mes activo (NULL si
+#       no hubo ninguno en los últimos H)
+#     col_racha_ceros = largo en meses de la racha actual de col = 0 (un
+#       NULL corta la racha; si no se corta en H, el largo de los H meses)
+#   activos: ventanas N para col_activos_N = meses activos de los últimos N
+ESPEC_VENTANAS = {
+    'lags': 0,
+    'deltas': 0,
+    'rolling': [],
+    'estadisticos': ['media', 'min', 'max', 'std'],
+    'ratio_media': [],
+    'recencia': 0,
+    'activos': [],
+}
+
+_ESTADISTICOS = {
+    'media': 'avg',
+    'min': 'min',
+    'max': 'max',
+    'std': 'stddev_samp',
+    'pendiente': None,  # forma cerrada en _expresion_rolling
+    'cv': 'stddev_samp',
+}
+
+# Estadísticos que salen DOUBLE de DuckDB y se guardan como FLOAT
+_ESTADISTICOS_FLOAT = {'media', 'std', 'pendiente', 'cv'}
+
+# Mes calendario como entero consecutivo
+_SQL_PERIODO = "((foto_mes // 100) * 12 + foto_mes % 100)"
+
+# x de la pendiente: meses desde enero de 2000, para que Σx² no cancele
+# dígitos al restarle (Σx)²/n
+_SQL_MES_PENDIENTE = f"CAST({_SQL_PERIODO} - 24000 AS DOUBLE)"
+
+def obtener_columnas_validas(df: Datos,
                              excluir: Optional[List[str]] = None) -> List[str]:
     """
     Devuelve la lista de columnas numéricas o válidas para feature engineering.
     
     Parameters
     ----------
-    df : pd.DataFrame
+    df : pd.DataFrame o relación DuckDB
         DataFrame con los datos
     excluir : list, optional
         Lista de columnas a excluir (por defecto: identificadores y targets)
@@ -25,27 +75,30 @@ def obtener_columnas_validas(df: pd.DataFrame,
     if excluir is None:
         excluir = ['numero_de_cliente', 'foto_mes', 'clase_ternaria', 'target']
     
-    columnas = [c for c in df.columns if c not in excluir]
+    columnas = [c for c in columnas_de(df) if c not in excluir]
     
     return columnas
 
-def feature_engineering_lag(df: pd.DataFrame, columnas: list[str], cant_lag: int = 1) -> pd.DataFrame:
+def feature_engineering_lag(df: Datos, columnas: list[str], cant_lag: int = 1,
+                            con: Optional[duckdb.DuckDBPyConnection] = None) -> Datos:
     """
     Genera variables de lag para los atributos especificados utilizando SQL.
   
     Parameters:
     -----------
-    df : pd.DataFrame
+    df : pd.DataFrame o relación DuckDB
         DataFrame con los datos
     columnas : list
         Lista de atributos para los cuales generar lags. Si es None, no se generan lags.
     cant_lag : int, default=1
         Cantidad de lags a generar para cada atributo
+    con : DuckDBPyConnection, optional
+        Conexión de la sesión (obligatoria si df es una relación)
   
     Returns:
     --------
-    pd.DataFrame
-        DataFrame con las variables de lag agregadas
+    pd.DataFrame o relación DuckDB
+        DataFrame con las variables de lag agregadas (relación si df era relación)
     """
 
     logger.info(f"Realizando feature engineering con {cant_lag} lags para {len(columnas) if columnas else 0} atributos")
@@ -53,54 +106,37 @@ def feature_engineering_lag(df: pd.DataFrame, columnas: list[str], cant_lag: int
     if columnas is None or len(columnas) == 0:
         logger.warning("No se especificaron atributos para generar lags")
         return df
-  
-    # Construir la consulta SQL
-    sql = "SELECT *"
-  
-    # Agregar los lags para los atributos especificados
-    for attr in columnas:
-        if attr in df.columns:
-            for i in range(1, cant_lag + 1):
-                sql += f", lag({attr}, {i}) OVER (PARTITION BY numero_de_cliente ORDER BY foto_mes) AS {attr}_lag_{i}"
-        else:
-            logger.warning(f"El atributo {attr} no existe en el DataFrame")
-  
-    # Completar la consulta
-    sql += " FROM df"
 
-    logger.debug(f"Consulta SQL: {sql}")
+    df = _aplicar_ventanas(df, columnas, {'lags': cant_lag}, con, "fe_lag",
+                           reordenar=False, solo_numericas=False)
 
-    # Ejecutar la consulta SQL
-    con = duckdb.connect(database=":memory:")
-    con.register("df", df)
-    df = con.execute(sql).df()
-    con.close()
-  
-    logger.info(f"Feature engineering completado. DataFrame resultante con {df.shape[1]} columnas")
+    logger.info(f"Feature engineering completado. DataFrame resultante con {len(columnas_de(df))} columnas")
 
     return df
 
-from typing import List, Optional
-
 def feature_engineering_delta(
-    df: pd.DataFrame,
+    df: Datos,
     columnas: Optional[List[str]],
-    cant_delta: int = 2
-) -> pd.DataFrame:
+    cant_delta: int = 2,
+    con: Optional[duckdb.DuckDBPyConnection] = None,
+) -> Datos:
     """
     Genera variables de delta (cambio absoluto) para los atributos especificados,
     usando SQL sobre ventanas por cliente ordenadas por foto_mes.
 
-    Delta 1: attr - lag(attr, 1)
-    Delta 2: attr - lag(attr, 2)
+    Delta k: attr - lag(attr, k)
+
+    Si el DataFrame ya tiene las columnas attr_lag_k (ej. de feature_engineering_lag),
+    el delta se calcula a partir de ellas sin volver a evaluar la ventana.
 
     Args:
         df: DataFrame base que contiene 'numero_de_cliente' y 'foto_mes'
         columnas: lista de atributos numéricos para generar deltas
-        cant_delta: cuántos deltas generar (máx 2; si pasás >2, se trunca a 2)
+        cant_delta: cuántos deltas generar (delta_1 ... delta_k)
+        con: conexión de la sesión (obligatoria si df es una relación)
 
     Returns:
-        DataFrame con las columnas delta agregadas.
+        DataFrame con las columnas delta agregadas (relación si df era relación).
     """
     logger.info(
         f"Generando deltas (hasta {cant_delta}) para "
@@ -111,65 +147,76 @@ def feature_engineering_delta(
         logger.warning("No se especificaron atributos para generar deltas")
         return df
 
-    # Aseguramos máximo 2 deltas (delta_1 y delta_2)
-    cant_delta = max(1, int(cant_delta))
-
-    # Construcción dinámica del SELECT
-    sql = ["SELECT *"]
-    for attr in columnas:
-        if attr not in df.columns:
-            logger.warning(f"El atributo '{attr}' no existe en el DataFrame; se omite.")
-            continue
-        # Delta 1
-        sql.append(
-            f", ({attr} - lag({attr}, 1) OVER (PARTITION BY numero_de_cliente ORDER BY foto_mes)) "
-            f"AS {attr}_delta_1"
-        )
-        # Delta 2 (solo si corresponde)
-        if cant_delta >= 2:
-            sql.append(
-                f", ({attr} - lag({attr}, 2) OVER (PARTITION BY numero_de_cliente ORDER BY foto_mes)) "
-                f"AS {attr}_delta_2"
-            )
-
-    # Si ninguna columna válida, devolvemos df sin cambios
-    if len(sql) == 1:
-        logger.warning("No se agregaron deltas porque no hubo atributos válidos.")
-        return df
-
-    query = " ".join(sql) + " FROM df"
+    df_out = _aplicar_ventanas(df, columnas, {'deltas': max(1, int(cant_delta))}, con, "fe_delta",
+                               reordenar=False, solo_numericas=True)
 
-    logger.debug(f"Consulta SQL (deltas): {query}")
-
-    con = duckdb.connect(database=":memory:")
-    try:
-        con.register("df", df)
-        df_out = con.execute(query).df()
-    finally:
-        con.close()
-
-    logger.info(f"Feature engineering (deltas) completado. Columnas ahora: {df_out.shape[1]}")
+    logger.info(f"Feature engineering (deltas) completado. Columnas ahora: {len(columnas_de(df_out))}")
     return df_out
 
 ## Opción mas eficiente con ayuda de GPT
 
 def feature_engineering_lag_delta(
-    df: pd.DataFrame,
+    df: Datos,
     columnas: Optional[List[str]] = None,
     cant_lag: int = 1,
     cant_delta: int = 2,
     con: Optional[duckdb.DuckDBPyConnection] = None,
-) -> pd.DataFrame:
+    motor: str = 'sql',
+    shards: int = 1,
+    hilos: Optional[int] = None,
+) -> Datos:
     """
     Genera en UNA SOLA QUERY:
       - lags:   col_lag_k
-      - deltas: col_delta_k = col - lag_k(col)
-    
+      - deltas: col_delta_k = col - col_lag_k
+
     Usando ventanas por numero_de_cliente ordenadas por foto_mes.
+    Si df es una relación de la sesión (con), devuelve otra relación sin
+    ejecutar nada; si es un DataFrame, devuelve un DataFrame.
+    Es feature_engineering_ventanas con sólo lags y deltas ('motor' elige
+    entre el SQL y el tensorial; 'shards' y 'hilos' parten la consulta SQL
+    por columnas).
+    """
+    return feature_engineering_ventanas(
+        df, columnas, {'lags': cant_lag, 'deltas': cant_delta}, con=con, motor=motor,
+        shards=shards, hilos=hilos
+    )
+
+
+def feature_engineering_ventanas(
+    df: Datos,
+    columnas: Optional[List[str]] = None,
+    espec: Optional[Dict] = None,
+    con: Optional[duckdb.DuckDBPyConnection] = None,
+    motor: str = 'sql',
+    shards: int = 1,
+    hilos: Optional[int] = None,
+) -> Datos:
+    """
+    Genera las features históricas descriptas en 'espec' (ver ESPEC_VENTANAS)
+    en una sola consulta sobre una única ventana nombrada por cliente:
+      - col_lag_k
+      - col_delta_k = col - col_lag_k (reutiliza las columnas de lag)
+      - col_{media,min,max,std}_N sobre los últimos N meses del cliente
+      - col_ratio_media_N = col / col_media_N
+      - col_recencia, col_racha_ceros y col_activos_N de las cantidades y montos
+
+    Args:
+        df: DataFrame o relación con 'numero_de_cliente' y 'foto_mes'
+        columnas: Atributos a procesar (None = obtener_columnas_validas)
+        espec: Especificación de ventanas (None = 1 lag y 2 deltas)
+        con: Conexión de la sesión (obligatoria si df es una relación)
+        motor: 'sql' (ventanas de DuckDB) o 'tensor' (arreglo cliente x mes x
+            atributo en NumPy, ver src.panel); mismo resultado, salvo el
+            último bit de los decimales (ver panel.verificar_motores)
+        shards: Con el motor SQL y shards > 1, los atributos se reparten en
+            esa cantidad de consultas que corren en paralelo (ver
+            _ventanas_por_shards); mismo resultado
+        hilos: Shards que corren a la vez (None = min(shards, cores))
+
+    Returns:
+        DataFrame (o relación, si df era relación) con las features agregadas
     """
-    # -----------------------------------------
-    # 1) Definir columnas a usar
-    # -----------------------------------------
     if columnas is None:
         columnas = obtener_columnas_validas(df)
 
@@ -177,80 +224,552 @@ def feature_engineering_lag_delta(
         logger.warning("No se especificaron columnas para FE; se devuelve df original.")
         return df
 
-    # Sólo numéricas para lags/deltas (evita bardear con strings)
-    numeric_cols = [
-        c for c in columnas
-        if c in df.columns and pd.api.types.is_numeric_dtype(df[c])
-    ]
-    if not numeric_cols:
-        logger.warning("No hay columnas numéricas válidas para generar lags/deltas.")
-        return df
+    if espec is None:
+        espec = {'lags': 1, 'deltas': 2}
+
+    if motor == 'tensor':
+        from .panel import ventanas_tensor
+        df_out = ventanas_tensor(df, columnas, espec, con=con, reordenar=True)
+    elif motor == 'sql' and shards > 1:
+        df_out = _ventanas_por_shards(df, columnas, espec, con, shards, hilos)
+    elif motor == 'sql':
+        df_out = _aplicar_ventanas(df, columnas, espec, con, "fe_hist",
+                                   reordenar=True, solo_numericas=True)
+    else:
+        raise ValueError(f"Motor desconocido: {motor} (usar 'sql' o 'tensor')")
+
+    logger.info(f"FE completado. Columnas: {len(columnas_de(df_out))}")
 
-    cant_lag = max(0, int(cant_lag))
-    cant_delta = min(2, max(0, int(cant_delta)))  # acotamos deltas a 0–2
+    return df_out
+
+
+def normalizar_espec(espec: Dict) -> Dict:
+    """
+    Completa la especificación con los valores de ESPEC_VENTANAS y valida
+    claves y estadísticos.
+    """
+    desconocidas = set(espec) - set(ESPEC_VENTANAS)
+    if desconocidas:
+        raise ValueError(f"Claves de espec desconocidas: {sorted(desconocidas)}")
+
+    normal = {**ESPEC_VENTANAS, **{k: v for k, v in espec.items() if v is not None}}
+    normal['lags'] = max(0, int(normal['lags']))
+    normal['deltas'] = max(0, int(normal['deltas']))
+    normal['rolling'] = sorted({int(n) for n in normal['rolling'] if int(n) > 1})
+    normal['ratio_media'] = sorted({int(n) for n in normal['ratio_media'] if int(n) > 1})
+    normal['recencia'] = max(0, int(normal['recencia']))
+    normal['activos'] = sorted({int(n) for n in normal['activos'] if int(n) > 1})
+
+    invalidos = [e for e in normal['estadisticos'] if e not in _ESTADISTICOS]
+    if invalidos:
+        raise ValueError(f"Estadísticos desconocidos: {invalidos} (válidos: {list(_ESTADISTICOS)})")
+
+    return normal
+
+
+def _aplicar_ventanas(df: Datos,
+                      columnas: List[str],
+                      espec: Dict,
+                      con: Optional[duckdb.DuckDBPyConnection],
+                      prefijo: str,
+                      reordenar: bool,
+                      solo_numericas: bool) -> Datos:
+    """
+    Registra la entrada, compila la consulta de ventanas y la ejecuta (o la
+    deja como relación si la entrada era una relación).
+    """
+    con, own_con = abrir_conexion(df, con)
+    tabla, es_relacion = registrar_entrada(df, con, prefijo)
+    tipos = tipos_columnas(con, tabla)
+
+    query = consulta_ventanas(tabla, tipos, columnas, espec,
+                              reordenar=reordenar, solo_numericas=solo_numericas)
+
+    try:
+        if query is None:
+            df_out = df
+        elif es_relacion:
+            df_out = con.sql(query)
+        else:
+            df_out = con.execute(query).df()
+        if not es_relacion:
+            con.unregister(tabla)
+    finally:
+        if own_con:
+            con.close()
+
+    return df_out
+
+
+def planificar_ventanas(tipos: dict,
+                        columnas: List[str],
+                        espec: Dict,
+                        reordenar: bool = True,
+                        solo_numericas: bool = True) -> Optional[Dict]:
+    """
+    Resuelve la especificación contra las columnas de la entrada: qué
+    columnas base se conservan y qué features se generan, en orden de salida.
+    Lo comparten la compilación SQL y el motor tensorial (src.panel).
+
+    Args:
+        tipos: {columna: tipo SQL} de la entrada (ver tipos_columnas)
+        columnas: Atributos candidatos
+        espec: Especificación de ventanas (ver ESPEC_VENTANAS)
+        reordenar: Si es True, las columnas base salen como claves, no
+            procesadas y procesadas; si es False, en el orden de la entrada
+        solo_numericas: Si es False, también se generan lags de columnas no
+            numéricas (deltas, rolling y ratios son siempre numéricos)
+
+    Returns:
+        dict: Plan con 'espec', 'base', 'numericas', 'lags_internos', 'lags',
+        'deltas', 'rolling', 'medias_auxiliares', 'ratios', 'recencia' y
+        'activos'; None si no hay nada para generar
+    """
+    espec = normalizar_espec(espec)
+
+    for c in columnas:
+        if c not in tipos:
+            logger.warning(f"El atributo '{c}' no existe en el DataFrame; se omite.")
+
+    numeric_cols = [c for c in columnas if c in tipos and es_tipo_numerico(tipos[c])]
+    lag_cols = numeric_cols if solo_numericas else [c for c in columnas if c in tipos]
+    if not lag_cols:
+        logger.warning("No hay columnas numéricas válidas para generar lags/deltas.")
+        return None
 
     logger.info(
-        f"FE: {len(numeric_cols)} columnas numéricas | "
-        f"{cant_lag} lags | {cant_delta} deltas"
+        f"FE: {len(lag_cols)} columnas | {espec['lags']} lags | {espec['deltas']} deltas | "
+        f"rolling {espec['rolling']} {espec['estadisticos'] if espec['rolling'] else ''} | "
+        f"ratio_media {espec['ratio_media']} | recencia {espec['recencia']} | activos {espec['activos']}"
     )
 
-    # -----------------------------------------
-    # 2) Armar conexión (reutilizable)
-    # -----------------------------------------
-    own_con = False
-    if con is None:
-        con = duckdb.connect(database=":memory:")
-        own_con = True
-
-    # Registramos df UNA sola vez
-    con.register("df", df)
-
-    # -----------------------------------------
-    # 3) Construir query eficiente
-    #    Sin SELECT *, sólo lo necesario
-    # -----------------------------------------
-    # columnas base que queremos preservar
-    base_cols = ['numero_de_cliente', 'foto_mes']
-    base_cols += [c for c in df.columns if c not in base_cols and c not in numeric_cols]
-    base_cols += numeric_cols
-    # quitamos duplicados preservando orden
-    seen = set()
-    base_cols = [c for c in base_cols if not (c in seen or seen.add(c))]
-
-    select_parts = [", ".join(base_cols)]
-
-    # Lags
+    # Columnas base que se preservan
+    if reordenar:
+        base_cols = ['numero_de_cliente', 'foto_mes']
+        base_cols += [c for c in tipos if c not in base_cols and c not in numeric_cols]
+        base_cols += numeric_cols
+        # quitamos duplicados preservando orden
+        seen = set()
+        base_cols = [c for c in base_cols if not (c in seen or seen.add(c))]
+    else:
+        base_cols = list(tipos)
+
+    plan = {
+        'espec': espec,
+        'base': base_cols,
+        'numericas': numeric_cols,
+        'lags_internos': [],
+        'lags': [],
+        'deltas': [],
+        'rolling': [],
+        'medias_auxiliares': [],
+        'ratios': [],
+        'recencia': [],
+        'activos': [],
+    }
+
+    # Lags (los que piden los deltas también, aunque no salgan como feature)
+    for col in lag_cols:
+        max_k = max(espec['lags'], espec['deltas'] if col in numeric_cols else 0)
+        for k in range(1, max_k + 1):
+            if f"{col}_lag_{k}" not in tipos:
+                plan['lags_internos'].append((col, k))
+                if k <= espec['lags']:
+                    plan['lags'].append((col, k))
+
+    medias_auxiliares = [n for n in espec['ratio_media']
+                         if n not in espec['rolling'] or 'media' not in espec['estadisticos']]
     for col in numeric_cols:
-        for k in range(1, cant_lag + 1):
-            select_parts.append(
-                f"lag({col}, {k}) OVER (PARTITION BY numero_de_cliente ORDER BY foto_mes) "
-                f"AS {col}_lag_{k}"
-            )
+        plan['deltas'] += [(col, k) for k in range(1, espec['deltas'] + 1)]
+        plan['rolling'] += [(col, est, n) for n in espec['rolling'] for est in espec['estadisticos']]
+        plan['medias_auxiliares'] += [(col, n) for n in medias_auxiliares]
+        plan['ratios'] += [(col, n) for n in espec['ratio_media']]
+        if es_conteo(col) or es_monetaria(col):
+            plan['recencia'] += [col] if espec['recencia'] else []
+            plan['activos'] += [(col, n) for n in espec['activos']]
 
-    # Deltas
-    for col in numeric_cols:
-        for k in range(1, cant_delta + 1):
-            select_parts.append(
-                f"({col} - lag({col}, {k}) OVER (PARTITION BY numero_de_cliente ORDER BY foto_mes)) "
-                f"AS {col}_delta_{k}"
-            )
+    if not (plan['lags_internos'] or plan['deltas'] or plan['rolling'] or plan['ratios']
+            or plan['recencia'] or plan['activos']):
+        logger.warning("La especificación no genera ninguna feature nueva.")
+        return None
+
+    return plan
+
+
+def nombres_plan(plan: Dict) -> List[str]:
+    """
+    Nombres de las features nuevas de un plan, en orden de salida.
+    """
+    return ([f"{c}_lag_{k}" for c, k in plan['lags']]
+            + [f"{c}_delta_{k}" for c, k in plan['deltas']]
+            + [f"{c}_{est}_{n}" for c, est, n in plan['rolling']]
+            + [f"{c}_ratio_media_{n}" for c, n in plan['ratios']]
+            + [f"{c}_{f}" for c in plan['recencia'] for f in ('recencia', 'racha_ceros')]
+            + [f"{c}_activos_{n}" for c, n in plan['activos']])
+
+
+def consulta_ventanas(tabla: str,
+                      tipos: dict,
+                      columnas: List[str],
+                      espec: Dict,
+                      reordenar: bool = True,
+                      solo_numericas: bool = True) -> Optional[str]:
+    """
+    Compila la especificación de ventanas en una consulta.
+
+    Todas las funciones de ventana de la consulta interna usan la misma
+    ventana nombrada (WINDOW w), así DuckDB ordena una sola vez por
+    cliente/mes; las rolling sólo agregan un frame sobre w. La consulta
+    externa arma los deltas y ratios como aritmética sobre las columnas ya
+    calculadas (col - col_lag_k, col / col_media_N).
+
+    Args:
+        tabla: Nombre de la tabla/vista de entrada
+        tipos: {columna: tipo SQL} de la entrada (ver tipos_columnas)
+        columnas: Atributos candidatos
+        espec: Especificación de ventanas (ver ESPEC_VENTANAS)
+        reordenar: Ver planificar_ventanas
+        solo_numericas: Ver planificar_ventanas
+
+    Returns:
+        str: Consulta SQL, o None si no hay nada para generar
+    """
+    plan = planificar_ventanas(tipos, columnas, espec, reordenar, solo_numericas)
+    if plan is None:
+        return None
+    return sql_desde_plan(tabla, tipos, plan)
+
+
+def sql_desde_plan(tabla: str, tipos: dict, plan: Dict) -> str:
+    """
+    Arma la consulta SQL (interna con la ventana nombrada, externa con la
+    aritmética) de un plan de planificar_ventanas.
+    """
+    interior = ["*"]
+    interior += [f"lag({c}, {k}) OVER w AS {c}_lag_{k}" for c, k in plan['lags_internos']]
+    interior += [_expresion_rolling(c, est, n, f"{c}_{est}_{n}") for c, est, n in plan['rolling']]
+    interior += [_expresion_rolling(c, 'media', n, f"{c}_media_{n}") for c, n in plan['medias_auxiliares']]
+    interior += [_expresion_evento(c, f, plan['espec']['recencia']) for c in plan['recencia']
+                 for f in ('recencia', 'racha_ceros')]
+    interior += [_expresion_evento(c, 'activos', n) for c, n in plan['activos']]
+
+    exterior = list(plan['base'])
+    exterior += [f"{c}_lag_{k}" for c, k in plan['lags']]
+    exterior += [f"{expresion_resta(c, tipos[c], f'{c}_lag_{k}')} AS {c}_delta_{k}" for c, k in plan['deltas']]
+    exterior += [f"{c}_{est}_{n}" for c, est, n in plan['rolling']]
+    exterior += [f"CAST({c} / NULLIF({c}_media_{n}, 0) AS FLOAT) AS {c}_ratio_media_{n}"
+                 for c, n in plan['ratios']]
+    exterior += [f"{c}_{f}" for c in plan['recencia'] for f in ('recencia', 'racha_ceros')]
+    exterior += [f"{c}_activos_{n}" for c, n in plan['activos']]
 
     query = f"""
         SELECT
-            {", ".join(select_parts)}
-        FROM df
+            {", ".join(exterior)}
+        FROM (
+            SELECT
+                {", ".join(interior)}
+            FROM {tabla}
+            WINDOW w AS (PARTITION BY numero_de_cliente ORDER BY foto_mes)
+        )
     """
 
     logger.debug(f"Consulta SQL FE:\n{query[:1000]}...")  # log parcial si es muy larga
 
-    # -----------------------------------------
-    # 4) Ejecutar
-    # -----------------------------------------
-    df_out = con.execute(query).df()
+    return query
 
-    if own_con:
-        con.close()
 
-    logger.info(f"FE completado. Filas: {df_out.shape[0]} | Columnas: {df_out.shape[1]}")
+def _expresion_rolling(col: str, estadistico: str, n: int, nombre: str) -> str:
+    """
+    Estadístico de los últimos 'n' meses del cliente (incluido el actual)
+    como frame sobre la ventana nombrada w. El coeficiente de variación es
+    std / |media| (NULL si la media es 0).
+
+    La pendiente es la de la regresión lineal contra el mes calendario, en
+    forma cerrada a partir de sumas de la ventana:
+    Σ(x - x̄)y / Σ(x - x̄)² = (Σxy - ΣxΣy/c) / (Σx² - (Σx)²/c), con x sólo
+    en los meses en que la columna no es NULL y c su cantidad. Es NULL con
+    menos de dos meses y 0 exacto si el valor es constante, como en el motor
+    tensor (panel._rolling).
+    """
+    frame = f"OVER (w ROWS BETWEEN {n - 1} PRECEDING AND CURRENT ROW)"
+    if estadistico == 'pendiente':
+        x = f"CASE WHEN {col} IS NOT NULL THEN {_SQL_MES_PENDIENTE} END"
+        cuenta = f"count({col}) {frame}"
+        sx = f"sum({x}) {frame}"
+        sy = f"sum(CAST({col} AS DOUBLE)) {frame}"
+        sxx = f"sum({x} * {x}) {frame}"
+        sxy = f"sum(CAST({col} AS DOUBLE) * {_SQL_MES_PENDIENTE}) {frame}"
+        expr = (f"CASE WHEN {cuenta} < 2 THEN NULL "
+                f"WHEN min({col}) {frame} = max({col}) {frame} THEN 0 "
+                f"ELSE ({sxy} - {sx} * {sy} / {cuenta}) / NULLIF({sxx} - {sx} * {sx} / {cuenta}, 0) END")
+    elif estadistico == 'cv':
+        expr = f"stddev_samp({col}) {frame} / NULLIF(abs(avg({col}) {frame}), 0)"
+    else:
+        expr = f"{_ESTADISTICOS[estadistico]}({col}) {frame}"
+    if estadistico in _ESTADISTICOS_FLOAT:
+        expr = f"CAST({expr} AS FLOAT)"
+    return f"{expr} AS {nombre}"
+
+
+def _expresion_evento(col: str, feature: str, n: int) -> str:
+    """
+    Features de eventos sobre los últimos 'n' meses del cliente, como
+    agregados de un frame sobre la ventana nombrada w (la misma pasada
+    ordenada que lags y rolling, sin importar cuántas columnas se sigan):
+    el último mes activo (o que corta la racha) es el máximo del mes
+    calendario entre los meses que cumplen la condición.
+    """
+    frame = f"OVER (w ROWS BETWEEN {n - 1} PRECEDING AND CURRENT ROW)"
+    if feature == 'recencia':
+        expr = f"{_SQL_PERIODO} - max(CASE WHEN {col} <> 0 THEN {_SQL_PERIODO} END) {frame}"
+    elif feature == 'racha_ceros':
+        corte = f"max(CASE WHEN {col} IS DISTINCT FROM 0 THEN {_SQL_PERIODO} END) {frame}"
+        expr = f"{_SQL_PERIODO} - coalesce({corte}, min({_SQL_PERIODO}) {frame} - 1)"
+    else:
+        expr = f"count(CASE WHEN {col} <> 0 THEN 1 END) {frame}"
+    nombre = f"{col}_activos_{n}" if feature == 'activos' else f"{col}_{feature}"
+    return f"CAST({expr} AS SMALLINT) AS {nombre}"
+
+
+## Modo por shards de columnas: una consulta por grupo de atributos
+
+def _ventanas_por_shards(df: Datos,
+                         columnas: List[str],
+                         espec: Dict,
+                         con: Optional[duckdb.DuckDBPyConnection],
+                         shards: int,
+                         hilos: Optional[int]) -> Datos:
+    """
+    Motor SQL partido por columnas: en lugar de una sola consulta con todas
+    las expresiones de ventana, los atributos se reparten en 'shards' grupos
+    y cada grupo es su propia consulta (planes chicos, resultados chicos).
+
+    Cada shard corre en un cursor propio (en paralelo, hasta 'hilos' a la
+    vez), lee de la entrada sólo sus atributos y guarda las claves y sus
+    features en una tabla de DuckDB (que puede ir a disco). El resultado
+    une la entrada con las tablas de los shards por (numero_de_cliente,
+    foto_mes) dentro de DuckDB, con las columnas en el mismo orden que el
+    motor SQL, así que nada pasa por Python. Con una relación de entrada
+    se devuelve esa unión sin ejecutar y las tablas de los shards quedan en
+    la sesión; la entrada se lee una vez por shard, así que conviene que
+    sea barata de releer (ej. el Parquet del cache de etapas).
+
+    Por shard se loguea el tiempo y el pico de memoria de DuckDB muestreado
+    mientras corre (con hilos > 1 el pico incluye a los shards que corren a
+    la vez).
+    """
+    con, own_con = abrir_conexion(df, con)
+    tabla, es_relacion = registrar_entrada(df, con, "fe_shards")
+    tipos = tipos_columnas(con, tabla)
+
+    plan = planificar_ventanas(tipos, columnas, espec, reordenar=True, solo_numericas=True)
+    if plan is None:
+        if not es_relacion:
+            con.unregister(tabla)
+        if own_con:
+            con.close()
+        return df
+
+    numericas = plan['numericas']
+    tam = -(-len(numericas) // max(1, shards))
+    grupos = [numericas[i:i + tam] for i in range(0, len(numericas), tam)]
+    hilos = hilos or min(len(grupos), os.cpu_count() or 1)
+
+    # Un grupo puede no generar nada (ej. sólo atributos sin recencia/activos
+    # y sin lags): ese shard se saltea. Las tablas de los shards no son TEMP
+    # para que las vean los cursores
+    consultas, destinos, con_features = [], [], []
+    for grupo in grupos:
+        plan_shard = planificar_ventanas(tipos, grupo, espec, reordenar=True, solo_numericas=True)
+        if plan_shard is None:
+            continue
+        plan_shard['base'] = ['numero_de_cliente', 'foto_mes']
+        destino = f"{tabla}_shard_{len(destinos)}"
+        consultas.append(f"CREATE OR REPLACE TABLE {destino} AS {sql_desde_plan(tabla, tipos, plan_shard)}")
+        destinos.append(destino)
+        con_features.append((grupo, len(nombres_plan(plan_shard))))
+    grupos = con_features
+
+    # El muestreo y los shards comparten 'picos': se actualiza bajo un lock
+    picos = {}
+    lock_picos = threading.Lock()
+    terminado = threading.Event()
+
+    def muestrear():
+        cur = con.cursor()
+        try:
+            while not terminado.is_set():
+                usada = cur.execute("SELECT sum(memory_usage_bytes) FROM duckdb_memory()").fetchone()[0] or 0
+                with lock_picos:
+                    for i in picos:
+                        picos[i] = max(picos[i], usada)
+                terminado.wait(0.05)
+        except Exception as e:
+            logger.warning(f"FE shards: se detiene el muestreo de memoria ({e})")
+        finally:
+            cur.close()
+
+    def correr(i: int, query: str):
+        cur = con.cursor()
+        with lock_picos:
+            picos[i] = 0
+        inicio = time.time()
+        try:
+            # Los DataFrames registrados son de una sola conexión: cada
+            # cursor registra el mismo, sin copiarlo
+            if not es_relacion:
+                cur.register(tabla, df)
+            cur.execute(query)
+        finally:
+            cur.close()
+        with lock_picos:
+            pico = picos.pop(i)
+        atributos, n_features = grupos[i]
+        logger.info(f"FE shard {i + 1}/{len(consultas)}: {len(atributos)} atributos, "
+                    f"{n_features} features en {time.time() - inicio:.1f}s | "
+                    f"pico DuckDB {pico / 1024 ** 2:,.1f} MB")
+
+    muestreo = threading.Thread(target=muestrear, daemon=True)
+    muestreo.start()
+    try:
+        with ThreadPoolExecutor(max_workers=hilos) as pool:
+            list(pool.map(correr, range(len(consultas)), consultas))
+    except BaseException:
+        for destino in destinos:
+            con.execute(f"DROP TABLE IF EXISTS {destino}")
+        raise
+    finally:
+        terminado.set()
+        muestreo.join()
+
+    nombres = plan['base'] + nombres_plan(plan)
+    uniones = "".join(f" JOIN {d} USING (numero_de_cliente, foto_mes)" for d in destinos)
+    df_out = con.sql(f"SELECT {', '.join(nombres)} FROM {tabla}{uniones}")
+
+    if not es_relacion:
+        try:
+            df_out = df_out.df()
+        finally:
+            for destino in destinos:
+                con.execute(f"DROP TABLE IF EXISTS {destino}")
+            con.unregister(tabla)
+            if own_con:
+                con.close()
 
     return df_out
+
+
+## Modo streaming: buckets de clientes en procesos separados
+
+def _procesar_bucket(entrada: str,
+                     salida: str,
+                     query: str,
+                     memory_limit: Optional[str],
+                     threads: int) -> Tuple[str, int]:
+    """
+    Corre la consulta de ventanas sobre un bucket de clientes en una
+    conexión propia (dentro de un proceso del pool) y lo escribe en 'salida'.
+    """
+    con = duckdb.connect(database=":memory:")
+    try:
+        con.execute(f"SET threads = {int(threads)}")
+        con.execute("SET preserve_insertion_order = false")
+        if memory_limit is not None:
+            con.execute(f"SET memory_limit = '{memory_limit}'")
+        con.execute(f"CREATE VIEW bucket_entrada AS SELECT * FROM read_parquet('{entrada}/*.parquet')")
+        con.execute(f"COPY ({query}) TO '{salida}' (FORMAT PARQUET, COMPRESSION zstd)")
+        filas = con.execute(f"SELECT count(*) FROM read_parquet('{salida}')").fetchone()[0]
+    finally:
+        con.close()
+    return salida, filas
+
+
+def feature_engineering_ventanas_por_buckets(
+    fuente: str,
+    salida: str,
+    columnas: Optional[List[str]] = None,
+    espec: Optional[Dict] = None,
+    n_buckets: int = 16,
+    n_procesos: Optional[int] = None,
+    memory_limit: Optional[str] = None,
+    threads_por_proceso: int = 1,
+) -> str:
+    """
+    Versión streaming de feature_engineering_ventanas para datasets que no
+    entran en memoria.
+
+    Como todas las ventanas son PARTITION BY numero_de_cliente, los clientes
+    se reparten en 'n_buckets' por hash y cada bucket se procesa por separado
+    en un pool de procesos. El pico de memoria depende del tamaño del bucket
+    y no del dataset. Cada bucket se escribe como un archivo más del dataset
+    de salida (un directorio de Parquet).
+
+    Args:
+        fuente: Archivo, glob o directorio Parquet de entrada
+        salida: Directorio del dataset de salida (se reemplaza si existe)
+        columnas: Atributos a procesar (None = obtener_columnas_validas)
+        espec: Especificación de ventanas (ver ESPEC_VENTANAS)
+        n_buckets: Cantidad de buckets de clientes
+        n_procesos: Procesos del pool (None = os.cpu_count())
+        memory_limit: Límite de memoria de DuckDB por proceso (ej. '4GB')
+        threads_por_proceso: Threads de DuckDB por proceso
+
+    Returns:
+        str: Directorio de salida
+    """
+    if os.path.isdir(fuente):
+        fuente = os.path.join(fuente, "*.parquet")
+    if espec is None:
+        espec = {'lags': 1, 'deltas': 2}
+    n_procesos = n_procesos or os.cpu_count() or 1
+
+    tmp_buckets = f"{salida}.buckets"
+    tmp_salida = f"{salida}.tmp"
+    for d in (tmp_buckets, tmp_salida):
+        shutil.rmtree(d, ignore_errors=True)
+    os.makedirs(tmp_salida)
+
+    # 1) Repartir la entrada por bucket en una sola pasada (streaming en DuckDB)
+    con = duckdb.connect(database=":memory:")
+    try:
+        if memory_limit is not None:
+            con.execute(f"SET memory_limit = '{memory_limit}'")
+        con.execute(f"CREATE VIEW bucket_entrada AS SELECT * FROM read_parquet('{fuente}')")
+        tipos = tipos_columnas(con, "bucket_entrada")
+        if columnas is None:
+            columnas = obtener_columnas_validas(con.table("bucket_entrada"))
+        query = consulta_ventanas("bucket_entrada", tipos, columnas, espec)
+        if query is None:
+            raise ValueError("La especificación no genera features sobre las columnas dadas")
+        con.execute(f"""
+            COPY (SELECT *, hash(numero_de_cliente) % {int(n_buckets)} AS bucket FROM bucket_entrada)
+            TO '{tmp_buckets}' (FORMAT PARQUET, PARTITION_BY (bucket))
+        """)
+    finally:
+        con.close()
+
+    # 2) Ventanas por bucket en paralelo; cada bucket es un archivo de salida
+    buckets = sorted(d for d in os.listdir(tmp_buckets) if d.startswith("bucket="))
+    logger.info(f"FE por buckets: {len(buckets)} buckets en {n_procesos} procesos")
+
+    total = 0
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=n_procesos, mp_context=ctx) as pool:
+        futuros = [
+            pool.submit(_procesar_bucket,
+                        os.path.join(tmp_buckets, b),
+                        os.path.join(tmp_salida, f"parte_{b.split('=')[1]}.parquet"),
+                        query, memory_limit, threads_por_proceso)
+            for b in buckets
+        ]
+        for futuro in as_completed(futuros):
+            archivo, filas = futuro.result()
+            total += filas
+            logger.debug(f"Bucket escrito: {os.path.basename(archivo)} ({filas} filas)")
+
+    shutil.rmtree(tmp_buckets, ignore_errors=True)
+    shutil.rmtree(salida, ignore_errors=True)
+    os.replace(tmp_salida, salida)
+
+    logger.info(f"FE por buckets completado: {total} filas en {salida}")
+    return salida
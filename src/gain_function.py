@@ -101,4 +101,36 @@ def ganancia_pesos(y_pred, data):
     ganancia = ganancia[np.argsort(y_pred)[::-1]]
     ganancia = np.cumsum(ganancia)
 
-    return 'gan_eval', np.max(ganancia) , True
\ No newline at end of file
+    return 'gan_eval', np.max(ganancia) , True
+
+def crear_ganancia_filas(ganancia: np.ndarray):
+    """
+    Crea una feval de LightGBM que lee la ganancia de cada fila de un arreglo
+    precalculado (ver loader.codificar_clase) en lugar de decodificarla del peso.
+
+    En lgb.cv cada fold es un subset del Dataset original con 'used_indices',
+    así que la ganancia del fold se toma de esas posiciones. El recorte se
+    guarda por dataset para no repetirlo en cada iteración.
+
+    Args:
+        ganancia: Ganancia por fila del Dataset completo (GANANCIA_ACIERTO / -COSTO_ESTIMULO,
+            o escalada por fila si el Dataset es una muestra)
+
+    Returns:
+        callable: feval (y_pred, data) -> ('gan_eval', ganancia máxima, True)
+    """
+    ganancia = np.asarray(ganancia)
+    # Con undersampling la ganancia de CONTINUA viene escalada (float)
+    acumulador = np.int64 if np.issubdtype(ganancia.dtype, np.integer) else np.float64
+    recortes = {}
+
+    def ganancia_filas(y_pred, data):
+        gan = recortes.get(id(data))
+        if gan is None:
+            indices = getattr(data, 'used_indices', None)
+            gan = ganancia if indices is None else ganancia[np.asarray(indices)]
+            recortes[id(data)] = gan
+        acumulada = np.cumsum(gan[np.argsort(y_pred)[::-1]], dtype=acumulador)
+        return 'gan_eval', float(np.max(acumulada)), True
+
+    return ganancia_filas
@@ -0,0 +1,165 @@
+import logging
+import weakref
+import numpy as np
+from typing import Dict
+from .config import GANANCIA_ACIERTO, COSTO_ESTIMULO, GANANCIA_TOPE
+from .gain_function import ganancia_evaluator
+
+logger = logging.getLogger(__name__)
+
+## Ganancia máxima con selección parcial
+# La ganancia óptima se alcanza dentro de los primeros envíos (las filas con
+# mayor probabilidad), así que alcanza con ordenar las k primeras: argpartition
+# las separa en O(n) y sólo se ordenan esas k. El resultado es el mismo que con
+# el orden completo de gain_function.ganancia_pesos, y se verifica en cada
+# llamada; si no se puede garantizar, se usa el orden completo:
+#   - empates de probabilidad entre filas de distinta ganancia dentro de las k
+#     (el máximo dependería de cómo el sort ordena los empates)
+#   - empates en el corte (el grupo de la k-ésima sigue fuera de la selección)
+#   - que las filas siguientes puedan superar el máximo: la ganancia acumulada
+#     en k más todas las ganancias positivas restantes lo supera
+
+
+def filas_tope(n: int, tope=None) -> int:
+    """
+    Filas que se ordenan: 'tope' como fracción de n si es < 1 o como
+    cantidad si es >= 1 (None = GANANCIA_TOPE; 0/null = todas).
+    """
+    tope = GANANCIA_TOPE if tope is None else tope
+    if not tope:
+        return n
+    k = int(np.ceil(tope * n)) if tope < 1 else int(tope)
+    return min(n, max(1, k))
+
+
+def preparar_ganancia(ganancia: np.ndarray, tope=None) -> Dict:
+    """
+    Estado de la métrica para un conjunto de filas fijo (ej. un fold): la
+    ganancia por fila, su total positivo, k y los buffers que se reusan en
+    cada ronda.
+    """
+    ganancia = np.asarray(ganancia)
+    n = len(ganancia)
+    k = filas_tope(n, tope)
+    acumulador = np.int64 if np.issubdtype(ganancia.dtype, np.integer) else np.float64
+    return {
+        'ganancia': ganancia,
+        'acumulador': acumulador,
+        'positivos': np.maximum(ganancia, 0).sum(dtype=acumulador),
+        'k': k,
+        'negada': np.empty(n, dtype=np.float64),
+        'corte': np.empty(n, dtype=bool),
+        'ganancia_k': np.empty(k, dtype=ganancia.dtype),
+        'acumulada_k': np.empty(k, dtype=acumulador),
+    }
+
+
+def ganancia_completa(y_pred: np.ndarray, estado: Dict):
+    """
+    Ganancia máxima con el orden completo (la cuenta de ganancia_pesos).
+    """
+    orden = np.argsort(y_pred)[::-1]
+    return np.max(np.cumsum(estado['ganancia'][orden], dtype=estado['acumulador']))
+
+
+def ganancia_topk(y_pred: np.ndarray, estado: Dict):
+    """
+    Ganancia máxima ordenando sólo las k filas de mayor probabilidad, o None
+    si con ellas no se puede garantizar el mismo resultado que el orden
+    completo (ver arriba).
+    """
+    k, n = estado['k'], len(y_pred)
+    if k >= n:
+        return None
+
+    negada = np.negative(y_pred, out=estado['negada'])
+    elegidas = np.argpartition(negada, k - 1)[:k]
+    valores = negada[elegidas]
+
+    # Empates en el corte: otras filas con la misma probabilidad que la k-ésima
+    # (argpartition la deja última), antes de ordenar
+    if np.count_nonzero(np.less_equal(negada, valores[-1], out=estado['corte'])) != k:
+        return None
+
+    orden = np.argsort(valores)
+    elegidas, valores = elegidas[orden], valores[orden]
+
+    ganancia_k = np.take(estado['ganancia'], elegidas, out=estado['ganancia_k'])
+    # Empates entre filas de distinta ganancia
+    if np.any((valores[1:] == valores[:-1]) & (ganancia_k[1:] != ganancia_k[:-1])):
+        return None
+
+    acumulada = np.cumsum(ganancia_k, dtype=estado['acumulador'], out=estado['acumulada_k'])
+    maxima = acumulada.max()
+    restantes = estado['positivos'] - np.maximum(ganancia_k, 0).sum(dtype=estado['acumulador'])
+    if acumulada[-1] + restantes > maxima:
+        return None
+    return maxima
+
+
+def ganancia_maxima(y_pred: np.ndarray, estado: Dict):
+    """
+    Ganancia máxima de enviar a los primeros según y_pred: ganancia_topk, o
+    el orden completo si no la garantiza.
+    """
+    maxima = ganancia_topk(y_pred, estado)
+    return ganancia_completa(y_pred, estado) if maxima is None else maxima
+
+
+def crear_ganancia_topk(ganancia: np.ndarray, tope=None):
+    """
+    Como gain_function.crear_ganancia_filas (misma ganancia máxima) pero con
+    ganancia_maxima y buffers preparados una vez por fold.
+
+    Args:
+        ganancia: Ganancia por fila del Dataset completo
+        tope: Filas que se ordenan (ver filas_tope)
+
+    Returns:
+        callable: feval (y_pred, data) -> ('gan_eval', ganancia máxima, True)
+    """
+    ganancia = np.asarray(ganancia)
+    estados = {}
+
+    def ganancia_filas(y_pred, data):
+        estado = estados.get(id(data))
+        if estado is None:
+            indices = getattr(data, 'used_indices', None)
+            estado = preparar_ganancia(ganancia if indices is None else ganancia[np.asarray(indices)], tope)
+            estados[id(data)] = estado
+        return 'gan_eval', float(ganancia_maxima(y_pred, estado)), True
+
+    return ganancia_filas
+
+
+# Estados de ganancia_pesos_rapida / ganancia_evaluator_rapida por Dataset
+_estados_pesos = weakref.WeakKeyDictionary()
+_estados_label = weakref.WeakKeyDictionary()
+
+
+def ganancia_pesos_rapida(y_pred, data):
+    """
+    gain_function.ganancia_pesos (ganancia leída del peso) con ganancia_maxima.
+    """
+    estado = _estados_pesos.get(data)
+    if estado is None:
+        weight = data.get_weight()
+        ganancia = np.where(weight == 1.00002, GANANCIA_ACIERTO, 0) - np.where(weight < 1.00002, COSTO_ESTIMULO, 0)
+        estado = _estados_pesos[data] = preparar_ganancia(ganancia)
+    return 'gan_eval', ganancia_maxima(y_pred, estado), True
+
+
+def ganancia_evaluator_rapida(y_pred, data):
+    """
+    gain_function.ganancia_evaluator (ganancia leída del label) con ganancia_topk.
+    Sin garantía se llama a ganancia_evaluator: con empates su resultado
+    depende del sort de Polars, no del de NumPy.
+    """
+    estado = _estados_label.get(data)
+    if estado is None:
+        ganancia = np.where(data.get_label() == 1, GANANCIA_ACIERTO, -COSTO_ESTIMULO).astype(np.int64)
+        estado = _estados_label[data] = preparar_ganancia(ganancia)
+    maxima = ganancia_topk(y_pred, estado)
+    if maxima is None:
+        return ganancia_evaluator(y_pred, data)
+    return 'ganancia', int(maxima), True
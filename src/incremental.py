@@ -0,0 +1,372 @@
+import json
+import logging
+import os
+import duckdb
+from typing import Dict, List, Optional
+from .features import normalizar_espec, feature_engineering_ventanas
+from .output_manager import agregar_particion_parquet
+from .esquema import columnas_iguales
+from .pipeline import Datos, registrar_entrada
+
+logger = logging.getLogger(__name__)
+
+ARCHIVO_ESTADO = "estado.parquet"
+ARCHIVO_META = "meta.json"
+
+
+def profundidad_estado(espec: Dict) -> int:
+    """
+    Meses previos de cada cliente que necesita la especificación para
+    calcular las features de un mes nuevo: el lag más lejano (también los
+    que usan los deltas) y N - 1 para cada rolling / ratio_media / activos
+    de N meses y para el horizonte de recencia.
+    """
+    espec = normalizar_espec(espec)
+    ventanas = espec['rolling'] + espec['ratio_media'] + espec['activos'] + [espec['recencia']]
+    return max([espec['lags'], espec['deltas']] + [n - 1 for n in ventanas])
+
+
+def _leer_meta(directorio: str) -> Optional[dict]:
+    ruta = os.path.join(directorio, ARCHIVO_META)
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, "r") as f:
+        return json.load(f)
+
+
+def _guardar_meta(directorio: str, meta: dict):
+    ruta = os.path.join(directorio, ARCHIVO_META)
+    with open(f"{ruta}.tmp", "w") as f:
+        json.dump(meta, f, indent=4)
+    os.replace(f"{ruta}.tmp", ruta)
+
+
+def _huellas_meses(con: duckdb.DuckDBPyConnection, fuente: str, filtro: str = "") -> Dict[str, List[int]]:
+    """
+    Huella de cada foto_mes de 'fuente': cantidad de filas, suma de
+    hash(numero_de_cliente) (sus clientes, como en target.actualizar_etiquetas)
+    y suma de hash(numero_de_cliente, clase_ternaria) (sus etiquetas).
+    """
+    filas = con.execute(f"""
+        SELECT foto_mes, COUNT(*), SUM(hash(numero_de_cliente)),
+               SUM(hash(numero_de_cliente, CAST(clase_ternaria AS VARCHAR)))
+        FROM {fuente}
+        {f"WHERE {filtro}" if filtro else ""}
+        GROUP BY foto_mes
+    """).fetchall()
+    return {str(int(mes)): [int(n), int(claves), int(clase)] for mes, n, claves, clase in filas}
+
+
+def _escribir_estado(con: duckdb.DuckDBPyConnection,
+                     fuente: str,
+                     columnas: List[str],
+                     profundidad: int,
+                     directorio: str) -> int:
+    """
+    Guarda las últimas 'profundidad' filas de cada cliente de 'fuente'
+    (claves y atributos) y devuelve la cantidad de filas escritas.
+    """
+    ruta = os.path.join(directorio, ARCHIVO_ESTADO)
+    select = ", ".join(['numero_de_cliente', 'foto_mes'] + columnas)
+    con.execute(f"""
+        COPY (
+            SELECT {select}
+            FROM {fuente}
+            QUALIFY row_number() OVER (PARTITION BY numero_de_cliente ORDER BY foto_mes DESC) <= {profundidad}
+        ) TO '{ruta}.tmp' (FORMAT PARQUET, COMPRESSION zstd)
+    """)
+    os.replace(f"{ruta}.tmp", ruta)
+    return con.execute(f"SELECT COUNT(*) FROM read_parquet('{ruta}')").fetchone()[0]
+
+
+def guardar_estado(df: Datos,
+                   columnas: List[str],
+                   espec: Dict,
+                   directorio: str,
+                   con: duckdb.DuckDBPyConnection,
+                   motor: str = 'sql',
+                   version: Optional[str] = None) -> dict:
+    """
+    Guarda el estado del FE incremental a partir de la entrada completa del
+    FE histórico (la salida intra-mes): las últimas k filas de cada cliente
+    con sus atributos, donde k = profundidad_estado(espec). Como las ventanas
+    cuentan filas del cliente, con esas k filas alcanza para calcular las
+    features de cualquier mes posterior igual que un recálculo completo.
+
+    Args:
+        df: Entrada del FE histórico (todos los meses procesados)
+        columnas: Atributos del FE histórico
+        espec: Especificación de ventanas (ver features.ESPEC_VENTANAS)
+        directorio: Directorio del estado (estado.parquet + meta.json)
+        con: Conexión de la sesión
+        motor: Motor de ventanas con el que se generó el dataset
+        version: Versión del FE (feature_store.version_fe): código y
+            configuración de todas las etapas que definen los atributos
+
+    Returns:
+        dict: Metadatos del estado guardado
+    """
+    espec = normalizar_espec(espec)
+    profundidad = profundidad_estado(espec)
+    os.makedirs(directorio, exist_ok=True)
+
+    tabla, es_relacion = registrar_entrada(df, con, "estado_fe")
+    presentes = set(con.table(tabla).columns)
+    columnas = [c for c in columnas if c in presentes]
+    try:
+        filas = _escribir_estado(con, tabla, columnas, profundidad, directorio)
+        ultimo_mes = con.execute(f"SELECT MAX(foto_mes) FROM {tabla}").fetchone()[0]
+        huellas = _huellas_meses(con, tabla)
+    finally:
+        if not es_relacion:
+            con.unregister(tabla)
+
+    meta = {
+        'columnas': columnas,
+        'espec': espec,
+        'motor': motor,
+        'version': version,
+        'profundidad': profundidad,
+        'ultimo_mes': int(ultimo_mes),
+        'filas': int(filas),
+        'huellas': huellas,
+    }
+    _guardar_meta(directorio, meta)
+    logger.info(f"Estado FE incremental guardado: {filas} filas ({profundidad} meses por cliente) "
+                f"hasta {ultimo_mes}")
+    return meta
+
+
+def estado_compatible(directorio: str,
+                      columnas: List[str],
+                      espec: Dict,
+                      motor: str = 'sql',
+                      version: Optional[str] = None) -> bool:
+    """
+    Indica si hay un estado guardado con los mismos atributos, especificación,
+    motor y versión del FE; si no, hay que recalcular el FE histórico
+    completo. Los nombres de los atributos no alcanzan: con otro drift,
+    otras fórmulas intra-mes u otro código se llaman igual pero valen otra
+    cosa, y los meses nuevos no serían comparables con los guardados.
+    Los estados guardados sin huellas por mes (ver meses_reetiquetados)
+    tampoco sirven.
+    """
+    meta = _leer_meta(directorio)
+    if (meta is None or not os.path.exists(os.path.join(directorio, ARCHIVO_ESTADO))
+            or 'huellas' not in meta):
+        return False
+    if (meta['columnas'] != list(columnas) or meta['espec'] != normalizar_espec(espec)
+            or meta['motor'] != motor or meta.get('version') != version):
+        logger.info("El estado FE incremental no coincide con la configuración actual")
+        return False
+    return True
+
+
+def meses_pendientes(df: Datos, directorio: str, con: duckdb.DuckDBPyConnection) -> List[int]:
+    """
+    foto_mes de 'df' posteriores al último mes incluido en el estado.
+    """
+    meta = _leer_meta(directorio)
+    tabla, es_relacion = registrar_entrada(df, con, "inc_meses")
+    try:
+        meses = con.execute(f"""
+            SELECT DISTINCT foto_mes FROM {tabla}
+            WHERE foto_mes > {meta['ultimo_mes']}
+            ORDER BY 1
+        """).fetchall()
+    finally:
+        if not es_relacion:
+            con.unregister(tabla)
+    return [int(m) for (m,) in meses]
+
+
+def meses_reetiquetados(df: Datos, directorio: str, con: duckdb.DuckDBPyConnection) -> Optional[List[int]]:
+    """
+    foto_mes ya incluidos en el estado cuya clase_ternaria en 'df' no es la
+    que se guardó: los dos meses anteriores a cada mes nuevo y cualquier mes
+    que target.actualizar_etiquetas haya vuelto a etiquetar. Sólo hay que
+    reescribir su clase (refrescar_clase).
+
+    Devuelve None si algún mes guardado cambió de clientes o ya no está en
+    'df': sus features (y las de los meses siguientes) cambian, y hay que
+    recalcular todo el FE histórico.
+    """
+    meta = _leer_meta(directorio)
+    tabla, es_relacion = registrar_entrada(df, con, "inc_huellas")
+    try:
+        actuales = _huellas_meses(con, tabla, f"foto_mes <= {meta['ultimo_mes']}")
+    finally:
+        if not es_relacion:
+            con.unregister(tabla)
+
+    guardadas = meta['huellas']
+    distintos, clientes = [], []
+    for mes in sorted(set(guardadas) | set(actuales)):
+        antes, ahora = guardadas.get(mes), actuales.get(mes)
+        if antes == ahora:
+            continue
+        if antes is None or ahora is None or antes[:2] != ahora[:2]:
+            clientes.append(int(mes))
+        distintos.append(int(mes))
+    if clientes:
+        logger.info(f"FE incremental: cambiaron los clientes de {clientes}; hay que recalcular todo")
+        return None
+    return distintos
+
+
+def agregar_mes_incremental(df: Datos,
+                            mes: int,
+                            directorio: str,
+                            destino: str,
+                            con: duckdb.DuckDBPyConnection,
+                            row_group_size: int = 122880,
+                            compresion: str = 'zstd') -> str:
+    """
+    Calcula las features históricas de un mes nuevo a partir del estado y
+    las agrega como partición foto_mes=mes al dataset 'destino', sin tocar
+    los meses anteriores. Después avanza el estado para incluir el mes.
+
+    La consulta de ventanas corre sobre las filas del mes unidas a las k
+    filas guardadas por cliente (en lugar de toda la historia), con los
+    mismos atributos, especificación y motor con que se guardó el estado.
+
+    Args:
+        df: Entrada del FE histórico que contiene las filas de 'mes'
+        mes: foto_mes a agregar (posterior al último mes del estado)
+        directorio: Directorio del estado
+        destino: Dataset Parquet particionado por foto_mes
+        con: Conexión de la sesión
+        row_group_size: Filas por row group
+        compresion: Códec Parquet
+
+    Returns:
+        str: Directorio de la partición escrita
+    """
+    meta = _leer_meta(directorio)
+    if mes <= meta['ultimo_mes']:
+        raise ValueError(f"El mes {mes} no es posterior al último mes del estado ({meta['ultimo_mes']})")
+
+    ruta_estado = os.path.join(directorio, ARCHIVO_ESTADO)
+    tabla, es_relacion = registrar_entrada(df, con, "inc_fuente")
+    try:
+        # Primero las filas nuevas: así las columnas quedan en el orden de la entrada
+        union = f"inc_union_{mes}"
+        con.execute(f"""
+            CREATE OR REPLACE TEMP VIEW {union} AS
+            SELECT * FROM {tabla} WHERE foto_mes = {mes}
+            UNION ALL BY NAME
+            SELECT * FROM read_parquet('{ruta_estado}')
+        """)
+        nuevas = con.table(union).filter(f"foto_mes = {mes}").count("*").fetchone()[0]
+        if nuevas == 0:
+            raise ValueError(f"La entrada no tiene filas de foto_mes {mes}")
+
+        features = feature_engineering_ventanas(
+            con.table(union), meta['columnas'], meta['espec'], con=con, motor=meta['motor']
+        )
+        escritas = agregar_particion_parquet(features.filter(f"foto_mes = {mes}"), destino, con,
+                                             row_group_size=row_group_size, compresion=compresion)
+
+        meta['filas'] = int(_escribir_estado(con, union, meta['columnas'], meta['profundidad'], directorio))
+        meta['ultimo_mes'] = int(mes)
+        meta['huellas'].update(_huellas_meses(con, tabla, f"foto_mes = {mes}"))
+        _guardar_meta(directorio, meta)
+        con.execute(f"DROP VIEW IF EXISTS {union}")
+    finally:
+        if not es_relacion:
+            con.unregister(tabla)
+
+    logger.info(f"FE incremental: {nuevas} filas de {mes} agregadas a {destino}/")
+    return escritas[0]
+
+
+def refrescar_clase(df: Datos,
+                    meses: List[int],
+                    destino: str,
+                    directorio: str,
+                    con: duckdb.DuckDBPyConnection,
+                    row_group_size: int = 122880,
+                    compresion: str = 'zstd') -> List[int]:
+    """
+    Reescribe sólo la clase_ternaria de las particiones 'meses' del dataset,
+    tomándola de 'df', sin recalcular features (ver meses_reetiquetados), y
+    actualiza sus huellas en el estado.
+
+    Returns:
+        list: foto_mes reescritos
+    """
+    meta = _leer_meta(directorio)
+    tabla, es_relacion = registrar_entrada(df, con, "inc_clase")
+    reescritos = []
+    try:
+        for mes in meses:
+            particion = os.path.join(destino, f"foto_mes={mes}")
+            if not os.path.isdir(particion):
+                continue
+            rel = con.sql(f"""
+                SELECT p.* REPLACE (e.clase_ternaria AS clase_ternaria), {mes} AS foto_mes
+                FROM read_parquet('{particion}/*.parquet', hive_partitioning = false) p
+                LEFT JOIN (
+                    SELECT numero_de_cliente, clase_ternaria FROM {tabla} WHERE foto_mes = {mes}
+                ) e USING (numero_de_cliente)
+            """)
+            agregar_particion_parquet(rel, destino, con, row_group_size=row_group_size, compresion=compresion)
+            reescritos.append(mes)
+        if meses:
+            lista = ", ".join(str(int(m)) for m in meses)
+            meta['huellas'].update(_huellas_meses(con, tabla, f"foto_mes IN ({lista})"))
+            _guardar_meta(directorio, meta)
+    finally:
+        if not es_relacion:
+            con.unregister(tabla)
+    return reescritos
+
+
+def verificar_incremental(df: Datos,
+                          mes: int,
+                          destino: str,
+                          columnas: List[str],
+                          espec: Dict,
+                          con: duckdb.DuckDBPyConnection,
+                          motor: str = 'sql',
+                          tolerancia: float = 1e-6) -> bool:
+    """
+    Recalcula las features de 'mes' sobre toda la historia de 'df' y las
+    compara con la partición escrita por agregar_mes_incremental.
+
+    Con el motor SQL el resultado debe ser idéntico. El motor tensorial
+    redondea media/std/cv/pendiente según la historia que ve (ver
+    panel.ventanas_tensor), así que los decimales se comparan con una
+    tolerancia relativa a la escala de cada columna.
+
+    Returns:
+        bool: True si coinciden todas las columnas
+    """
+    tabla, es_relacion = registrar_entrada(df, con, "inc_verif")
+    try:
+        historia = con.sql(f"SELECT * FROM {tabla} WHERE foto_mes <= {mes}")
+        esperado = feature_engineering_ventanas(historia, columnas, espec, con=con, motor=motor)
+        esperado = esperado.filter(f"foto_mes = {mes}").df()
+    finally:
+        if not es_relacion:
+            con.unregister(tabla)
+    obtenido = con.read_parquet(os.path.join(destino, f"foto_mes={mes}", "*.parquet"),
+                                hive_partitioning=False).df()
+
+    esperado = esperado.drop(columns='foto_mes').sort_values('numero_de_cliente', ignore_index=True)
+    obtenido = obtenido.sort_values('numero_de_cliente', ignore_index=True)
+
+    if list(esperado.columns) != list(obtenido.columns) or len(esperado) != len(obtenido):
+        logger.error(f"FE incremental {mes}: columnas o filas distintas del recálculo completo "
+                     f"({esperado.shape} vs {obtenido.shape})")
+        return False
+
+    distintas = [c for c in esperado.columns
+                 if not columnas_iguales(esperado[c], obtenido[c], tolerancia)]
+    if distintas:
+        logger.error(f"FE incremental {mes}: {len(distintas)} columnas difieren del recálculo completo: "
+                     f"{distintas[:10]}")
+        return False
+
+    logger.info(f"FE incremental {mes}: coincide con el recálculo completo ({esperado.shape[1]} columnas)")
+    return True
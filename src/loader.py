@@ -1,31 +1,306 @@
 import pandas as pd
 import logging
 import numpy as np
+import duckdb
+import json
+import os
+import shutil
+from typing import List, Optional, Tuple
+from .config import GANANCIA_ACIERTO, COSTO_ESTIMULO
+from .esquema import inferir_esquema, select_con_esquema, aplicar_esquema, CATEGORIAS_CLASE
 
 logger = logging.getLogger(__name__)
 
+ARCHIVO_META_CACHE = "_cache.json"
+
+# Columnas de la clase que nunca entran como feature al modelo
+COLUMNAS_NO_FEATURE = ['clase_ternaria', 'target', 'clase_peso', 'clase_binaria2']
+
 ## Funcion para cargar datos
-def cargar_datos(path: str) -> pd.DataFrame | None:
+def cargar_datos(path: str,
+                 meses: Optional[List[int]] = None,
+                 columnas: Optional[List[str]] = None,
+                 cache_dir: Optional[str] = None,
+                 usar_cache: bool = True,
+                 compactar: bool = True) -> pd.DataFrame | None:
 
     '''
-    Carga un CSV desde 'path' y retorna un pandas.DataFrame.
+    Carga el dataset desde 'path' y retorna un pandas.DataFrame.
+
+    La primera vez convierte el CSV a un dataset Parquet particionado por
+    foto_mes (ver asegurar_cache_parquet). Las siguientes corridas leen del
+    cache, y sólo las particiones de 'meses' y las 'columnas' pedidas.
+    Con 'compactar' las columnas salen con los tipos de src.esquema
+    (int32, float32, enteros chicos, categórica para clase_ternaria).
+
+    Args:
+        path: Ruta al CSV (o .csv.gz) crudo
+        meses: Lista de foto_mes a leer (None = todos)
+        columnas: Lista de columnas a leer (None = todas)
+        cache_dir: Directorio del cache Parquet (None = junto al CSV)
+        usar_cache: Si es False, lee el CSV completo con pandas como antes
+        compactar: Si es True, aplica el esquema de tipos compactos
+
+    Returns:
+        pd.DataFrame: Dataset filtrado por meses y columnas
     '''
 
     logger.info(f"Cargando dataset desde {path}")
     try:
-        df = pd.read_csv(path)
+        if not usar_cache:
+            df = pd.read_csv(path, usecols=columnas)
+            if meses is not None:
+                df = df[df['foto_mes'].isin(meses)].reset_index(drop=True)
+            if compactar:
+                aplicar_esquema(df)
+        else:
+            directorio = asegurar_cache_parquet(path, cache_dir)
+            df = leer_parquet_particionado(directorio, meses=meses, columnas=columnas,
+                                           compactar=compactar)
         logger.info(f"Dataset cargado con {df.shape[0]} filas y {df.shape[1]} columnas")
         return df
     except Exception as e:
         logger.error(f"Error al cargar el dataset: {e}")
         raise
 
+
+def _huella_archivo(path: str) -> dict:
+    """
+    Huella liviana del archivo fuente (tamaño + mtime) para invalidar el cache.
+    """
+    st = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def asegurar_cache_parquet(path: str, cache_dir: Optional[str] = None) -> str:
+    """
+    Convierte el CSV a un dataset Parquet particionado por foto_mes si el cache
+    no existe o si el archivo fuente cambió desde la última conversión.
+
+    Args:
+        path: Ruta al CSV (o .csv.gz) crudo
+        cache_dir: Directorio del cache (None = '<nombre>_parquet' junto al CSV)
+
+    Returns:
+        str: Directorio del dataset Parquet
+    """
+    path = os.path.expanduser(path)
+    if cache_dir is None:
+        base = os.path.basename(path).split('.')[0]
+        cache_dir = os.path.join(os.path.dirname(path), f"{base}_parquet")
+
+    meta_path = os.path.join(cache_dir, ARCHIVO_META_CACHE)
+    huella = _huella_archivo(path)
+
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        if meta.get('fuente') == huella and 'esquema' in meta:
+            logger.info(f"Usando cache Parquet en {cache_dir}")
+            return cache_dir
+        logger.info("El archivo fuente cambió; se regenera el cache Parquet")
+
+    logger.info(f"Convirtiendo {path} a Parquet particionado por foto_mes en {cache_dir}")
+
+    # Escribimos en un directorio temporal y recién al final reemplazamos,
+    # así una conversión interrumpida nunca queda como cache válido
+    tmp_dir = f"{cache_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    con = duckdb.connect(database=":memory:")
+    try:
+        con.execute(f"""
+            CREATE OR REPLACE VIEW crudo AS
+            SELECT * FROM read_csv_auto('{path}')
+        """)
+        columnas = [c[0] for c in con.execute("DESCRIBE crudo").fetchall()]
+        esquema = inferir_esquema(con, "crudo")
+        con.execute(f"""
+            COPY crudo TO '{tmp_dir}'
+            (FORMAT PARQUET, PARTITION_BY (foto_mes), COMPRESSION zstd)
+        """)
+    finally:
+        con.close()
+
+    with open(os.path.join(tmp_dir, ARCHIVO_META_CACHE), 'w') as f:
+        json.dump({'fuente': huella, 'columnas': columnas, 'esquema': esquema}, f, indent=4)
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+
+    logger.info(f"Cache Parquet generado con {len(columnas)} columnas")
+    return cache_dir
+
+
+def leer_parquet_particionado(directorio: str,
+                              meses: Optional[List[int]] = None,
+                              columnas: Optional[List[str]] = None,
+                              compactar: bool = True) -> pd.DataFrame:
+    """
+    Lee un dataset Parquet particionado por foto_mes (foto_mes=AAAAMM/*.parquet).
+    El filtro por meses poda particiones completas y la selección de columnas
+    sólo lee esos column chunks. Si el dataset guarda un esquema compacto, el
+    casteo se hace en DuckDB y pandas nunca ve los int64/float64 originales.
+
+    Args:
+        directorio: Directorio raíz del dataset
+        meses: Lista de foto_mes a leer (None = todos)
+        columnas: Lista de columnas a leer (None = todas)
+        compactar: Si es True, castea al esquema compacto guardado
+
+    Returns:
+        pd.DataFrame: Datos leídos, con las columnas en el orden original
+    """
+    con = duckdb.connect(database=":memory:")
+    try:
+        df = relacion_parquet_particionado(con, directorio, meses=meses, columnas=columnas,
+                                           compactar=compactar).df()
+    finally:
+        con.close()
+
+    return df
+
+
+def relacion_parquet_particionado(con: duckdb.DuckDBPyConnection,
+                                  directorio: str,
+                                  meses: Optional[List[int]] = None,
+                                  columnas: Optional[List[str]] = None,
+                                  compactar: bool = True) -> duckdb.DuckDBPyRelation:
+    """
+    Igual que leer_parquet_particionado pero devuelve la relación DuckDB sin
+    ejecutarla, para encadenar etapas en una SesionPipeline.
+    """
+    meta_path = os.path.join(directorio, ARCHIVO_META_CACHE)
+    orden = None
+    esquema = None
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        orden = meta.get('columnas')
+        esquema = meta.get('esquema')
+
+    if columnas is None:
+        columnas = orden if orden is not None else ['*']
+    elif orden is not None:
+        faltantes = [c for c in columnas if c not in orden]
+        if faltantes:
+            raise KeyError(f"Columnas inexistentes en el dataset: {faltantes}")
+
+    if compactar and esquema is not None and columnas != ['*']:
+        select = select_con_esquema(esquema, columnas)
+    else:
+        select = ", ".join(c if c == '*' else f'"{c}"' for c in columnas)
+    where = ""
+    if meses is not None:
+        where = f"WHERE foto_mes IN ({', '.join(str(int(m)) for m in meses)})"
+
+    return con.sql(f"""
+        SELECT {select}
+        FROM read_parquet('{directorio}/*/*.parquet', hive_partitioning = true)
+        {where}
+    """)
+
+
+def cargar_relacion(con: duckdb.DuckDBPyConnection,
+                    path: str,
+                    meses: Optional[List[int]] = None,
+                    columnas: Optional[List[str]] = None,
+                    cache_dir: Optional[str] = None) -> duckdb.DuckDBPyRelation:
+    """
+    Versión de cargar_datos para una SesionPipeline: asegura el cache Parquet
+    y devuelve la relación (compacta, filtrada por meses y columnas) sin
+    materializarla en pandas.
+    """
+    logger.info(f"Cargando dataset desde {path} como relación DuckDB")
+    directorio = asegurar_cache_parquet(path, cache_dir)
+    return relacion_parquet_particionado(con, directorio, meses=meses, columnas=columnas)
+
+
+def meses_con_historia(meses: List[int], cant_historia: int) -> List[int]:
+    """
+    Agrega a 'meses' los 'cant_historia' meses previos a cada uno, que son los
+    que necesitan los lags/deltas para calcularse sobre esos meses.
+
+    Args:
+        meses: Lista de foto_mes (AAAAMM)
+        cant_historia: Cantidad de meses hacia atrás (ej. cant_lag)
+
+    Returns:
+        list: foto_mes ordenados y sin repetidos
+    """
+    resultado = set()
+    for mes in meses:
+        periodo = (int(mes) // 100) * 12 + (int(mes) % 100) - 1
+        for k in range(int(cant_historia) + 1):
+            p = periodo - k
+            resultado.add((p // 12) * 100 + (p % 12) + 1)
+    return sorted(resultado)
+
+## Codificación de la clase sin copiar el dataset
+# Índice = código de clase_ternaria en CATEGORIAS_CLASE (0 CONTINUA, 1 BAJA+1,
+# 2 BAJA+2); el último lugar (código -1) corresponde a filas sin clase
+_Y_BINARIA = np.array([0, 1, 1, 0], dtype=np.int8)
+_Y_TARGET = np.array([0, 0, 1, 0], dtype=np.int8)
+_PESOS = np.array([1.0, 1.00001, 1.00002, 1.0], dtype=np.float32)
+
+
+def codigos_clase(df: pd.DataFrame) -> np.ndarray:
+    """
+    Códigos int8 de clase_ternaria según CATEGORIAS_CLASE (-1 = sin clase).
+    Si la columna ya es categórica con ese orden, se usan sus códigos sin copia.
+    """
+    serie = df['clase_ternaria']
+    dtype = serie.dtype
+    if isinstance(dtype, pd.CategoricalDtype) and list(dtype.categories) == CATEGORIAS_CLASE:
+        return serie.cat.codes.to_numpy()
+    return pd.Categorical(serie, categories=CATEGORIAS_CLASE).codes
+
+
+def codificar_clase(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Codifica clase_ternaria en tres arreglos alineados con las filas de 'df',
+    sin modificar ni copiar el DataFrame:
+    - y: int8, 1 si BAJA+1 o BAJA+2, 0 si CONTINUA (o sin clase)
+    - peso: float32, 1.0 / 1.00001 / 1.00002 para CONTINUA / BAJA+1 / BAJA+2
+    - ganancia: int32, GANANCIA_ACIERTO si BAJA+2 y -COSTO_ESTIMULO si no
+
+    Args:
+        df: DataFrame con columna 'clase_ternaria'
+
+    Returns:
+        tuple: (y, peso, ganancia)
+    """
+    codigos = codigos_clase(df)
+    tabla_ganancia = np.array([-COSTO_ESTIMULO, -COSTO_ESTIMULO, GANANCIA_ACIERTO, -COSTO_ESTIMULO],
+                              dtype=np.int32)
+
+    y = _Y_BINARIA[codigos]
+    peso = _PESOS[codigos]
+    ganancia = tabla_ganancia[codigos]
+
+    conteo = np.bincount(codigos + 1, minlength=4)
+    logger.info(f"Clase codificada - CONTINUA: {conteo[1]}, BAJA+1: {conteo[2]}, "
+                f"BAJA+2: {conteo[3]}, sin clase: {conteo[0]}")
+
+    return y, peso, ganancia
+
+
+def columnas_features(df: pd.DataFrame) -> List[str]:
+    """
+    Columnas de 'df' que entran al modelo (todas menos las de la clase).
+    """
+    return [c for c in df.columns if c not in COLUMNAS_NO_FEATURE]
+
+
 ## Función para convertir a binario el target
 def convertir_clase_ternaria_a_target(df: pd.DataFrame) -> pd.DataFrame:
     """
     Convierte clase_ternaria a target binario reemplazando en el mismo atributo:
     - 'clase_ternaria': 1 si BAJA+1 o BAJA+2, 0 si CONTINUA
     - 'target':   1 solo si BAJA+2, 0 si BAJA+1 o CONTINUA
+
+    Devuelve una copia y no modifica 'df'. Para entrenar conviene
+    codificar_clase, que no copia el DataFrame.
   
     Args:
         df: DataFrame con columna 'clase_ternaria'
@@ -33,34 +308,19 @@ def convertir_clase_ternaria_a_target(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         pd.DataFrame: DataFrame con clase_ternaria convertida a valores binarios (0, 1)
     """
+    codigos = codigos_clase(df)
+    conteo = np.bincount(codigos + 1, minlength=4)
+
     # Crear copia del DataFrame para no modificar el original
     df_result = df.copy()
-  
-    # Contar valores originales para logging
-    n_continua_orig = (df_result['clase_ternaria'] == 'CONTINUA').sum()
-    n_baja1_orig = (df_result['clase_ternaria'] == 'BAJA+1').sum()
-    n_baja2_orig = (df_result['clase_ternaria'] == 'BAJA+2').sum()
-  
-    # Target real (solo baja+2 = 1)
-    df_result['target'] = df_result['clase_ternaria'].map({
-        'CONTINUA': 0,
-        'BAJA+1': 0,
-        'BAJA+2': 1
-    })
-
-    # Target binario (baja+1 o baja+2 = 1)
-    df_result['clase_ternaria'] = df_result['clase_ternaria'].map({
-        'CONTINUA': 0,
-        'BAJA+1': 1,
-        'BAJA+2': 1
-    })
-
-    # Log de la conversión
-    n_ceros = (df_result['clase_ternaria'] == 0).sum()
-    n_unos = (df_result['clase_ternaria'] == 1).sum()
-  
+    df_result['target'] = _Y_TARGET[codigos]
+    df_result['clase_ternaria'] = _Y_BINARIA[codigos]
+
+    n_unos = int(conteo[2] + conteo[3])
+    n_ceros = int(len(codigos) - n_unos)
+
     logger.info(f"Conversión completada:")
-    logger.info(f"  Original - CONTINUA: {n_continua_orig}, BAJA+1: {n_baja1_orig}, BAJA+2: {n_baja2_orig}")
+    logger.info(f"  Original - CONTINUA: {conteo[1]}, BAJA+1: {conteo[2]}, BAJA+2: {conteo[3]}")
     logger.info(f"  Binario - 0: {n_ceros}, 1: {n_unos}")
     logger.info(f"  Distribución: {n_unos/(n_ceros + n_unos)*100:.2f}% casos positivos")
   
@@ -72,25 +332,24 @@ def convertir_clase_pesos(df: pd.DataFrame) -> pd.DataFrame:
     - Agrega columna peso y le asigna uno distinto a baja+1 y baja+2
     - Crea clase binaria con el target real:
         - 1 si BAJA+1 o BAJA+2, 0 si CONTINUA
+
+    Devuelve una copia y no modifica 'df'. Para entrenar conviene
+    codificar_clase, que devuelve los mismos valores como arreglos sin
+    copiar el DataFrame.
   
     Args:
         df: DataFrame con columna 'clase_ternaria'
   
     Returns:
-        pd.DataFrame: DataFrame con clase_peso y clase_binaria
+        pd.DataFrame: DataFrame con clase_peso y clase_binaria2
     """
+    codigos = codigos_clase(df)
+
     # Crear copia del DataFrame para no modificar el original
     df_result = df.copy()
-  
-    # Agrega la columna peso y asigna dependiendo la clase
-    df_result['clase_peso'] = 1.0
-    df_result.loc[df_result['clase_ternaria'] == 'BAJA+2', 'clase_peso'] = 1.00002
-    df_result.loc[df_result['clase_ternaria'] == 'BAJA+1', 'clase_peso'] = 1.00001
-
-    # Agrega clase binaria con el target correspondiente
-    df_result['clase_binaria2'] = 0
-    df_result['clase_binaria2'] = np.where(df_result['clase_ternaria'] == 'CONTINUA', 0, 1)
+    df_result['clase_peso'] = _PESOS[codigos]
+    df_result['clase_binaria2'] = _Y_BINARIA[codigos]
   
     logger.info(f"Conversión completada:")
   
-    return df_result
\ No newline at end of file
+    return df_result
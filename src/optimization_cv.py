@@ -4,16 +4,29 @@ import pandas as pd
 import numpy as np
 import json
 import os
+import fcntl
 import logging
+import multiprocessing
 from .config import (
-    SEMILLA, MES_TRAIN, STUDY_NAME,
-    GANANCIA_ACIERTO, COSTO_ESTIMULO, PARAMETROS_LGB
+    SEMILLA, MES_TRAIN, STUDY_NAME, CACHE_DIR,
+    GANANCIA_ACIERTO, COSTO_ESTIMULO, PARAMETROS_LGB,
+    OPTUNA_STORAGE, OPTUNA_WORKERS, OPTUNA_PODA, OPTUNA_SUBMUESTREO,
+    LGB_UMBRAL_DISPERSO
 )
-from .gain_function import ganancia_evaluator, ganancia_pesos
+from .ganancia_rapida import ganancia_evaluator_rapida, crear_ganancia_topk
+from .loader import codificar_clase, codigos_clase
+from .seleccion import features_modelo
+from .dataset_lgb import dataset_cacheado, huella_dataset
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Trials que cuentan para n_trials (los podados también consumieron su presupuesto)
+_TERMINADOS = (optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED)
+
+# Folds del CV de la optimización (la ganancia del fold de validación x NFOLD estima la del mes)
+NFOLD = 5
+
 def objetivo_ganancia_cv(t) -> float:
     """
     Función objetivo para Optuna con Cross Validation.
@@ -61,7 +74,7 @@ def objetivo_ganancia_cv(t) -> float:
         nfold=5,
         seed= SEMILLA[0] if isinstance(SEMILLA, list) else SEMILLA,
         stratified=True,
-        feval=ganancia_evaluator,
+        feval=ganancia_evaluator_rapida,
         callbacks=[lgb.early_stopping(50), lgb.log_evaluation(0)]
     )
   
@@ -80,7 +93,8 @@ def objetivo_ganancia_cv(t) -> float:
 
     return ganancia_maxima
 
-def guardar_iteracion_cv(trial, ganancia_maxima, ganancias_cv, best_iteration=None, archivo_base=None):
+def guardar_iteracion_cv(trial, ganancia_maxima, ganancias_cv, best_iteration=None, archivo_base=None,
+                         estado='COMPLETE'):
 
     if archivo_base is None:
         archivo_base = STUDY_NAME
@@ -95,54 +109,408 @@ def guardar_iteracion_cv(trial, ganancia_maxima, ganancias_cv, best_iteration=No
         'best_iteration': int(best_iteration) if best_iteration is not None else None,
         'value': float(ganancia_maxima),
         'datetime': datetime.now().isoformat(),
-        'state': 'COMPLETE'
+        'state': estado,
+        'estudio': trial.study.study_name,
+        # Fidelidad (fracción de CONTINUA) y filas de entrenamiento de cada fold,
+        # para reescalar min_data_in_leaf al entrenar con todas las filas
+        'fidelidad': trial.user_attrs.get('fidelidad', 1.0),
+        'filas_entrenamiento': trial.user_attrs.get('filas_entrenamiento'),
+        # Datos del estudio: sólo compiten entre sí los trials de los mismos datos
+        'huella_datos': trial.user_attrs.get('huella_datos')
     }
 
-    # Cargar datos existentes
-    if os.path.exists(archivo):
-        with open(archivo, 'r') as f:
-            try:
-                datos_existentes = json.load(f)
-                if not isinstance(datos_existentes, list):
+    # Lock exclusivo: con varios workers, leer-agregar-escribir no se pisa
+    with open(f"{archivo}.lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        # Cargar datos existentes
+        if os.path.exists(archivo):
+            with open(archivo, 'r') as f:
+                try:
+                    datos_existentes = json.load(f)
+                    if not isinstance(datos_existentes, list):
+                        datos_existentes = []
+                except json.JSONDecodeError:
                     datos_existentes = []
-            except json.JSONDecodeError:
-                datos_existentes = []
+        else:
+            datos_existentes = []
+
+        # Agregar nueva iteración a los datos existentes
+        datos_existentes.append(iteracion_data)
+
+        # Guardar nuevamente en el archivo (tmp + rename: nunca queda a medio escribir)
+        with open(f"{archivo}.tmp", 'w') as f:
+            json.dump(datos_existentes, f, indent=4)
+        os.replace(f"{archivo}.tmp", archivo)
+
+    logger.info(f"Iteración CV {trial.number} guardada ({estado}) - Ganancia: {ganancia_maxima:,.0f}")
+
+
+def crear_pruner(config=None):
+    """
+    Pruner de Optuna según OPTUNA_PODA:
+      - 'median': poda si el trial está por debajo de la mediana de los
+        anteriores en la misma ronda (después de 'startup' trials y 'warmup' rondas)
+      - 'halving': successive halving con min_resource = 'warmup' rondas
+      - 'hyperband': Hyperband entre 'warmup' y 4000 rondas
+      - None: sin poda
+    """
+    config = {**OPTUNA_PODA, **(config or {})}
+    tipo = config.get('pruner')
+    if not tipo:
+        return optuna.pruners.NopPruner()
+    if tipo == 'median':
+        return optuna.pruners.MedianPruner(n_startup_trials=config['startup'],
+                                           n_warmup_steps=config['warmup'])
+    if tipo == 'halving':
+        return optuna.pruners.SuccessiveHalvingPruner(min_resource=config['warmup'])
+    if tipo == 'hyperband':
+        return optuna.pruners.HyperbandPruner(min_resource=config['warmup'], max_resource=4000)
+    raise ValueError(f"Pruner desconocido: {tipo} (usar 'median', 'halving', 'hyperband' o null)")
+
+
+def callback_poda(trial, cada=None, metrica='gan_eval'):
+    """
+    Callback de lgb.cv que cada 'cada' rondas reporta al trial la mejor
+    'metrica'-mean hasta ahora (en la escala del valor del objetivo, x NFOLD) y,
+    si el pruner lo decide, guarda el trial como PRUNED en el log de
+    iteraciones y corta el CV con optuna.TrialPruned.
+    """
+    cada = cada or OPTUNA_PODA['cada']
+    ganancias = []
+
+    def _callback(env):
+        media = next(r[2] for r in env.evaluation_result_list if r[1] == metrica)
+        ganancias.append(media)
+        ronda = env.iteration + 1
+        if ronda % cada:
+            return
+        mejor = max(ganancias)
+        trial.report(mejor * NFOLD, step=ronda)
+        if trial.should_prune():
+            guardar_iteracion_cv(trial, mejor, ganancias, best_iteration=ganancias.index(mejor) + 1,
+                                 estado='PRUNED')
+            raise optuna.TrialPruned(f"Trial {trial.number} podado en la ronda {ronda} "
+                                     f"(ganancia {mejor:,.0f})")
+
+    _callback.order = 40  # después de early_stopping (30): no se reporta una ronda que lo cortó
+    return _callback
+
+def params_dataset() -> dict:
+    """
+    Parámetros de LightGBM fijos en todos los trials con los que se binnea
+    el Dataset de la optimización.
+    """
+    return {
+        'feature_pre_filter': False,
+        'max_bin': 31,
+        'seed': SEMILLA[0] if isinstance(SEMILLA, list) else SEMILLA,
+        'verbosity': -1,
+    }
+
+
+def fidelidades_optimizacion() -> list:
+    """
+    Fracciones de CONTINUA con las que se optimiza, de menor a mayor
+    (OPTUNA_SUBMUESTREO['fidelidades'], o sólo 'continua' si no hay).
+    """
+    fidelidades = OPTUNA_SUBMUESTREO.get('fidelidades') or [OPTUNA_SUBMUESTREO.get('continua', 1.0)]
+    return sorted(float(f) for f in fidelidades)
+
+
+def mascara_submuestreo(df, tasa: float, semilla=None) -> np.ndarray:
+    """
+    Filas que entran a la optimización: todas las BAJA+1/BAJA+2 y una
+    fracción 'tasa' de las CONTINUA, elegidas con un azar uniforme por fila
+    fijo por semilla (como el 'azar' de los notebooks de R). Con la misma
+    semilla las muestras de tasas menores están contenidas en las de tasas
+    mayores, así cada fidelidad agrega filas a la anterior.
+    """
+    if tasa >= 1:
+        return np.ones(len(df), dtype=bool)
+    if semilla is None:
+        semilla = SEMILLA[0] if isinstance(SEMILLA, list) else SEMILLA
+    azar = np.random.default_rng(semilla).random(len(df))
+    return (codigos_clase(df) != 0) | (azar < tasa)
+
+
+def preparar_datos_cv(df, fidelidad=None) -> dict:
+    """
+    Datos de la optimización, armados una vez por estudio: el Dataset
+    binneado de MES_TRAIN (compartido por todos los trials y folds, y
+    guardado en CACHE_DIR/lgb para las corridas siguientes) y la ganancia
+    por fila de la métrica.
+
+    Con fidelidad < 1 sólo entra esa fracción de las CONTINUA (ver
+    mascara_submuestreo) y cada una pesa 1 / fidelidad en la ganancia: la
+    métrica estima la ganancia sobre todas las filas y se compara entre
+    fidelidades. Los pesos del entrenamiento no cambian.
+
+    Args:
+        df: DataFrame con datos
+        fidelidad: Fracción de CONTINUA (None = la primera de fidelidades_optimizacion)
+
+    Returns:
+        dict: {'dataset': lgb.Dataset, 'features': [...], 'ganancia': np.ndarray,
+        'archivo': binario del Dataset (lo abren los workers), 'fidelidad': float,
+        'filas_entrenamiento': filas con las que entrena cada fold,
+        'huella': huella_dataset de MES_TRAIN con todas las filas (la misma en
+        todas las fidelidades; identifica los datos del estudio)}
+    """
+    if fidelidad is None:
+        fidelidad = fidelidades_optimizacion()[0]
+    df_cv = df[df['foto_mes'].isin(MES_TRAIN)]
+    features = features_modelo(df_cv)
+    y_train, w_train, ganancia = codificar_clase(df_cv)
+    huella = huella_dataset(df_cv, features, y_train, w_train, params_dataset(), LGB_UMBRAL_DISPERSO)
+    if fidelidad < 1:
+        total = len(df_cv)
+        df_cv = df_cv[mascara_submuestreo(df_cv, fidelidad)]
+        logger.info(f"Undersampling de CONTINUA al {fidelidad:.0%}: {len(df_cv)} de {total} filas")
+        y_train, w_train, ganancia = codificar_clase(df_cv)
+        ganancia = np.where(codigos_clase(df_cv) == 0, ganancia / fidelidad, ganancia)
+
+    # Columnas casi todas en cero como matriz CSC (ver dataset_lgb)
+    dataset, features, archivo = dataset_cacheado(df_cv, features, y_train, w_train,
+                                                  params=params_dataset(),
+                                                  directorio=os.path.join(CACHE_DIR, "lgb"),
+                                                  huella=huella if fidelidad >= 1 else None)
+    return {'dataset': dataset, 'features': features, 'ganancia': ganancia, 'archivo': archivo,
+            'fidelidad': float(fidelidad),
+            'filas_entrenamiento': len(df_cv) - len(df_cv) // NFOLD,
+            'huella': huella}
+
+
+def nombre_estudio(fidelidad: float, huella: str) -> str:
+    """
+    Estudio de Optuna de unos datos y una fidelidad: {STUDY_NAME}_{huella}
+    con todas las filas y {STUDY_NAME}_{huella}_continua{fidelidad} con
+    undersampling (otra métrica, otro estudio). Con otros datos, features o
+    binning la huella cambia y se empieza un estudio nuevo en lugar de
+    retomar trials evaluados sobre otro Dataset.
+    """
+    base = f"{STUDY_NAME}_{huella[:8]}"
+    return base if fidelidad >= 1 else f"{base}_continua{fidelidad:g}"
+
+
+def storage_estudio(tipo=None, archivo_base=None):
+    """
+    Storage local del estudio, por STUDY_NAME:
+      - 'journal': resultados/{archivo_base}.journal (JournalFileBackend, con
+        lock de archivo; lo comparten procesos de la misma máquina)
+      - 'sqlite': resultados/{archivo_base}.db
+      - None: en memoria (no se reanuda ni admite workers)
+    """
+    tipo = OPTUNA_STORAGE if tipo is None else tipo
+    if archivo_base is None:
+        archivo_base = STUDY_NAME
+    if not tipo:
+        return None
+
+    os.makedirs("resultados", exist_ok=True)
+    if tipo == 'journal':
+        from optuna.storages import JournalStorage
+        from optuna.storages.journal import JournalFileBackend
+        return JournalStorage(JournalFileBackend(f"resultados/{archivo_base}.journal"))
+    if tipo == 'sqlite':
+        return f"sqlite:///resultados/{archivo_base}.db"
+    raise ValueError(f"OPTUNA_STORAGE desconocido: {tipo} (usar 'journal', 'sqlite' o null)")
+
+
+def _semilla_sampler(existentes: int, indice=None) -> int:
+    """
+    Semilla del TPESampler. Un estudio nuevo usa la de siempre; al retomar (o
+    en cada worker) se deriva de la cantidad de trials ya existentes y del
+    worker, porque con la misma semilla el muestreo aleatorio inicial
+    repetiría los parámetros de los primeros trials.
+    """
+    semilla = SEMILLA[0] if isinstance(SEMILLA, list) else SEMILLA
+    if existentes == 0 and indice is None:
+        return semilla
+    claves = [semilla, existentes] + ([indice] if indice is not None else [])
+    return int(np.random.SeedSequence(claves).generate_state(1)[0])
+
+
+def _reencolar_interrumpidos(study, storage) -> int:
+    """
+    Trials que quedaron RUNNING de una corrida que murió: se marcan FAIL y sus
+    parámetros vuelven a la cola, así el estudio los reintenta. Sólo se llama
+    al arrancar, antes de lanzar los workers (ninguno corre todavía).
+    """
+    interrumpidos = study.get_trials(deepcopy=False, states=(optuna.trial.TrialState.RUNNING,))
+    if not interrumpidos:
+        return 0
+    study_id = storage.get_study_id_from_name(study.study_name)
+    for t in interrumpidos:
+        trial_id = storage.get_trial_id_from_study_id_trial_number(study_id, t.number)
+        storage.set_trial_state_values(trial_id, optuna.trial.TrialState.FAIL)
+        study.enqueue_trial(t.params)
+    logger.warning(f"{len(interrumpidos)} trials interrumpidos de una corrida anterior vuelven a la cola")
+    return len(interrumpidos)
+
+
+def _correr_trial(study, trial, objetivo):
+    """
+    Corre un trial pedido con study.ask y lo informa al estudio como lo
+    haría study.optimize (COMPLETE, PRUNED o FAIL).
+    """
+    try:
+        valor = objetivo(trial)
+    except optuna.TrialPruned:
+        study.tell(trial, state=optuna.trial.TrialState.PRUNED)
+    except Exception:
+        study.tell(trial, state=optuna.trial.TrialState.FAIL)
+        raise
     else:
-        datos_existentes = []
+        study.tell(trial, valor)
+
 
-    # Agregar nueva iteración a los datos existentes
-    datos_existentes.append(iteracion_data)
+def _trabajador(indice, tipo_storage, study_name, datos, n_trials, encolado, existentes, hilos, logs):
+    """
+    Worker del modo multiproceso: abre el estudio compartido y el Dataset
+    binneado (binario del cache, sin volver a binnear) y corre trials con
+    'hilos' threads de LightGBM. 'datos' es la salida de preparar_datos_cv
+    sin el Dataset.
 
-    # Guardar nuevamente en el archivo
-    with open(archivo, 'w') as f:
-        json.dump(datos_existentes, f, indent=4)
+    Cada trial se toma bajo un lock de archivo compartido por los workers:
+    sólo si con los terminados y los que están corriendo no se llega a
+    'n_trials' o, con 'encolado', sólo si queda un trial en la cola (así
+    en una promoción no se corren trials propuestos por el sampler).
+
+    'logs' son los archivos de log de la corrida: el worker (spawn) no hereda
+    los handlers y agrega sus líneas a esos mismos archivos.
+    """
+    handlers = [logging.StreamHandler()] + [logging.FileHandler(a, mode="a", encoding="utf-8") for a in logs]
+    logging.basicConfig(level=logging.INFO, handlers=handlers, force=True,
+                        format=f'%(asctime)s - %(levelname)s - worker {indice} - %(name)s %(lineno)d - %(message)s')
+    study = optuna.load_study(
+        study_name=study_name,
+        storage=storage_estudio(tipo_storage),
+        # Semilla distinta por worker: con la misma, todos propondrían lo mismo
+        sampler=optuna.samplers.TPESampler(seed=_semilla_sampler(existentes, indice)),
+        pruner=crear_pruner()
+    )
+    datos = {**datos, 'dataset': lgb.Dataset(datos['archivo'], params=params_dataset()).construct()}
+    objetivo = lambda trial: objetivo_ganancia_pesos_cv(trial, None, datos, hilos=hilos)
+
+    while True:
+        with open(f"resultados/{study_name}.lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if encolado:
+                queda = bool(study.get_trials(deepcopy=False, states=(optuna.trial.TrialState.WAITING,)))
+            else:
+                ocupados = study.get_trials(deepcopy=False,
+                                            states=_TERMINADOS + (optuna.trial.TrialState.RUNNING,))
+                queda = len(ocupados) < n_trials
+            if not queda:
+                break
+            trial = study.ask()
+        _correr_trial(study, trial, objetivo)
 
-    logger.info(f"Iteración CV {trial.number} guardada - Ganancia: {ganancia_maxima:,.0f}")
 
 def optimizar_con_cv(df, n_trials=3) -> optuna.Study:
     """
     Ejecuta optimización bayesiana con Cross Validation.
+
+    Con una sola fidelidad (OPTUNA_SUBMUESTREO) corre 'n_trials' en ella. Con
+    varias, el estudio corre en la primera y los OPTUNA_SUBMUESTREO['top']
+    mejores trials completos pasan a la siguiente, donde se reevalúan con
+    los mismos parámetros (un estudio por fidelidad, ver nombre_estudio).
   
     Args:
         df: DataFrame con datos
-        n_trials: Número de trials a ejecutar
+        n_trials: Número de trials a ejecutar (en la primera fidelidad)
   
     Returns:
-        optuna.Study: Estudio de Optuna con resultados de CV
+        optuna.Study: Estudio de Optuna con resultados de CV (el de la última fidelidad)
+    """
+    fidelidades = fidelidades_optimizacion()
+    study = _optimizar_estudio(df, n_trials, fidelidades[0])
+    for fidelidad in fidelidades[1:]:
+        completos = study.get_trials(deepcopy=False, states=(optuna.trial.TrialState.COMPLETE,))
+        mejores = sorted(completos, key=lambda t: t.value, reverse=True)[:int(OPTUNA_SUBMUESTREO['top'])]
+        logger.info(f"Pasan {len(mejores)} trials de {study.study_name} a la fidelidad {fidelidad:g}: "
+                    f"{[t.number for t in mejores]}")
+        study = _optimizar_estudio(df, len(mejores), fidelidad, encolar=[t.params for t in mejores])
+    return study
+
+
+def _optimizar_estudio(df, n_trials, fidelidad, encolar=None) -> optuna.Study:
+    """
+    Corre (o retoma) el estudio de una fidelidad hasta tener 'n_trials'
+    terminados. Con 'encolar' los trials son esos parámetros (los que
+    todavía no estén en el estudio) en lugar de los que propone el sampler.
     """
-    study_name = f"{STUDY_NAME}"
+    workers = max(1, int(OPTUNA_WORKERS or 1))
+    storage = storage_estudio()
+    if storage is not None:
+        storage = optuna.storages.get_storage(storage)
+    elif workers > 1:
+        logger.warning("OPTUNA_WORKERS > 1 necesita OPTUNA_STORAGE; se corre con un solo proceso")
+        workers = 1
+
+    # El Dataset se binnea una sola vez; los trials sólo cambian el booster
+    datos = preparar_datos_cv(df, fidelidad)
+    study_name = nombre_estudio(fidelidad, datos['huella'])
   
-    # Crear estudio
+    # Crear estudio (o retomarlo del storage si ya existe)
     study = optuna.create_study(
         direction='maximize',
         study_name=study_name,
-        sampler=optuna.samplers.TPESampler(seed=SEMILLA[0] if isinstance(SEMILLA, list) else SEMILLA)
+        storage=storage,
+        load_if_exists=True,
+        sampler=optuna.samplers.TPESampler(seed=SEMILLA[0] if isinstance(SEMILLA, list) else SEMILLA),
+        pruner=crear_pruner()
     )
-  
+    previa = study.user_attrs.get('huella_datos')
+    if previa is None:
+        study.set_user_attr('huella_datos', datos['huella'])
+    elif previa != datos['huella']:
+        raise RuntimeError(f"El estudio {study_name} es de otros datos (huella {previa}, ahora {datos['huella']}); "
+                           f"no se retoma")
+    if storage is not None:
+        _reencolar_interrumpidos(study, storage)
+    existentes = len(study.trials)
+    if existentes:
+        study.sampler = optuna.samplers.TPESampler(seed=_semilla_sampler(existentes))
+    completos = len(study.get_trials(deepcopy=False, states=_TERMINADOS))
+    if encolar is not None:
+        # Al retomar, los parámetros ya evaluados no se repiten
+        for params in encolar:
+            study.enqueue_trial(params, skip_if_exists=True)
+        n_trials = completos + len(study.get_trials(deepcopy=False, states=(optuna.trial.TrialState.WAITING,)))
+    restantes = max(0, n_trials - completos)
+    logger.info(f"Estudio {study_name} (CONTINUA al {fidelidad:.0%}): {completos} trials terminados, "
+                f"faltan {restantes} ({workers} worker{'s' if workers > 1 else ''})")
+
     # Ejecutar optimización
-    study.optimize(lambda trial: objetivo_ganancia_pesos_cv(trial, df), n_trials=n_trials)
+    if restantes and workers == 1:
+        study.optimize(lambda trial: objetivo_ganancia_pesos_cv(trial, df, datos), n_trials=restantes)
+    elif restantes:
+        # Procesos nuevos (spawn): cada uno abre el binario del Dataset y usa
+        # su parte de los cores en LightGBM, así no se sobresuscribe la máquina
+        hilos = max(1, (os.cpu_count() or 1) // workers)
+        ctx = multiprocessing.get_context("spawn")
+        datos_worker = {k: v for k, v in datos.items() if k != 'dataset'}
+        logs = [h.baseFilename for h in logging.getLogger().handlers if isinstance(h, logging.FileHandler)]
+        procesos = [
+            ctx.Process(target=_trabajador,
+                        args=(i, OPTUNA_STORAGE, study_name, datos_worker,
+                              n_trials, encolar is not None, existentes, hilos, logs))
+            for i in range(min(workers, restantes))
+        ]
+        for p in procesos:
+            p.start()
+        for p in procesos:
+            p.join()
+        fallidos = [i for i, p in enumerate(procesos) if p.exitcode != 0]
+        if fallidos:
+            raise RuntimeError(f"Workers de Optuna terminaron con error: {fallidos}")
+        study = optuna.load_study(study_name=study_name, storage=storage)
   
-    # Resultados
+    # Resultados (best_value es siempre de un trial COMPLETE)
+    podados = len(study.get_trials(deepcopy=False, states=(optuna.trial.TrialState.PRUNED,)))
+    logger.info(f"Trials podados: {podados} de {len(study.trials)}")
     logger.info(f"Mejor ganancia: {study.best_value:,.0f}")
     logger.info(f"Mejores parámetros: {study.best_params}")
     logger.info(f"Mejores parámetros: {study.best_params}")
@@ -150,7 +518,7 @@ def optimizar_con_cv(df, n_trials=3) -> optuna.Study:
     return study
 
 
-def objetivo_ganancia_pesos_cv(trial, df) -> float:
+def objetivo_ganancia_pesos_cv(trial, df, datos=None, hilos=None) -> float:
     """
     Función objetivo para Optuna con Cross Validation.
     Utiliza SEMILLA[0] desde configuración para reproducibilidad.
@@ -158,6 +526,8 @@ def objetivo_ganancia_pesos_cv(trial, df) -> float:
     Args:
         trial: Trial de Optuna
         df: DataFrame con datos
+        datos: Salida de preparar_datos_cv (None = armarla en este trial)
+        hilos: num_threads de LightGBM (None = los de LightGBM por defecto)
   
     Returns:
         float: Ganancia promedio del CV
@@ -169,50 +539,47 @@ def objetivo_ganancia_pesos_cv(trial, df) -> float:
         'boosting_type': 'gbdt',
         'first_metric_only': True,
         'boost_from_average': True,
-        'feature_pre_filter': False,
         'num_leaves': trial.suggest_int('num_leaves', PARAMETROS_LGB['num_leaves']["min"], PARAMETROS_LGB["num_leaves"]["max"]),
         'min_data_in_leaf': trial.suggest_int('min_data_in_leaf', PARAMETROS_LGB['min_data_in_leaf']["min"], PARAMETROS_LGB["min_data_in_leaf"]["max"]),
         'learning_rate': trial.suggest_float('learning_rate', PARAMETROS_LGB['learning_rate']["min"], PARAMETROS_LGB['learning_rate']["max"], log=True),
         'feature_fraction': trial.suggest_float('feature_fraction', PARAMETROS_LGB['feature_fraction']["min"], PARAMETROS_LGB['feature_fraction']["max"]),
         'bagging_fraction': trial.suggest_float('bagging_fraction', PARAMETROS_LGB['bagging_fraction']["min"], PARAMETROS_LGB['bagging_fraction']["max"]),
-        'max_bin': 31,
-        'seed': SEMILLA[0],  # Desde configuración YAML
-        'verbosity': -1
+        **params_dataset()  # max_bin, seed (SEMILLA[0]) y demás fijos del binning
     }
+    if hilos:
+        params['num_threads'] = int(hilos)
 
-    # Preparar datos para CV
-    df_cv = df[df['foto_mes'].isin(MES_TRAIN)]
-
-    # Features y target
-    X_train = df_cv.drop(['clase_ternaria', 'clase_peso', 'clase_binaria2'], axis=1)
-    y_train = df_cv['clase_binaria2']
-    w_train = df_cv['clase_peso']
-  
-    # Crear dataset de LightGBM
-    dataset = lgb.Dataset(X_train, label=y_train, weight=w_train)
+    # Dataset binneado de MES_TRAIN (features seleccionadas) y ganancia por fila
+    if datos is None:
+        datos = preparar_datos_cv(df)
+    dataset, ganancia = datos['dataset'], datos['ganancia']
+    trial.set_user_attr('fidelidad', datos['fidelidad'])
+    trial.set_user_attr('filas_entrenamiento', datos['filas_entrenamiento'])
+    trial.set_user_attr('huella_datos', datos['huella'])
   
     # Configurar CV con semilla desde configuración
     cv_results = lgb.cv(
         params,
         dataset,
         num_boost_round=4000,
-        nfold=5,
+        nfold=NFOLD,
         seed= SEMILLA[0] if isinstance(SEMILLA, list) else SEMILLA,
         stratified=True,
-        feval=ganancia_pesos,
-        callbacks=[lgb.early_stopping(50), lgb.log_evaluation(0)]
+        feval=crear_ganancia_topk(ganancia),
+        callbacks=[lgb.early_stopping(50), lgb.log_evaluation(0), callback_poda(trial)]
     )
   
     # Extraer ganancia promedio y max
-    max_gan = max(cv_results['valid gan_eval-mean'])
+    ganancias_cv = cv_results['valid gan_eval-mean']
+    max_gan = max(ganancias_cv)
 
     # Mejor iteración
-    best_iteration = cv_results['valid gan_eval-mean'].index(max_gan) + 1
+    best_iteration = ganancias_cv.index(max_gan) + 1
 
     logger.debug(f"Trial {trial.number}: Ganancia CV = {max_gan:,.0f}")
     logger.debug(f"Trial {trial.number}: Mejor iteración = {best_iteration}")
 
     # Guardar iteración para análisis posterior
-    guardar_iteracion_cv(trial, max_gan, best_iteration=best_iteration)
+    guardar_iteracion_cv(trial, max_gan, ganancias_cv, best_iteration=best_iteration)
 
-    return max_gan * 5
+    return max_gan * NFOLD
@@ -1,5 +1,7 @@
 import pandas as pd
+import duckdb
 import os
+import shutil
 import logging
 from datetime import datetime
 from .config import STUDY_NAME
@@ -45,4 +47,142 @@ def guardar_predicciones_finales(resultados_df: pd.DataFrame, nombre_archivo=Non
     logger.info(f"  Primeras filas:")
     logger.info(f"{resultados_df.head()}")
   
-    return ruta_archivo
\ No newline at end of file
+    return ruta_archivo
+
+
+def guardar_dataset_parquet(rel: duckdb.DuckDBPyRelation,
+                            destino: str,
+                            con: duckdb.DuckDBPyConnection,
+                            particion: str = 'foto_mes',
+                            row_group_size: int = 122880,
+                            compresion: str = 'zstd') -> str:
+    """
+    Escribe una relación DuckDB como dataset Parquet particionado por
+    'particion' (destino/foto_mes=AAAAMM/*.parquet), directamente desde
+    DuckDB y sin pasar por pandas. Los lectores pueden después leer sólo
+    los meses y columnas que necesitan (ej. loader.leer_parquet_particionado
+    o read_parquet('destino/*/*.parquet', hive_partitioning = true)).
+
+    Se escribe en un directorio temporal y recién al final se reemplaza
+    'destino', así una corrida interrumpida no deja un dataset a medias.
+
+    Args:
+        rel: Relación a escribir (se ejecuta acá)
+        destino: Directorio del dataset
+        con: Conexión de la relación
+        particion: Columna de partición
+        row_group_size: Filas por row group
+        compresion: Códec Parquet (zstd, snappy, gzip, uncompressed)
+
+    Returns:
+        str: Directorio del dataset escrito
+    """
+    tmp_dir = f"{destino}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    nombre = "salida_dataset"
+    rel.create_view(nombre, replace=True)
+    try:
+        con.execute(f"""
+            COPY {nombre} TO '{tmp_dir}'
+            (FORMAT PARQUET, PARTITION_BY ({particion}),
+             ROW_GROUP_SIZE {int(row_group_size)}, COMPRESSION {compresion})
+        """)
+    finally:
+        con.execute(f"DROP VIEW IF EXISTS {nombre}")
+
+    shutil.rmtree(destino, ignore_errors=True)
+    os.replace(tmp_dir, destino)
+
+    particiones = [d for d in os.listdir(destino) if d.startswith(f"{particion}=")]
+    logger.info(f"Dataset guardado en {destino}/ ({len(particiones)} particiones por {particion})")
+    return destino
+
+
+def tamanio_en_disco(ruta: str) -> int:
+    """
+    Bytes de un archivo o de todos los archivos de un directorio (con
+    subdirectorios, ej. particiones foto_mes=AAAAMM).
+    """
+    if not os.path.isdir(ruta):
+        return os.path.getsize(ruta)
+    return sum(os.path.getsize(os.path.join(raiz, f)) for raiz, _, archivos in os.walk(ruta) for f in archivos)
+
+
+def publicar_dataset(origen: str, destino: str) -> str:
+    """
+    Publica en 'destino' un dataset particionado ya escrito en 'origen' (ej.
+    la entrada del cache de la última etapa) con hardlinks, sin volver a
+    escribir los Parquet. Si 'destino' está en otro filesystem se copian.
+    Como guardar_dataset_parquet, reemplaza 'destino' recién al final; y
+    como agregar_particion_parquet reemplaza particiones en lugar de
+    reescribir archivos, modificar 'destino' después no toca 'origen'.
+
+    Args:
+        origen: Directorio del dataset escrito
+        destino: Directorio a publicar
+
+    Returns:
+        str: Directorio publicado
+    """
+    tmp_dir = f"{destino}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    try:
+        shutil.copytree(origen, tmp_dir, copy_function=os.link)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        shutil.copytree(origen, tmp_dir)
+
+    shutil.rmtree(destino, ignore_errors=True)
+    os.replace(tmp_dir, destino)
+    logger.info(f"Dataset publicado en {destino}/ desde {origen}")
+    return destino
+
+
+def agregar_particion_parquet(rel: duckdb.DuckDBPyRelation,
+                              destino: str,
+                              con: duckdb.DuckDBPyConnection,
+                              particion: str = 'foto_mes',
+                              row_group_size: int = 122880,
+                              compresion: str = 'zstd') -> list:
+    """
+    Agrega (o reemplaza) particiones de un dataset escrito con
+    guardar_dataset_parquet sin reescribir las demás: cada valor de
+    'particion' presente en 'rel' reemplaza su directorio destino/particion=valor.
+
+    Args:
+        rel: Relación con las filas nuevas (se ejecuta acá)
+        destino: Directorio del dataset existente
+        con: Conexión de la relación
+        particion: Columna de partición
+        row_group_size: Filas por row group
+        compresion: Códec Parquet
+
+    Returns:
+        list: Directorios de partición escritos
+    """
+    tmp_dir = f"{destino}.parcial.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    nombre = "salida_particion"
+    rel.create_view(nombre, replace=True)
+    try:
+        con.execute(f"""
+            COPY {nombre} TO '{tmp_dir}'
+            (FORMAT PARQUET, PARTITION_BY ({particion}),
+             ROW_GROUP_SIZE {int(row_group_size)}, COMPRESSION {compresion})
+        """)
+    finally:
+        con.execute(f"DROP VIEW IF EXISTS {nombre}")
+
+    os.makedirs(destino, exist_ok=True)
+    escritas = []
+    for d in sorted(os.listdir(tmp_dir)):
+        final = os.path.join(destino, d)
+        shutil.rmtree(final, ignore_errors=True)
+        os.replace(os.path.join(tmp_dir, d), final)
+        escritas.append(final)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    logger.info(f"Particiones agregadas a {destino}/: {[os.path.basename(d) for d in escritas]}")
+    return escritas
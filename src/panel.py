@@ -0,0 +1,516 @@
+import logging
+import os
+import shutil
+import tempfile
+import duckdb
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+from .esquema import COLUMNAS_CLAVE, columnas_iguales, tipos_columnas
+from .features import planificar_ventanas, nombres_plan, sql_desde_plan
+from .pipeline import Datos, registrar_entrada, abrir_conexion
+
+logger = logging.getLogger(__name__)
+
+# Tipos SQL que un float32 representa sin pérdida (el resto va en float64)
+_TIPOS_EXACTOS_FLOAT32 = {'FLOAT', 'TINYINT', 'SMALLINT', 'UTINYINT', 'USMALLINT'}
+
+# Memoria de trabajo de un bloque de atributos pasado a float64 en una tanda
+# de clientes (ver _calcular_panel); _rolling arma varias tablas de ese tamaño
+_BYTES_TANDA = 32 * 1024 ** 2
+
+# Mayor entero que float32 representa de forma exacta
+_MAX_ENTERO_FLOAT32 = 2 ** 24
+
+
+def ventanas_tensor(df: Datos,
+                    columnas: List[str],
+                    espec: Dict,
+                    con: Optional[duckdb.DuckDBPyConnection] = None,
+                    reordenar: bool = True,
+                    directorio: Optional[str] = None,
+                    bloque: int = 32) -> Datos:
+    """
+    Motor tensorial de feature_engineering_ventanas.
+
+    Pivotea los atributos una sola vez a un arreglo (cliente, posición,
+    atributo) en un memmap, donde la posición es el número de mes del
+    cliente (igual que las ventanas SQL, que cuentan filas del cliente y no
+    meses calendario). Los lags son vistas desplazadas del mismo arreglo y
+    las rolling salen de sumas acumuladas por cliente (ver _rolling); al
+    final se aplana de vuelta al formato largo.
+
+    Los tipos de salida se toman de la consulta SQL equivalente (sólo se
+    bindea, no se ejecuta), así el resultado tiene las mismas columnas y
+    dtypes que el motor SQL. Lags, deltas, min y max coinciden exactamente;
+    media, std, cv, pendiente y ratios pueden diferir en el último bit del
+    FLOAT (acá salen de sumas acumuladas, DuckDB los acumula por frame).
+
+    Con una relación sólo se llevan a pandas las claves y los atributos del
+    plan, y el resultado se une a la relación de entrada por (cliente, mes):
+    como el SQL, no conserva el orden de las filas de la entrada.
+
+    Args:
+        df: DataFrame o relación con 'numero_de_cliente' y 'foto_mes'
+        columnas: Atributos a procesar
+        espec: Especificación de ventanas (ver features.ESPEC_VENTANAS)
+        con: Conexión de la sesión (obligatoria si df es una relación)
+        reordenar: Ver features.planificar_ventanas
+        directorio: Dónde crear el memmap (None = directorio temporal del sistema)
+        bloque: Atributos procesados por vez (acota la memoria de trabajo)
+
+    Returns:
+        DataFrame (o relación, si df era relación) con las features agregadas
+    """
+    con, own_con = abrir_conexion(df, con)
+    tabla, es_relacion = registrar_entrada(df, con, "fe_tensor")
+    registradas = [] if es_relacion else [tabla]
+    tipos = tipos_columnas(con, tabla)
+
+    plan = planificar_ventanas(tipos, columnas, espec, reordenar, solo_numericas=True)
+    if plan is None:
+        for t in registradas:
+            con.unregister(t)
+        if own_con:
+            con.close()
+        return df
+
+    # Tipos de salida: los de la consulta SQL equivalente
+    rel_sql = con.sql(sql_desde_plan(tabla, tipos, plan))
+    destino = {c: str(t) for c, t in zip(rel_sql.columns, rel_sql.types)}
+
+    # De una relación sólo pasan a pandas las claves y los atributos del plan;
+    # las columnas nuevas vuelven a la relación por (cliente, mes), que no
+    # depende del orden en que DuckDB vuelva a leer la entrada
+    if es_relacion:
+        proyeccion = ', '.join(f'"{c}"' for c in COLUMNAS_CLAVE + plan['numericas'])
+        datos = con.sql(f"SELECT {proyeccion} FROM {tabla}").df()
+    else:
+        datos = df
+
+    nuevas = _calcular_panel(datos, tipos, plan, destino, directorio, bloque)
+    columnas_nuevas = list(nuevas.columns)
+
+    tabla_nuevas = f"{tabla}_nuevas"
+    if es_relacion:
+        for c in COLUMNAS_CLAVE:
+            nuevas[c] = datos[c].to_numpy()
+    con.register(tabla_nuevas, nuevas)
+    registradas.append(tabla_nuevas)
+
+    select = [f'b."{c}"' for c in plan['base']]
+    select += [f'CAST(n."{c}" AS {destino[c]}) AS "{c}"' for c in columnas_nuevas]
+    if es_relacion:
+        union = ' AND '.join(f'b."{c}" = n."{c}"' for c in COLUMNAS_CLAVE)
+        query = f"SELECT {', '.join(select)} FROM {tabla} b JOIN {tabla_nuevas} n ON {union}"
+    else:
+        query = f"SELECT {', '.join(select)} FROM {tabla} b POSITIONAL JOIN {tabla_nuevas} n"
+
+    try:
+        if es_relacion:
+            df_out = con.sql(query)
+        else:
+            df_out = con.execute(query).df()
+            for t in registradas:
+                con.unregister(t)
+    finally:
+        if own_con:
+            con.close()
+
+    return df_out
+
+
+def verificar_motores(df: Datos,
+                      columnas: List[str],
+                      espec: Dict,
+                      con: duckdb.DuckDBPyConnection,
+                      clientes: int = 5000,
+                      tolerancia: float = 1e-6) -> bool:
+    """
+    Calcula las ventanas con el motor SQL y con el tensorial sobre una
+    muestra fija de clientes (toda su historia) y compara columna por
+    columna: NULL en las mismas filas y, en los decimales (media, std, cv,
+    pendiente, ratios), una diferencia relativa a la escala de la columna.
+
+    Args:
+        df: DataFrame o relación con 'numero_de_cliente' y 'foto_mes'
+        columnas: Atributos a procesar
+        espec: Especificación de ventanas
+        con: Conexión de la sesión
+        clientes: Clientes de la muestra (los de menor hash de numero_de_cliente)
+        tolerancia: Diferencia relativa admitida en los decimales
+
+    Returns:
+        bool: True si coinciden todas las columnas
+    """
+    from .features import feature_engineering_ventanas
+
+    tabla, es_relacion = registrar_entrada(df, con, "verif_motor")
+    try:
+        muestra = con.sql(f"""
+            SELECT * FROM {tabla}
+            WHERE numero_de_cliente IN (
+                SELECT numero_de_cliente FROM (SELECT DISTINCT numero_de_cliente FROM {tabla})
+                ORDER BY hash(numero_de_cliente) LIMIT {int(clientes)})
+        """)
+        resultados = {}
+        for motor in ('sql', 'tensor'):
+            salida = feature_engineering_ventanas(muestra, columnas, espec, con=con, motor=motor)
+            resultados[motor] = salida.order("numero_de_cliente, foto_mes").df()
+    finally:
+        if not es_relacion:
+            con.unregister(tabla)
+
+    sql, tensor = resultados['sql'], resultados['tensor']
+    if list(sql.columns) != list(tensor.columns) or len(sql) != len(tensor):
+        logger.error(f"Motores SQL y tensorial: columnas o filas distintas ({sql.shape} vs {tensor.shape})")
+        return False
+
+    distintas = [c for c in sql.columns if not columnas_iguales(sql[c], tensor[c], tolerancia)]
+    if distintas:
+        logger.error(f"Motores SQL y tensorial: {len(distintas)} columnas difieren en {len(sql)} filas: "
+                     f"{distintas[:10]}")
+        return False
+
+    logger.info(f"Motores SQL y tensorial coinciden ({sql.shape[1]} columnas, {len(sql)} filas)")
+    return True
+
+
+def _calcular_panel(datos: pd.DataFrame,
+                    tipos: dict,
+                    plan: Dict,
+                    destino: Dict[str, str],
+                    directorio: Optional[str],
+                    bloque: int) -> pd.DataFrame:
+    """
+    Arma el tensor (cliente, posición, atributo) y calcula las features del
+    plan. Devuelve un DataFrame con las columnas nuevas, alineado con las
+    filas de 'datos' (NaN = NULL).
+    """
+    espec = plan['espec']
+    cols = plan['numericas']
+    n = len(datos)
+
+    # Posición de cada fila dentro de su cliente (orden cliente, mes)
+    clientes = datos['numero_de_cliente'].to_numpy()
+    meses = datos['foto_mes'].to_numpy().astype(np.int64)
+    orden = np.lexsort((meses, clientes))
+    cli_ord = clientes[orden]
+    inicio = np.r_[True, cli_ord[1:] != cli_ord[:-1]] if n else np.zeros(0, dtype=bool)
+    idx_cli = np.cumsum(inicio) - 1
+    pos = np.arange(n) - np.flatnonzero(inicio)[idx_cli]
+    n_cli = int(idx_cli[-1]) + 1 if n else 0
+    largo = int(pos.max()) + 1 if n else 0
+
+    # Relleno al inicio: los lags y ventanas que miran antes del primer mes
+    # del cliente leen NaN, igual que lag()/frames en SQL
+    pad = max([k for _, k in plan['lags_internos']]
+              + [n_ - 1 for n_ in espec['rolling'] + espec['ratio_media'] + espec['activos']]
+              + [espec['recencia'] - 1, 0])
+
+    dtype = np.float32 if _alcanza_float32(datos, tipos, cols) else np.float64
+    logger.info(f"Panel: {n_cli} clientes x {largo} meses x {len(cols)} atributos ({np.dtype(dtype).name})")
+
+    tmp_dir = tempfile.mkdtemp(prefix="panel_", dir=directorio)
+    try:
+        tensor = np.memmap(os.path.join(tmp_dir, "panel.dat"), dtype=dtype, mode="w+",
+                           shape=(n_cli, pad + largo, len(cols)))
+        tensor[:] = np.nan
+        for j, c in enumerate(cols):
+            tensor[idx_cli, pad + pos, j] = datos[c].to_numpy(dtype=np.float64, na_value=np.nan)[orden]
+
+        periodo = np.full((n_cli, pad + largo), np.nan)
+        periodo[idx_cli, pad + pos] = (meses // 100 * 12 + meses % 100)[orden]
+
+        # Columnas de salida en su tipo final (las medias auxiliares de
+        # ratio_media no salen: se usan dentro de la tanda)
+        nombres = nombres_plan(plan)
+        resultados = {c: np.empty(n, dtype=np.float32 if destino[c] in _TIPOS_EXACTOS_FLOAT32 else np.float64)
+                      for c in nombres}
+
+        # Tandas de clientes: los bloques de atributos pasan a float64 (y
+        # _rolling arma sus acumuladas, mínimos y máximos) sólo para los
+        # clientes de la tanda, así la memoria de trabajo no crece con el panel
+        ancho = (pad + largo) * min(bloque, max(len(cols), 1)) * 8
+        por_tanda = max(1, _BYTES_TANDA // max(ancho, 1))
+        primera_fila = np.flatnonzero(inicio)
+
+        for c0 in range(0, n_cli, por_tanda):
+            c1 = min(c0 + por_tanda, n_cli)
+            r0, r1 = primera_fila[c0], (primera_fila[c1] if c1 < n_cli else n)
+            filas = orden[r0:r1]
+            cli_t, pos_t = idx_cli[r0:r1] - c0, pos[r0:r1]
+            tensor_t, periodo_t = tensor[c0:c1], periodo[c0:c1]
+
+            def aplanar(arr: np.ndarray) -> np.ndarray:
+                # (cliente, posición, atributo) -> (fila de la tanda, atributo)
+                return arr[cli_t, pos_t]
+
+            def escribir(nombre: str, valores: np.ndarray):
+                if nombre in resultados:
+                    resultados[nombre][filas] = valores
+
+            def vista(k: int, j0: int, j1: int) -> np.ndarray:
+                # Valores k meses atrás (k = 0: el mes actual)
+                return tensor_t[:, pad - k:pad - k + largo, j0:j1]
+
+            for j0 in range(0, len(cols), bloque):
+                j1 = min(j0 + bloque, len(cols))
+                bloque_cols = cols[j0:j1]
+                actual = np.asarray(vista(0, j0, j1), dtype=np.float64)
+
+                lags_bloque = {k for c, k in plan['lags_internos'] if c in bloque_cols}
+                for k in sorted(lags_bloque):
+                    lag = aplanar(np.asarray(vista(k, j0, j1)))
+                    for i, c in enumerate(bloque_cols):
+                        escribir(f"{c}_lag_{k}", lag[:, i])
+
+                for k in range(1, espec['deltas'] + 1):
+                    delta = aplanar(actual - np.asarray(vista(k, j0, j1), dtype=np.float64))
+                    for i, c in enumerate(bloque_cols):
+                        escribir(f"{c}_delta_{k}", delta[:, i])
+
+                pedidos = {}
+                for n_ in sorted(set(espec['rolling']) | set(espec['ratio_media'])):
+                    pedidos[n_] = list(espec['estadisticos']) if n_ in espec['rolling'] else []
+                    if n_ in espec['ratio_media'] and 'media' not in pedidos[n_]:
+                        pedidos[n_].append('media')
+                medias = {}
+                if pedidos:
+                    for (est, n_), arr in _rolling(tensor_t, periodo_t, pad, largo, j0, j1, pedidos).items():
+                        plano = aplanar(arr)
+                        if est == 'media':
+                            medias[n_] = plano
+                        for i, c in enumerate(bloque_cols):
+                            escribir(f"{c}_{est}_{n_}", plano[:, i])
+
+                if espec['ratio_media']:
+                    # Como en SQL: col y media en FLOAT y división redondeada a FLOAT
+                    actual_plano = aplanar(actual).astype(np.float32).astype(np.float64)
+                for n_ in espec['ratio_media']:
+                    media = medias[n_].astype(np.float32).astype(np.float64)
+                    with np.errstate(divide='ignore', invalid='ignore'):
+                        ratio = np.where(media == 0, np.nan, actual_plano / media)
+                    for i, c in enumerate(bloque_cols):
+                        escribir(f"{c}_ratio_media_{n_}", ratio[:, i])
+
+                eventos = [i for i, c in enumerate(bloque_cols)
+                           if c in plan['recencia'] or any(c == c_ for c_, _ in plan['activos'])]
+                if eventos:
+                    sub = np.asarray(tensor_t[:, :, j0:j1][:, :, eventos], dtype=np.float64)
+                    for (f, n_), arr in _eventos(sub, periodo_t, pad, largo, espec).items():
+                        plano = aplanar(arr)
+                        for i, k in enumerate(eventos):
+                            escribir(f"{bloque_cols[k]}_{f}" if n_ is None else f"{bloque_cols[k]}_{f}_{n_}",
+                                     plano[:, i])
+
+        del tensor
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return pd.DataFrame(resultados, columns=nombres)
+
+
+def _rolling(tensor: np.ndarray,
+             periodo: np.ndarray,
+             pad: int,
+             largo: int,
+             j0: int,
+             j1: int,
+             pedidos: Dict[int, List[str]]) -> Dict[Tuple[str, int], np.ndarray]:
+    """
+    Estadísticos de los últimos n meses de cada (cliente, posición) para los
+    atributos j0:j1 y todas las ventanas pedidas ({n: [estadísticos]}).
+
+    Std y pendiente salen de sumas acumuladas a lo largo del mes
+    del cliente (cantidad, Σy, Σy², Σx, Σx², Σxy): la suma de una ventana es
+    la resta de dos acumuladas, así que cada ventana cuesta lo mismo sin
+    importar n y las acumuladas se comparten entre ventanas. Para acotar la
+    cancelación de Σy² - (Σy)²/n los valores se centran por (cliente,
+    atributo) y el mes por cliente. Min y max se arman por duplicación
+    (mínimos de 1, 2, 4... meses), con log2(n) pasadas.
+
+    La media (y con ella el cv) sale de la suma directa de los n meses, no
+    de las acumuladas centradas: así una ventana de media 0 da 0 exacto
+    (ej. [-49, NULL, 49]) y el cv es NULL como en SQL, en lugar de una
+    dispersión dividida por el residuo de redondeo.
+
+    Ignora NaN como DuckDB ignora NULL en los agregados. En ventanas con un
+    valor constante std, cv y pendiente valen 0 exacto, como en SQL.
+    """
+    estadisticos = {est for ests in pedidos.values() for est in ests}
+    necesita_y = bool(estadisticos & {'media', 'std', 'cv', 'pendiente'})
+    necesita_media = bool(estadisticos & {'media', 'cv'})
+    necesita_y2 = bool(estadisticos & {'std', 'cv'})
+    necesita_x = 'pendiente' in estadisticos
+    # min/max también marcan las ventanas constantes (dispersión 0 exacta)
+    necesita_extremos = bool(estadisticos & {'min', 'max', 'std', 'cv', 'pendiente'})
+
+    v = np.asarray(tensor[:, :, j0:j1], dtype=np.float64)
+    valido = ~np.isnan(v)
+
+    def acumular(arr: np.ndarray) -> np.ndarray:
+        # Suma acumulada con un 0 al inicio: ventana = acum[q + 1] - acum[q + 1 - n]
+        acum = np.zeros((arr.shape[0], arr.shape[1] + 1, arr.shape[2]))
+        np.cumsum(arr, axis=1, out=acum[:, 1:])
+        return acum
+
+    def ventana(acum: np.ndarray, n: int) -> np.ndarray:
+        return acum[:, pad + 1:pad + 1 + largo] - acum[:, pad + 1 - n:pad + 1 - n + largo]
+
+    def suma_directa(arr: np.ndarray, n: int) -> np.ndarray:
+        # Suma de los meses q-n+1..q sin restar acumuladas (exacta con enteros)
+        suma = arr[:, pad:pad + largo].copy()
+        for k in range(1, n):
+            suma += arr[:, pad - k:pad - k + largo]
+        return suma
+
+    acumuladas = {'cuenta': acumular(valido.astype(np.float64))}
+    if necesita_y:
+        with np.errstate(invalid='ignore'):
+            cuenta_total = valido.sum(axis=1, keepdims=True)
+            centro = np.where(cuenta_total > 0, np.where(valido, v, 0.0).sum(axis=1, keepdims=True)
+                              / np.maximum(cuenta_total, 1), 0.0)
+        y = np.where(valido, v - centro, 0.0)
+        if necesita_media:
+            v_cero = np.where(valido, v, 0.0)
+        acumuladas['y'] = acumular(y)
+        if necesita_y2:
+            acumuladas['yy'] = acumular(y * y)
+        if necesita_x:
+            x = periodo - np.nanmean(periodo, axis=1, keepdims=True)
+            x = np.where(valido, np.nan_to_num(x)[:, :, None], 0.0)
+            acumuladas['x'] = acumular(x)
+            acumuladas['xx'] = acumular(x * x)
+            acumuladas['xy'] = acumular(x * y)
+            del x
+        del y
+
+    if necesita_extremos:
+        # minimos[s][q] = mínimo de los meses q-s+1..q (s potencia de 2)
+        minimos, maximos = {1: v}, {1: v}
+        s = 1
+        while 2 * s <= max(pedidos):
+            mi, ma = minimos[s].copy(), maximos[s].copy()
+            np.fmin(mi[:, s:], minimos[s][:, :-s], out=mi[:, s:])
+            np.fmax(ma[:, s:], maximos[s][:, :-s], out=ma[:, s:])
+            s *= 2
+            minimos[s], maximos[s] = mi, ma
+
+    def extremo(tabla: Dict[int, np.ndarray], n: int, funcion) -> np.ndarray:
+        # Unión de dos ventanas de 2^k meses que cubren los últimos n
+        k = 1 << (n.bit_length() - 1)
+        t = tabla[k]
+        return funcion(t[:, pad:pad + largo], t[:, pad - (n - k):pad - (n - k) + largo])
+
+    salida = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for n, ests in pedidos.items():
+            if not ests:
+                continue
+            cuenta = ventana(acumuladas['cuenta'], n)
+            if necesita_extremos:
+                minimo = extremo(minimos, n, np.fmin)
+                maximo = extremo(maximos, n, np.fmax)
+                constante = minimo == maximo
+            if necesita_y:
+                suma = ventana(acumuladas['y'], n)
+            if necesita_media:
+                media = np.where(cuenta > 0, suma_directa(v_cero, n) / cuenta, np.nan)
+                if necesita_extremos:
+                    media = np.where(constante, minimo, media)
+            if necesita_y2:
+                m2 = np.maximum(ventana(acumuladas['yy'], n) - suma * suma / cuenta, 0.0)
+                std = np.where(cuenta > 1, np.where(constante, 0.0, np.sqrt(m2 / (cuenta - 1))), np.nan)
+
+            for est in ests:
+                if est == 'media':
+                    salida[(est, n)] = media
+                elif est == 'min':
+                    salida[(est, n)] = minimo
+                elif est == 'max':
+                    salida[(est, n)] = maximo
+                elif est == 'std':
+                    salida[(est, n)] = std
+                elif est == 'cv':
+                    salida[(est, n)] = np.where(media == 0, np.nan, std / np.abs(media))
+                elif est == 'pendiente':
+                    sx = ventana(acumuladas['x'], n)
+                    sxx = ventana(acumuladas['xx'], n) - sx * sx / cuenta
+                    sxy = ventana(acumuladas['xy'], n) - sx * suma / cuenta
+                    pendiente = np.where(constante, 0.0, sxy / sxx)
+                    salida[(est, n)] = np.where(cuenta > 1, pendiente, np.nan)
+
+    return salida
+
+
+def _eventos(v: np.ndarray,
+             periodo: np.ndarray,
+             pad: int,
+             largo: int,
+             espec: Dict) -> Dict[Tuple[str, Optional[int]], np.ndarray]:
+    """
+    Recencia, racha de ceros y meses activos (ver features.ESPEC_VENTANAS)
+    de los atributos de 'v' (cliente, posición, atributo) en una sola pasada
+    por el mes del cliente: el último mes activo y el último que corta la
+    racha salen de un máximo acumulado de posiciones, y los meses activos de
+    una suma acumulada (una resta por ventana, como en _rolling).
+
+    Returns:
+        dict: {('recencia', None), ('racha_ceros', None), ('activos', n): arreglo}
+    """
+    activo = ~np.isnan(v) & (v != 0)
+    salida = {}
+
+    if espec['recencia']:
+        h = espec['recencia']
+        existe = ~np.isnan(periodo)[:, :, None]
+        q = np.arange(v.shape[1])[None, :, None]
+        actual = q[:, pad:pad + largo]
+        per = np.broadcast_to(periodo[:, :, None], v.shape)
+        per_actual = per[:, pad:pad + largo]
+
+        def ultimo(marca: np.ndarray) -> np.ndarray:
+            # Posición del último mes marcado hasta cada posición (-1 = ninguno)
+            return np.maximum.accumulate(np.where(marca, q, -1), axis=1)[:, pad:pad + largo]
+
+        ult = ultimo(activo)
+        en_ventana = ult > actual - h
+        salida[('recencia', None)] = np.where(
+            en_ventana, per_actual - np.take_along_axis(per, np.maximum(ult, 0), axis=1), np.nan)
+
+        # La racha la corta un mes con valor distinto de 0 (NULL incluido);
+        # el relleno anterior al primer mes del cliente no la corta
+        corte = ultimo(existe & (v != 0))
+        primero = np.maximum(actual - (h - 1), pad)
+        salida[('racha_ceros', None)] = np.where(
+            corte > actual - h,
+            per_actual - np.take_along_axis(per, np.maximum(corte, 0), axis=1),
+            per_actual - np.take_along_axis(per, primero, axis=1) + 1)
+
+    if espec['activos']:
+        acum = np.zeros((v.shape[0], v.shape[1] + 1, v.shape[2]))
+        np.cumsum(activo, axis=1, out=acum[:, 1:])
+        for n in espec['activos']:
+            salida[('activos', n)] = acum[:, pad + 1:pad + 1 + largo] - acum[:, pad + 1 - n:pad + 1 - n + largo]
+
+    return salida
+
+
+def _alcanza_float32(datos: pd.DataFrame, tipos: dict, cols: List[str]) -> bool:
+    """
+    Indica si todos los atributos entran en float32 sin pérdida: FLOAT y
+    enteros chicos siempre; enteros más anchos sólo si sus valores no
+    superan 2^24.
+    """
+    for c in cols:
+        tipo = tipos[c]
+        if tipo in _TIPOS_EXACTOS_FLOAT32:
+            continue
+        if tipo in ('INTEGER', 'BIGINT', 'UINTEGER', 'UBIGINT', 'HUGEINT'):
+            serie = datos[c]
+            maximo = max(abs(serie.min()), abs(serie.max())) if serie.notna().any() else 0
+            if maximo <= _MAX_ENTERO_FLOAT32:
+                continue
+        return False
+    return True
@@ -0,0 +1,129 @@
+import itertools
+import logging
+import duckdb
+import pandas as pd
+from typing import Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Lo que aceptan las etapas como entrada: un DataFrame de pandas, una tabla de
+# Arrow o una relación de DuckDB ya definida sobre la conexión de la sesión
+Datos = Union[pd.DataFrame, duckdb.DuckDBPyRelation, "pyarrow.Table"]
+
+_contador_vistas = itertools.count()
+
+
+class SesionPipeline:
+    """
+    Conexión DuckDB compartida por todas las etapas de un workflow.
+
+    Las etapas (clase_ternaria, drift_inf, fe_intrames, lags/deltas) reciben y
+    devuelven relaciones de esta conexión, de modo que la tabla ancha nunca
+    pasa por pandas entre etapa y etapa. Sólo se convierte con a_pandas() /
+    a_arrow() cuando hace falta la matriz (LightGBM) o al final del workflow.
+    """
+
+    def __init__(self,
+                 database: str = ":memory:",
+                 threads: Optional[int] = None,
+                 memory_limit: Optional[str] = None,
+                 temp_directory: Optional[str] = None):
+        self.con = duckdb.connect(database=database)
+        if threads is not None:
+            self.con.execute(f"SET threads = {int(threads)}")
+        if memory_limit is not None:
+            self.con.execute(f"SET memory_limit = '{memory_limit}'")
+        if temp_directory is not None:
+            self.con.execute(f"SET temp_directory = '{temp_directory}'")
+
+    def relacion(self, datos: Datos, prefijo: str = "datos") -> duckdb.DuckDBPyRelation:
+        """
+        Devuelve 'datos' como relación de la sesión (registrando DataFrames o
+        tablas Arrow sin copiarlos).
+        """
+        if isinstance(datos, duckdb.DuckDBPyRelation):
+            return datos
+        nombre, _ = registrar_entrada(datos, self.con, prefijo)
+        return self.con.table(nombre)
+
+    def materializar(self, rel: duckdb.DuckDBPyRelation, nombre: str) -> duckdb.DuckDBPyRelation:
+        """
+        Ejecuta la relación una sola vez y la guarda como tabla temporal de
+        DuckDB (columnar, puede ir a disco). Útil antes de consumir una
+        relación costosa más de una vez.
+        """
+        rel.create_view(f"{nombre}_def", replace=True)
+        self.con.execute(f"CREATE OR REPLACE TEMP TABLE {nombre} AS SELECT * FROM {nombre}_def")
+        self.con.execute(f"DROP VIEW {nombre}_def")
+        return self.con.table(nombre)
+
+    def a_arrow(self, rel: duckdb.DuckDBPyRelation):
+        """
+        Materializa la relación como pyarrow.Table.
+        """
+        return rel.fetch_arrow_table()
+
+    def a_pandas(self, rel: duckdb.DuckDBPyRelation) -> pd.DataFrame:
+        """
+        Materializa la relación como DataFrame de pandas (para LightGBM).
+        """
+        return rel.df()
+
+    def cerrar(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+
+def registrar_entrada(datos: Datos,
+                      con: Optional[duckdb.DuckDBPyConnection],
+                      prefijo: str) -> Tuple[str, bool]:
+    """
+    Registra la entrada de una etapa en 'con' bajo un nombre único.
+
+    Si 'datos' es una relación se define como vista (sin ejecutarla); si es un
+    DataFrame o una tabla Arrow se registra sin copia. El nombre es único para
+    que las vistas de etapas encadenadas no se pisen entre sí.
+
+    Args:
+        datos: Entrada de la etapa
+        con: Conexión donde se registra (la de la relación, si 'datos' es relación)
+        prefijo: Prefijo del nombre de la vista
+
+    Returns:
+        tuple: (nombre de la vista, True si la entrada era una relación)
+    """
+    nombre = f"{prefijo}_{next(_contador_vistas)}"
+    if isinstance(datos, duckdb.DuckDBPyRelation):
+        datos.create_view(nombre)
+        return nombre, True
+    con.register(nombre, datos)
+    return nombre, False
+
+
+def abrir_conexion(datos: Datos,
+                   con: Optional[duckdb.DuckDBPyConnection]) -> Tuple[duckdb.DuckDBPyConnection, bool]:
+    """
+    Devuelve la conexión a usar por una etapa y si la etapa es dueña de ella.
+    Una relación sólo puede consultarse desde su propia conexión.
+    """
+    if con is not None:
+        return con, False
+    if isinstance(datos, duckdb.DuckDBPyRelation):
+        raise ValueError("Para encadenar relaciones hay que pasar la conexión de la sesión (con)")
+    return duckdb.connect(database=":memory:"), True
+
+
+def columnas_de(datos: Datos) -> list:
+    """
+    Nombres de columnas de un DataFrame, tabla Arrow o relación.
+    """
+    if isinstance(datos, pd.DataFrame):
+        return list(datos.columns)
+    if isinstance(datos, duckdb.DuckDBPyRelation):
+        return list(datos.columns)
+    return list(datos.column_names)
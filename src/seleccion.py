@@ -0,0 +1,295 @@
+import json
+import logging
+import os
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+from .config import STUDY_NAME, SEMILLA, SELECCION_FEATURES, FEATURE_STORE
+from .loader import codificar_clase, columnas_features
+from .feature_store import version_actual
+
+logger = logging.getLogger(__name__)
+
+PREFIJO_CANARIO = "canario_"
+
+
+def columnas_constantes_o_nulas(df: pd.DataFrame,
+                                columnas: List[str],
+                                nulos_max: float = 0.99) -> Dict[str, List[str]]:
+    """
+    Columnas sin información: constantes (un único valor y sin nulos, o
+    todas nulas) y casi nulas (fracción de nulos >= nulos_max). Una columna
+    con un único valor y algunos nulos no es constante: el nulo informa.
+
+    Returns:
+        dict: {'constantes': [...], 'nulas': [...]}
+    """
+    n = len(df)
+    constantes, nulas = [], []
+    for c in columnas:
+        valores = df[c].to_numpy(dtype=np.float64, na_value=np.nan)
+        validos = ~np.isnan(valores)
+        cant_nulos = n - int(validos.sum())
+        if cant_nulos == n:
+            constantes.append(c)
+        elif cant_nulos / n >= nulos_max:
+            nulas.append(c)
+        elif cant_nulos == 0 and np.nanmin(valores) == np.nanmax(valores):
+            constantes.append(c)
+    return {'constantes': constantes, 'nulas': nulas}
+
+
+def columnas_correlacionadas(df: pd.DataFrame,
+                             columnas: List[str],
+                             correlacion_max: float = 0.98,
+                             muestra: int = 20000,
+                             semilla: int = 0) -> List[str]:
+    """
+    Columnas casi duplicadas de otra anterior en 'columnas' (|correlación de
+    Pearson| > correlacion_max). Se recorre en orden y se conserva la
+    primera de cada grupo, así los atributos originales quedan antes que
+    sus lags/deltas. La correlación se estima sobre una muestra de filas,
+    con los nulos imputados por la media de la columna.
+
+    Returns:
+        list: Columnas a descartar
+    """
+    if len(columnas) < 2:
+        return []
+    rng = np.random.default_rng(semilla)
+    filas = np.sort(rng.choice(len(df), size=min(muestra, len(df)), replace=False))
+
+    matriz = np.empty((len(filas), len(columnas)), dtype=np.float32)
+    for j, c in enumerate(columnas):
+        valores = df[c].to_numpy(dtype=np.float64, na_value=np.nan)[filas]
+        media = np.nanmean(valores) if not np.isnan(valores).all() else 0.0
+        valores = np.where(np.isnan(valores), media, valores) - media
+        desvio = np.sqrt(np.mean(valores * valores))
+        matriz[:, j] = valores / desvio if desvio > 0 else 0.0
+
+    correlacion = np.abs(matriz.T @ matriz) / len(filas)
+    del matriz
+
+    conservadas = np.zeros(len(columnas), dtype=bool)
+    descartadas = []
+    for j, c in enumerate(columnas):
+        if conservadas.any() and (correlacion[j, conservadas] > correlacion_max).any():
+            descartadas.append(c)
+        else:
+            conservadas[j] = True
+    return descartadas
+
+
+def ganancia_vs_canarios(df: pd.DataFrame,
+                         columnas: List[str],
+                         y: np.ndarray,
+                         peso: np.ndarray,
+                         canarios: int = 20,
+                         cuantil: float = 1.0,
+                         rondas: int = 200,
+                         semilla: int = 0) -> Dict:
+    """
+    Agrega 'canarios' columnas de ruido uniforme, entrena un LightGBM rápido
+    y ordena las features por ganancia (importance_type='gain'). Se descartan
+    las que no superan el cuantil 'cuantil' de la ganancia de los canarios
+    (1.0 = por encima del mejor canario): el modelo no las distingue de ruido.
+
+    Returns:
+        dict: {'descartadas': [...], 'ganancia': {feature: gain}, 'corte': float}
+    """
+    rng = np.random.default_rng(semilla)
+    nombres_canarios = [f"{PREFIJO_CANARIO}{i}" for i in range(canarios)]
+    ruido = pd.DataFrame(rng.random((len(df), canarios), dtype=np.float32),
+                         columns=nombres_canarios, index=df.index)
+    X = pd.concat([df[columnas], ruido], axis=1)
+
+    params = {
+        'objective': 'binary',
+        'boosting_type': 'gbdt',
+        'learning_rate': 0.1,
+        'num_leaves': 31,
+        'min_data_in_leaf': 100,
+        'feature_fraction': 0.5,
+        'bagging_fraction': 0.8,
+        'bagging_freq': 1,
+        'max_bin': 31,
+        'feature_pre_filter': False,
+        'seed': semilla,
+        'verbosity': -1,
+    }
+    modelo = lgb.train(params, lgb.Dataset(X, label=y, weight=peso), num_boost_round=rondas)
+    ganancia = dict(zip(modelo.feature_name(), modelo.feature_importance(importance_type='gain')))
+
+    corte = float(np.quantile([ganancia[c] for c in nombres_canarios], cuantil))
+    descartadas = [c for c in columnas if ganancia[c] <= corte]
+    return {
+        'descartadas': descartadas,
+        'ganancia': {c: float(ganancia[c]) for c in columnas},
+        'corte': corte,
+    }
+
+
+def _huella_filas(df_train: pd.DataFrame) -> str:
+    """
+    Huella de las filas de entrenamiento de la poda: claves y clase. Las
+    columnas se comparan aparte (ver _candidatas y seleccion_vigente).
+    """
+    columnas = ['numero_de_cliente', 'foto_mes', 'clase_ternaria']
+    return str(int(pd.util.hash_pandas_object(df_train[columnas], index=False).sum()))
+
+
+def _candidatas(df_train: pd.DataFrame) -> List[str]:
+    """
+    Features numéricas de 'df_train' que entran a la poda.
+    """
+    return [c for c in columnas_features(df_train) if pd.api.types.is_numeric_dtype(df_train[c])]
+
+
+def podar_features(df: pd.DataFrame,
+                   meses: List[int],
+                   parametros: Optional[Dict] = None,
+                   version: Optional[str] = None) -> Dict:
+    """
+    Etapa de poda entre el FE y la optimización: sobre los meses de
+    entrenamiento descarta, en orden, las columnas constantes o casi nulas,
+    las casi duplicadas (correlación) y las que no superan a los canarios.
+    Cada paso corre sobre las columnas que sobrevivieron al anterior.
+    El resultado guarda la huella de las filas, las candidatas, la versión
+    del feature store y los parámetros, para reutilizarlo con
+    seleccion_vigente en lugar de volver a podar.
+
+    Args:
+        df: DataFrame con features y clase_ternaria
+        meses: foto_mes sobre los que se decide (ej. MES_TRAIN)
+        parametros: Umbrales (None = SELECCION_FEATURES de la configuración):
+            nulos_max, correlacion_max, muestra, canarios, cuantil_canarios, rondas
+        version: Versión del feature store de 'df' (None = la actual de FEATURE_STORE)
+
+    Returns:
+        dict: {'features': [...], 'descartadas': {motivo: [...]}, 'ganancia': {...}}
+    """
+    parametros = {**SELECCION_FEATURES, **(parametros or {})}
+    semilla = SEMILLA[0] if isinstance(SEMILLA, list) else SEMILLA
+
+    df_train = df[df['foto_mes'].isin(meses)]
+    candidatas = _candidatas(df_train)
+    logger.info(f"Poda de features: {len(candidatas)} candidatas sobre {len(df_train)} filas de {meses}")
+
+    descartadas = columnas_constantes_o_nulas(df_train, candidatas, parametros['nulos_max'])
+    quitar = set(descartadas['constantes']) | set(descartadas['nulas'])
+    vivas = [c for c in candidatas if c not in quitar]
+    logger.info(f"Poda: {len(descartadas['constantes'])} constantes y "
+                f"{len(descartadas['nulas'])} casi nulas; quedan {len(vivas)}")
+
+    descartadas['correlacionadas'] = columnas_correlacionadas(
+        df_train, vivas, parametros['correlacion_max'], parametros['muestra'], semilla
+    )
+    quitar = set(descartadas['correlacionadas'])
+    vivas = [c for c in vivas if c not in quitar]
+    logger.info(f"Poda: {len(quitar)} correlacionadas (|r| > {parametros['correlacion_max']}); quedan {len(vivas)}")
+
+    y, peso, _ = codificar_clase(df_train)
+    canarios = ganancia_vs_canarios(df_train, vivas, y, peso,
+                                    canarios=parametros['canarios'],
+                                    cuantil=parametros['cuantil_canarios'],
+                                    rondas=parametros['rondas'],
+                                    semilla=semilla)
+    descartadas['canarios'] = canarios['descartadas']
+    quitar = set(canarios['descartadas'])
+    vivas = [c for c in vivas if c not in quitar]
+    logger.info(f"Poda: {len(quitar)} por debajo de los canarios (gain <= {canarios['corte']:,.1f}); "
+                f"quedan {len(vivas)} de {len(candidatas)}")
+
+    return {
+        'features': vivas,
+        'descartadas': descartadas,
+        'ganancia': canarios['ganancia'],
+        'parametros': parametros,
+        'meses': [int(m) for m in meses],
+        'huella': _huella_filas(df_train),
+        'candidatas': candidatas,
+        'version': version if version is not None else version_actual(FEATURE_STORE),
+    }
+
+
+def seleccion_vigente(df: pd.DataFrame,
+                      meses: List[int],
+                      parametros: Optional[Dict] = None,
+                      archivo_base: Optional[str] = None,
+                      version: Optional[str] = None) -> Optional[Dict]:
+    """
+    Selección guardada por guardar_features si se hizo sobre las mismas
+    filas (meses, clientes y clase), las mismas columnas candidatas, la
+    misma versión del feature store (None = la actual de FEATURE_STORE) y
+    con los mismos parámetros; si no, None y hay que correr podar_features.
+    Volver a podar una selección ya podada sólo puede achicarla, así que
+    mientras los datos no cambien se reutiliza. Si el FE agrega o cambia
+    columnas, la selección vieja las descartaría sin evaluarlas.
+    """
+    if archivo_base is None:
+        archivo_base = STUDY_NAME
+
+    archivo = f"resultados/{archivo_base}_features.json"
+    if not os.path.exists(archivo):
+        return None
+    with open(archivo, 'r') as f:
+        seleccion = json.load(f)
+
+    parametros = {**SELECCION_FEATURES, **(parametros or {})}
+    if version is None:
+        version = version_actual(FEATURE_STORE)
+    df_train = df[df['foto_mes'].isin(meses)]
+    if (seleccion.get('meses') != [int(m) for m in meses] or seleccion.get('parametros') != parametros
+            or seleccion.get('huella') != _huella_filas(df_train)
+            or seleccion.get('candidatas') != _candidatas(df_train)
+            or seleccion.get('version') != version):
+        logger.info(f"La selección de {archivo} es de otros datos, columnas o parámetros: se vuelve a podar")
+        return None
+    logger.info(f"Se reutiliza la selección de {archivo} ({len(seleccion['features'])} features)")
+    return seleccion
+
+
+def guardar_features(seleccion: Dict, archivo_base: Optional[str] = None) -> str:
+    """
+    Guarda el resultado de podar_features en resultados/{archivo_base}_features.json.
+    """
+    if archivo_base is None:
+        archivo_base = STUDY_NAME
+
+    archivo = f"resultados/{archivo_base}_features.json"
+    os.makedirs("resultados", exist_ok=True)
+    with open(archivo, 'w') as f:
+        json.dump(seleccion, f, indent=4)
+
+    logger.info(f"Features seleccionadas guardadas en {archivo} ({len(seleccion['features'])})")
+    return archivo
+
+
+def cargar_features(archivo_base: Optional[str] = None) -> Optional[List[str]]:
+    """
+    Lista de features guardada por guardar_features (None si no existe).
+    """
+    if archivo_base is None:
+        archivo_base = STUDY_NAME
+
+    archivo = f"resultados/{archivo_base}_features.json"
+    if not os.path.exists(archivo):
+        return None
+    with open(archivo, 'r') as f:
+        return json.load(f)['features']
+
+
+def features_modelo(df: pd.DataFrame, archivo_base: Optional[str] = None) -> List[str]:
+    """
+    Columnas que entran al modelo: la selección guardada del estudio si
+    existe, o todas las features de 'df' (loader.columnas_features).
+    """
+    seleccion = cargar_features(archivo_base)
+    if seleccion is None:
+        return columnas_features(df)
+
+    faltantes = [c for c in seleccion if c not in df.columns]
+    if faltantes:
+        logger.warning(f"{len(faltantes)} features seleccionadas no están en el DataFrame: {faltantes[:10]}")
+    return [c for c in seleccion if c in df.columns]
@@ -7,73 +7,114 @@ logger = logging.getLogger(__name__)
 import duckdb
 import os
 import pandas as pd
+from .esquema import ENUM_CLASE_TERNARIA
+from .pipeline import abrir_conexion, registrar_entrada
+
+# foto_mes (AAAAMM) -> período correlativo en meses
+_SQL_PERIODO = "(CAST(foto_mes/100 AS INT) * 12) + (CAST(foto_mes AS INT) % 100)"
+
+
+def _sql_etiquetas(claves: str, periodo_ultimo: str, periodo_desde: str | None = None) -> str:
+    """
+    SQL que etiqueta cada (numero_de_cliente, foto_mes) de 'claves' (que debe
+    tener periodo0) con clase_ternaria a partir de los LEAD de presencia.
+
+    Args:
+        claves: Tabla/CTE con numero_de_cliente, foto_mes y periodo0
+        periodo_ultimo: Expresión SQL del último período disponible
+        periodo_desde: Si se indica, sólo se etiquetan (y se leen) períodos >= a éste.
+                       Como las ventanas sólo miran hacia adelante, el resultado
+                       para esos períodos es el mismo que con toda la historia.
+    """
+    filtro = f"WHERE periodo0 >= {periodo_desde}" if periodo_desde is not None else ""
+    return f"""
+        SELECT
+          numero_de_cliente,
+          foto_mes,
+          CAST(CASE
+            WHEN periodo0 < {periodo_ultimo} - 1
+                 AND periodo1 = periodo0 + 1
+                 AND (periodo2 IS NULL OR periodo2 > periodo0 + 2)
+              THEN 'BAJA+2'
+            WHEN periodo0 < {periodo_ultimo}
+                 AND (periodo1 IS NULL OR periodo1 > periodo0 + 1)
+              THEN 'BAJA+1'
+            WHEN periodo0 < {periodo_ultimo} - 1
+              THEN 'CONTINUA'
+            ELSE NULL
+          END AS {ENUM_CLASE_TERNARIA}) AS clase_ternaria
+        FROM (
+          SELECT
+            numero_de_cliente,
+            foto_mes,
+            periodo0,
+            LEAD(periodo0, 1) OVER (PARTITION BY numero_de_cliente ORDER BY periodo0) AS periodo1,
+            LEAD(periodo0, 2) OVER (PARTITION BY numero_de_cliente ORDER BY periodo0) AS periodo2
+          FROM {claves}
+          {filtro}
+        )
+    """
+
 
 def clase_ternaria(
-    csv_path: str = "~/buckets/b1/datasets/competencia_02_crudo.csv.gz",
+    csv_path: str | duckdb.DuckDBPyRelation = "~/buckets/b1/datasets/competencia_02_crudo.csv.gz",
     con: duckdb.DuckDBPyConnection | None = None,
     table_prefix: str = "competencia_02",
-) -> pd.DataFrame:
+    como_relacion: bool = False,
+) -> pd.DataFrame | duckdb.DuckDBPyRelation:
     """
     Lee el CSV indicado, crea las tablas {table_prefix}_crudo y {table_prefix}
     en DuckDB y devuelve un DataFrame con la tabla procesada que incluye clase_ternaria.
+
+    Si csv_path es una relación de la sesión (con), {table_prefix}_crudo y
+    {table_prefix} se definen como vistas sobre ella y se devuelve la
+    relación, sin copiar el crudo ni pasar por pandas. Con como_relacion=True
+    también se devuelve la relación cuando la fuente es un CSV.
     """
-    csv_path = os.path.expanduser(csv_path)
+    es_relacion = isinstance(csv_path, duckdb.DuckDBPyRelation)
+    if como_relacion and con is None:
+        raise ValueError("Para devolver una relación hay que pasar la conexión de la sesión (con)")
 
     # Crear conexión si no se pasa una
-    own_con = False
-    if con is None:
-        con = duckdb.connect(database=":memory:")
-        own_con = True
+    con, own_con = abrir_conexion(csv_path, con)
 
-    # 1) Crear tabla cruda
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {table_prefix}_crudo AS
-        SELECT * FROM read_csv_auto('{csv_path}')
-    """)
+    # 1) Crear tabla cruda (o vista sobre la relación de entrada)
+    if es_relacion:
+        csv_path.create_view(f"{table_prefix}_crudo", replace=True)
+        objeto = "VIEW"
+    else:
+        csv_path = os.path.expanduser(csv_path)
+        con.execute(f"""
+            CREATE OR REPLACE TABLE {table_prefix}_crudo AS
+            SELECT * FROM read_csv_auto('{csv_path}')
+        """)
+        objeto = "TABLE"
 
     # 2) Crear tabla con clase_ternaria
     con.execute(f"""
-        CREATE OR REPLACE TABLE {table_prefix} AS
+        CREATE OR REPLACE {objeto} {table_prefix} AS
         WITH b AS (
           SELECT
             numero_de_cliente,
             CAST(foto_mes AS INT) AS foto_mes,
-            (CAST(foto_mes/100 AS INT) * 12) + (CAST(foto_mes AS INT) % 100) AS periodo0
+            {_SQL_PERIODO} AS periodo0
           FROM {table_prefix}_crudo
         ),
-        w AS (
-          SELECT
-            *,
-            LEAD(periodo0, 1) OVER (PARTITION BY numero_de_cliente ORDER BY periodo0) AS periodo1,
-            LEAD(periodo0, 2) OVER (PARTITION BY numero_de_cliente ORDER BY periodo0) AS periodo2
-          FROM b
-        ),
-        mx AS (
-          SELECT
-            MAX(periodo0) AS periodo_ultimo,
-            MAX(periodo0) - 1 AS periodo_anteultimo
-          FROM b
+        e AS (
+          {_sql_etiquetas("b", "(SELECT MAX(periodo0) FROM b)")}
         )
         SELECT
           d.*,
-          CASE
-            WHEN w.periodo0 < (SELECT periodo_anteultimo FROM mx)
-                 AND w.periodo1 = w.periodo0 + 1
-                 AND (w.periodo2 IS NULL OR w.periodo2 > w.periodo0 + 2)
-              THEN 'BAJA+2'
-            WHEN w.periodo0 < (SELECT periodo_ultimo FROM mx)
-                 AND (w.periodo1 IS NULL OR w.periodo1 > w.periodo0 + 1)
-              THEN 'BAJA+1'
-            WHEN w.periodo0 < (SELECT periodo_anteultimo FROM mx)
-              THEN 'CONTINUA'
-            ELSE NULL
-          END AS clase_ternaria
+          e.clase_ternaria
         FROM {table_prefix}_crudo d
-        LEFT JOIN w
-          ON w.numero_de_cliente = d.numero_de_cliente
-         AND w.foto_mes = CAST(d.foto_mes AS INT)
+        LEFT JOIN e
+          ON e.numero_de_cliente = d.numero_de_cliente
+         AND e.foto_mes = CAST(d.foto_mes AS INT)
     """)
 
+    if es_relacion or como_relacion:
+        return con.table(table_prefix)
+
     # 3) Devolver como DataFrame
     df = con.execute(f"SELECT * FROM {table_prefix}").df()
 
@@ -84,6 +125,152 @@ def clase_ternaria(
     return df
 
 
+def actualizar_etiquetas(
+    fuente: str | pd.DataFrame | duckdb.DuckDBPyRelation,
+    db_path: str = "clase_ternaria.duckdb",
+    meses: list[int] | None = None,
+) -> pd.DataFrame:
+    """
+    Mantiene en un archivo DuckDB las etiquetas clase_ternaria por
+    (numero_de_cliente, foto_mes) y las actualiza en forma incremental.
+
+    Sólo se leen las claves de la fuente. Cuando aparecen meses nuevos se
+    guardan sus claves en la tabla 'presencia' y se re-etiquetan únicamente
+    los períodos >= (primer mes nuevo - 2): un mes nuevo sólo cambia la
+    etiqueta de los dos meses anteriores (y la suya, que queda en NULL).
+
+    Un mes ya guardado cuenta como nuevo si cambiaron sus clientes (ej. un
+    CSV corregido o DATA_PATH apuntando a otro dataset): se compara por mes
+    la huella de las claves (cantidad y suma de hash(numero_de_cliente))
+    de la fuente contra la de 'presencia'. Los meses guardados que ya no
+    están en la fuente se borran y también re-etiquetan desde dos antes.
+
+    Args:
+        fuente: Ruta al CSV crudo (se usa su cache Parquet), DataFrame o
+                relación con al menos numero_de_cliente y foto_mes
+        db_path: Archivo DuckDB donde se guardan presencia y etiquetas
+        meses: foto_mes a devolver (None = todos)
+
+    Returns:
+        pd.DataFrame: numero_de_cliente, foto_mes, clase_ternaria (categórica)
+    """
+    # Claves de la fuente (sólo dos columnas enteras)
+    if isinstance(fuente, str):
+        from .loader import asegurar_cache_parquet, leer_parquet_particionado
+        directorio = asegurar_cache_parquet(fuente)
+        claves = leer_parquet_particionado(directorio, columnas=['numero_de_cliente', 'foto_mes'])
+    elif isinstance(fuente, duckdb.DuckDBPyRelation):
+        claves = fuente.project("numero_de_cliente, foto_mes").fetch_arrow_table()
+    else:
+        claves = fuente[['numero_de_cliente', 'foto_mes']]
+
+    con = duckdb.connect(database=os.path.expanduser(db_path))
+    try:
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS presencia (
+              numero_de_cliente INTEGER,
+              foto_mes INTEGER,
+              periodo0 INTEGER
+            )
+        """)
+        con.execute(f"""
+            CREATE TABLE IF NOT EXISTS etiquetas (
+              numero_de_cliente INTEGER,
+              foto_mes INTEGER,
+              clase_ternaria {ENUM_CLASE_TERNARIA}
+            )
+        """)
+        con.register("claves_fuente", claves)
+
+        # Huella de las claves de cada mes: meses nuevos, con otros clientes
+        # o que ya no están en la fuente
+        huella = """
+            SELECT foto_mes, COUNT(*) AS filas, SUM(hash(numero_de_cliente)) AS suma
+            FROM (SELECT DISTINCT CAST(numero_de_cliente AS INT) AS numero_de_cliente,
+                                  CAST(foto_mes AS INT) AS foto_mes
+                  FROM {tabla})
+            GROUP BY foto_mes
+        """
+        meses_nuevos = [m for (m,) in con.execute(f"""
+            SELECT COALESCE(f.foto_mes, p.foto_mes)
+            FROM ({huella.format(tabla="claves_fuente")}) f
+            FULL OUTER JOIN ({huella.format(tabla="presencia")}) p USING (foto_mes)
+            WHERE f.filas IS DISTINCT FROM p.filas OR f.suma IS DISTINCT FROM p.suma
+            ORDER BY 1
+        """).fetchall()]
+
+        if meses_nuevos:
+            logger.info(f"Meses nuevos o con otros clientes para etiquetar: {meses_nuevos}")
+            lista = ", ".join(str(m) for m in meses_nuevos)
+
+            con.execute("BEGIN TRANSACTION")
+            con.execute(f"DELETE FROM presencia WHERE foto_mes IN ({lista})")
+            con.execute(f"""
+                INSERT INTO presencia
+                SELECT DISTINCT
+                  CAST(numero_de_cliente AS INT),
+                  CAST(foto_mes AS INT),
+                  {_SQL_PERIODO}
+                FROM claves_fuente
+                WHERE CAST(foto_mes AS INT) IN ({lista})
+            """)
+
+            desde = min((m // 100) * 12 + m % 100 for m in meses_nuevos) - 2
+            ultimo = con.execute("SELECT MAX(periodo0) FROM presencia").fetchone()[0]
+
+            con.execute(f"DELETE FROM etiquetas WHERE {_SQL_PERIODO} >= {desde}")
+            con.execute(f"""
+                INSERT INTO etiquetas
+                {_sql_etiquetas("presencia", str(ultimo), str(desde))}
+            """)
+            con.execute("COMMIT")
+
+            n = con.execute(f"SELECT COUNT(*) FROM etiquetas WHERE {_SQL_PERIODO} >= {desde}").fetchone()[0]
+            logger.info(f"Etiquetas recalculadas desde el período {desde}: {n} filas")
+        else:
+            logger.info("No hay meses nuevos; se usan las etiquetas guardadas")
+
+        filtro = ""
+        if meses is not None:
+            filtro = f"WHERE foto_mes IN ({', '.join(str(int(m)) for m in meses)})"
+        df = con.execute(f"SELECT * FROM etiquetas {filtro}").df()
+    finally:
+        con.close()
+
+    return df
+
+
+def agregar_etiquetas(
+    df: pd.DataFrame | duckdb.DuckDBPyRelation,
+    etiquetas: pd.DataFrame,
+    con: duckdb.DuckDBPyConnection | None = None,
+) -> pd.DataFrame | duckdb.DuckDBPyRelation:
+    """
+    Agrega clase_ternaria a 'df' uniendo por (numero_de_cliente, foto_mes).
+    Si df es una relación de la sesión devuelve la relación con el join.
+    """
+    if isinstance(df, duckdb.DuckDBPyRelation):
+        if con is None:
+            raise ValueError("Para encadenar relaciones hay que pasar la conexión de la sesión (con)")
+        tabla, _ = registrar_entrada(df, con, "datos")
+        tabla_et, _ = registrar_entrada(etiquetas, con, "etiquetas")
+        excluir = " EXCLUDE (clase_ternaria)" if 'clase_ternaria' in df.columns else ""
+        return con.sql(f"""
+            SELECT d.*{excluir}, e.clase_ternaria
+            FROM {tabla} d
+            LEFT JOIN {tabla_et} e
+              USING (numero_de_cliente, foto_mes)
+        """)
+
+    # En pandas se alinea por clave y se agrega una sola columna, sin merge
+    # (que copiaría todo el DataFrame)
+    claves = ['numero_de_cliente', 'foto_mes']
+    serie = etiquetas.set_index(claves)['clase_ternaria']
+    df['clase_ternaria'] = serie.reindex(pd.MultiIndex.from_frame(df[claves])).to_numpy()
+    df['clase_ternaria'] = df['clase_ternaria'].astype(serie.dtype)
+    return df
+
+
 def pivot_clase_ternaria(con: duckdb.DuckDBPyConnection) -> pd.DataFrame:
     """
     Ejecuta el PIVOT de counts por foto_mes y clase_ternaria, ordenado por foto_mes.
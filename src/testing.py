@@ -7,12 +7,16 @@ import os
 from datetime import datetime
 from .config import *
 from .config import (
-    MES_TEST, MES_TRAIN,GANANCIA_ACIERTO, COSTO_ESTIMULO
+    MES_TEST, MES_TRAIN
 )
+from .loader import codificar_clase
+from .seleccion import features_modelo
+from .dataset_lgb import construir_dataset
+from .best_params import reescalar_params
 
 logger = logging.getLogger(__name__)
 
-def evaluar_en_test(df, mejores_params, best_iter=None) -> dict:
+def evaluar_en_test(df, mejores_params, best_iter=None, filas_optimizacion=None) -> dict:
     """
     Evalúa el modelo con los mejores hiperparámetros en el conjunto de test.
     Solo calcula la ganancia, sin usar sklearn.
@@ -20,6 +24,10 @@ def evaluar_en_test(df, mejores_params, best_iter=None) -> dict:
     Args:
         df: DataFrame con todos los datos
         mejores_params: Mejores hiperparámetros encontrados por Optuna
+        best_iter: Rondas de boosting
+        filas_optimizacion: Filas de entrenamiento de cada fold en la optimización
+            (best_params.filas_optimizacion); si se pasan, min_data_in_leaf se
+            reescala a las filas de MES_TRAIN
   
     Returns:
         dict: Resultados de la evaluación en test (ganancia + estadísticas básicas)
@@ -31,16 +39,13 @@ def evaluar_en_test(df, mejores_params, best_iter=None) -> dict:
     df_train_completo = df[df['foto_mes'].isin(MES_TRAIN)]
     df_test = df[df['foto_mes'].isin(MES_TEST)]
 
-    X_train = df_train_completo.drop(columns=['clase_ternaria','clase_peso','clase_binaria2'])
-    y_train = df_train_completo['clase_binaria2']
-    w_train = df_train_completo['clase_peso']
-    
-    X_test = df_test.drop(['clase_ternaria', 'clase_peso','clase_binaria2'], axis=1)
-    y_test_class = df_test['clase_ternaria']
+    features = features_modelo(df)
+    y_train, w_train, _ = codificar_clase(df_train_completo)
+    _, _, ganancia = codificar_clase(df_test)
 
     # Entrenar modelo con mejores parámetros
     
-    params = mejores_params.copy()
+    params = reescalar_params(mejores_params, filas_optimizacion, len(df_train_completo))
     params.update({
         'objective': 'binary',
         'boosting_type': 'gbdt',
@@ -52,8 +57,8 @@ def evaluar_en_test(df, mejores_params, best_iter=None) -> dict:
         'verbosity': -1
     })
     
-    train_data = lgb.Dataset(X_train,
-                            label=y_train, weight=w_train)
+    # Columnas casi todas en cero como matriz CSC; 'features' queda en el orden del Dataset
+    train_data, features = construir_dataset(df_train_completo, features, y_train, w_train, params=params)
 
     best_iter = int(best_iter)
   
@@ -62,13 +67,12 @@ def evaluar_en_test(df, mejores_params, best_iter=None) -> dict:
                 train_data,
                 num_boost_round=best_iter)
     
-    y_pred_test = model_test.predict(X_test)
+    y_pred_test = model_test.predict(df_test[features])
 
     # Ganancia y orden
-    ganancia = np.where(y_test_class == 'BAJA+2', GANANCIA_ACIERTO, 0) - np.where(y_test_class != 'BAJA+2', COSTO_ESTIMULO, 0)
     order = np.argsort(y_pred_test)[::-1] #ordeno por probabilidad
     ganancia_ord = ganancia[order]
-    ganancia_cum = np.cumsum(ganancia_ord)
+    ganancia_cum = np.cumsum(ganancia_ord, dtype=np.int64)
   
     # Ventana de análisis
     piso_envios = 4000
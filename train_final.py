@@ -4,22 +4,30 @@ import datetime
 import lightgbm as lgb
 import numpy as np
 
-from src.loader import cargar_datos, convertir_clase_ternaria_a_target
-from src.features import feature_engineering_lag, feature_engineering_delta, obtener_columnas_validas
+from src.loader import codificar_clase
+from src.seleccion import features_modelo
+from src.dataset_lgb import construir_dataset
+from src.best_params import reescalar_params
+from src.feature_store import cargar_dataframe
+from src.esquema import reportar_memoria
 from src.config import *
 
-os.makedirs("logs", exist_ok=True)
-fecha = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-nombre_log = f"log_final_{fecha}.log"
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(name)s %(lineno)d - %(message)s",
-    handlers=[
-        logging.FileHandler(f"logs/{nombre_log}", mode="w", encoding="utf-8"),
-        logging.StreamHandler()
-    ]
-)
+# Fuera del import: los procesos spawn (workers de Optuna, buckets del FE)
+# reimportan este script y no deben abrir otro archivo de log
+def configurar_logging():
+    os.makedirs("logs", exist_ok=True)
+    fecha = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    nombre_log = f"log_final_{fecha}.log"
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(name)s %(lineno)d - %(message)s",
+        handlers=[
+            logging.FileHandler(f"logs/{nombre_log}", mode="w", encoding="utf-8"),
+            logging.StreamHandler()
+        ]
+    )
+
 logger = logging.getLogger(__name__)
 
 def main():
@@ -30,27 +38,15 @@ def main():
     MES_PRED  = 202106
     best_iteration = 223
     CORTE_OPTIMO = 9500  
+    # 'filas_entrenamiento' del trial del que salen params y best_iteration
+    # (None = no reescalar min_data_in_leaf). No usar filas_optimizacion():
+    # es la del mejor trial del log actual, no la de estos valores fijos
+    FILAS_OPTIMIZACION = None
 
-    # Cargar datos
-    df = cargar_datos(DATA_PATH)
-
-    # Feature Engineering
-    atributos = obtener_columnas_validas(df)
-    df = feature_engineering_lag(df, atributos, 2)
-    logger.info(f"Dataset post-FE: {df.shape}")
-    df = feature_engineering_delta(df, atributos, 2)
-    logger.info(f"Dataset post-FE: {df.shape}")
-
-    # Agrego pesos
-    df['clase_peso'] = 1.0
-    df.loc[df['clase_ternaria'] == 'BAJA+2', 'clase_peso'] = 1.00002
-    df.loc[df['clase_ternaria'] == 'BAJA+1', 'clase_peso'] = 1.00001
-
-    # Clase binaria
-    df['clase_binaria2'] = 0
-    df['clase_binaria2'] = np.where(df['clase_ternaria'] == 'CONTINUA', 0, 1)
-
-    logger.info(f"Dataset post-FE: {df.shape}")
+    # Features de entrenamiento y predicción desde el feature store de workflow A
+    df = cargar_dataframe(FEATURE_STORE, TRAIN_f + [MES_PRED])
+    logger.info(f"Dataset del feature store: {df.shape}")
+    reportar_memoria(df, "feature store")
 
     params = {
         'objective': 'binary',
@@ -69,12 +65,19 @@ def main():
     }
 
     # Preparo datos para entrenamiento
+    features = features_modelo(df)
     train_final = df[df['foto_mes'].isin(TRAIN_f)]
-    X_final = train_final.drop(columns=['clase_ternaria','clase_peso','clase_binaria2'])
-    y_final = train_final['clase_binaria2']
-    w_final = train_final['clase_peso']
+    y_final, w_final, _ = codificar_clase(train_final)
+
+    # min_data_in_leaf de la optimización (folds, quizás con undersampling) a las filas de TRAIN_f
+    if FILAS_OPTIMIZACION is None:
+        logger.warning(f"FILAS_OPTIMIZACION es None: min_data_in_leaf={params['min_data_in_leaf']} no se "
+                       f"reescala a las {len(train_final)} filas de TRAIN_f; si los parámetros salen de "
+                       f"un estudio, poner las filas_entrenamiento de ese trial")
+    params = reescalar_params(params, FILAS_OPTIMIZACION, len(train_final))
 
-    dtrain_final = lgb.Dataset(X_final, label=y_final, weight=w_final)
+    # Columnas casi todas en cero como matriz CSC; 'features' queda en el orden del Dataset
+    dtrain_final, features = construir_dataset(train_final, features, y_final, w_final, params=params)
 
     # Entreno modelo final
     model_final = lgb.train(params,
@@ -93,7 +96,7 @@ def main():
         # Si no existe, creamos un id reproducible
         df_pred[ID_COL] = np.arange(len(df_pred))
 
-    X_predict = df_pred.drop(columns=['clase_ternaria', 'target', 'clase_peso','clase_binaria2'], errors='ignore')
+    X_predict = df_pred[features]
     logger.info(f"Prediciendo sobre MES_PRED={MES_PRED} (n={len(df_pred)}) ...")
     df_pred['prob'] = model_final.predict(X_predict)
 
@@ -126,4 +129,5 @@ def main():
     logger.info(f"CORTE_OPTIMO: {CORTE_OPTIMO}, best_iteration: {best_iteration}")
 
 if __name__ == "__main__":
+    configurar_logging()
     main()
\ No newline at end of file
@@ -1,32 +1,44 @@
-import pandas as pd
 import os
+import shutil
 import datetime
 import logging
 
 logging.getLogger("matplotlib").setLevel(logging.WARNING)
 logging.getLogger("matplotlib.font_manager").setLevel(logging.WARNING)
 
-#from src.loader import cargar_datos
-from src.features import obtener_columnas_validas, feature_engineering_lag_delta
-from src.data_drifting import drift_inf, ind
-from src.target import clase_ternaria
-from src.fe_intrames import fe_intrames
+from src.loader import cargar_relacion
+from src.features import obtener_columnas_validas, feature_engineering_ventanas, feature_engineering_ventanas_por_buckets
+from src.data_drifting import corregir_drift, ind
+from src.target import actualizar_etiquetas, agregar_etiquetas
+from src.fe_intrames import fe_intrames, features_intrames_requeridas
+from src.seleccion import cargar_features
+from src.esquema import reportar_memoria
+from src.feature_store import version_fe, version_actual, escribir_feature_store
+from src.pipeline import SesionPipeline
+from src.panel import ventanas_tensor, verificar_motores
+from src.cache import CacheEtapas, clave_archivo
+from src.output_manager import guardar_dataset_parquet, publicar_dataset
+from src.incremental import (guardar_estado, estado_compatible, meses_pendientes, meses_reetiquetados,
+                             agregar_mes_incremental, refrescar_clase, verificar_incremental)
 
 from src.config import *
 
 ## config basico logging
-os.makedirs("logs", exist_ok=True)
-
-fecha = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-nombre_log = f"log_{fecha}.log"
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(name)s %(lineno)d - %(message)s',
-    handlers=[
-        logging.FileHandler(f"logs/{nombre_log}", mode="w", encoding="utf-8"),
-        logging.StreamHandler()
-    ]
-)
+# Fuera del import: los procesos spawn (workers de Optuna, buckets del FE)
+# reimportan este script y no deben abrir otro archivo de log
+def configurar_logging():
+    os.makedirs("logs", exist_ok=True)
+
+    fecha = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    nombre_log = f"log_{fecha}.log"
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='%(asctime)s - %(levelname)s - %(name)s %(lineno)d - %(message)s',
+        handlers=[
+            logging.FileHandler(f"logs/{nombre_log}", mode="w", encoding="utf-8"),
+            logging.StreamHandler()
+        ]
+    )
 
 logger = logging.getLogger(__name__)
 
@@ -34,50 +46,168 @@ logger = logging.getLogger(__name__)
 def main():
     ##Pipeline principal con optimización usando configuración YAML.
     logger.info("=== INICIANDO PIPELINE CON CONFIGURACIÓN YAML ===")
-  
-    # 1. Cargar datos
-    #df = cargar_datos(DATA_PATH)
-
-    # 2. Target y Pivot (por si necesito)
-    df = clase_ternaria(df)
-    #df = pivot_clase_ternaria(df)
-
-    #3. Eliminación Features
-    df.drop(columns=['mprestamos_personales', 'cprestamos_personales'], inplace=True)
-    logger.info(f"Etapa completada: {df.shape}")
-
-    #4. Data Quality
-    # COMPLETAR
-
-    #5. Data Drifting
-    # Defino campos monetarios a usar y aplico función
-    campos_monetarios = [col for col in df.columns if col.startswith(('m', 'Visa_m', 'Master_m', 'vm_m'))]
-    df = drift_inf(df, campos_monetarios, ind)
-
-    #6. Feature Engineering Intra-Mes
-    df = fe_intrames(df)
-    logger.info(f"Etapa completada: {df.shape}")
-
-    #7. Feature Engineering Histórico
-    atributos = obtener_columnas_validas(df)
-    df = feature_engineering_lag_delta(
-        df=df,
-        columnas=atributos,
-        cant_lag=2,
-        cant_delta=2
-    )
-    """
-    cant_lag = 2
-    cant_delta = 2
-    df = feature_engineering_lag(df, atributos, cant_lag)
-    df = feature_engineering_delta(df, atributos, cant_delta)
-    """  
-    logger.info(f"Etapa completada: {df.shape}")
 
-    #8. Output en parquet
-    df.to_parquet("df.parquet", index=False) 
+    # Todas las etapas comparten una sesión DuckDB y se pasan relaciones.
+    # Cada etapa se guarda en el cache de etapas: una corrida nueva sólo
+    # recalcula las etapas cuyo código, parámetros o entrada cambiaron
+    with SesionPipeline(memory_limit=DUCKDB_MEMORIA, temp_directory=DUCKDB_TEMP_DIR) as sesion:
+        con = sesion.con
+        cache = CacheEtapas(con, CACHE_DIR, max_bytes=int(CACHE_MAX_GB * 1024 ** 3))
+        clave = clave_archivo(DATA_PATH)
+
+        # 1. Cargar datos
+        df = cargar_relacion(con, DATA_PATH)
+
+        # 2. Target y Pivot (por si necesito)
+        # Las etiquetas viven en un DuckDB persistente y sólo se recalculan
+        # los meses afectados por los meses nuevos
+        df, clave = cache.etapa(
+            "target", clave,
+            lambda: agregar_etiquetas(df, actualizar_etiquetas(DATA_PATH, db_path=ETIQUETAS_DB), con=con),
+            codigo=[cargar_relacion, actualizar_etiquetas, agregar_etiquetas]
+        )
+        reportar_memoria(df, "target", con, cache.archivo(clave))
+        #df = pivot_clase_ternaria(df)
+
+        #3. Eliminación Features
+        eliminar = ['mprestamos_personales', 'cprestamos_personales']
+        df, clave = cache.etapa(
+            "eliminacion", clave,
+            lambda: df.project(f"* EXCLUDE ({', '.join(eliminar)})"),
+            parametros={'eliminar': eliminar},
+            persistir=False
+        )
+        logger.info(f"Etapa completada: {len(df.columns)} columnas")
+
+        #4. Data Quality
+        # COMPLETAR
+
+        #5. Data Drifting
+        # Defino campos monetarios a usar y aplico función
+        campos_monetarios = [col for col in df.columns if col.startswith(('m', 'Visa_m', 'Master_m', 'vm_m'))]
+        df, clave = cache.etapa(
+            "drift", clave,
+            lambda: corregir_drift(df, campos_monetarios, modo=DRIFT_MODO, tb_indices=ind, con=con),
+            parametros={'campos': campos_monetarios, 'modo': DRIFT_MODO, 'indices': ind},
+            codigo=[corregir_drift]
+        )
+
+        #6. Feature Engineering Intra-Mes (FE_INTRAMES); con FE_INTRAMES_PODAR
+        # sólo las que usa la selección de features guardada del estudio
+        seleccion = cargar_features() if FE_INTRAMES_PODAR else None
+        pedidas = features_intrames_requeridas(FE_INTRAMES, seleccion) if seleccion is not None else None
+        df, clave = cache.etapa(
+            "intrames", clave,
+            lambda: fe_intrames(df, con=con, espec=FE_INTRAMES, features=pedidas),
+            parametros={'espec': FE_INTRAMES, 'features': pedidas},
+            codigo=[fe_intrames]
+        )
+        logger.info(f"Etapa completada: {len(df.columns)} columnas")
+        reportar_memoria(df, "fe intra-mes", con, cache.archivo(clave))
+
+        #7. Feature Engineering Histórico (lags, deltas y rolling según FE_HISTORICO)
+        atributos = obtener_columnas_validas(df)
+        motor = FE_MOTOR if FE_BUCKETS == 0 else 'sql'
+
+        # Versión del feature store: todo lo que define las features (no los datos)
+        version = version_fe({
+            'eliminar': eliminar, 'drift': DRIFT_MODO, 'indices': ind,
+            'intrames': FE_INTRAMES, 'pedidas': pedidas, 'historico': FE_HISTORICO, 'motor': motor,
+            'codigo': [agregar_etiquetas, corregir_drift, fe_intrames, feature_engineering_ventanas, ventanas_tensor],
+        })
+
+        # Incremental: con el dataset y el estado de una corrida anterior
+        # sólo se calculan (y agregan como partición) los meses nuevos. Si la
+        # versión del store cambió (código o configuración del FE) los meses
+        # ya guardados no sirven: corrida completa a una versión nueva
+        incremental = FE_INCREMENTAL and os.path.isdir(OUTPUT_PARQUET)
+        if incremental and version_actual(FEATURE_STORE) != version:
+            logger.info(f"FE incremental: el feature store está en la versión {version_actual(FEATURE_STORE)} "
+                        f"y la actual es {version}; se recalcula todo")
+            incremental = False
+        reetiquetados = None
+        if incremental and estado_compatible(FE_ESTADO, atributos, FE_HISTORICO, motor, version):
+            # Meses ya guardados cuya clase cambió (los dos anteriores a cada
+            # mes nuevo y los que re-etiquetó actualizar_etiquetas); None si
+            # cambiaron sus clientes
+            reetiquetados = meses_reetiquetados(df, FE_ESTADO, con)
+        if reetiquetados is not None:
+            meses = meses_pendientes(df, FE_ESTADO, con)
+            logger.info(f"FE incremental: meses nuevos {meses}, clase a refrescar en {reetiquetados}")
+            for mes in meses:
+                agregar_mes_incremental(df, mes, FE_ESTADO, OUTPUT_PARQUET, con,
+                                        row_group_size=PARQUET_ROW_GROUP,
+                                        compresion=PARQUET_COMPRESION)
+                if FE_VERIFICAR_INCREMENTAL and not verificar_incremental(
+                        df, mes, OUTPUT_PARQUET, atributos, FE_HISTORICO, con, motor=motor):
+                    raise RuntimeError(f"El FE incremental de {mes} no coincide con el recálculo completo; "
+                                       f"correr con FE_INCREMENTAL: false")
+            refrescados = refrescar_clase(df, reetiquetados, OUTPUT_PARQUET, FE_ESTADO, con,
+                                          row_group_size=PARQUET_ROW_GROUP,
+                                          compresion=PARQUET_COMPRESION)
+            if meses or refrescados:
+                salida = con.read_parquet(os.path.join(OUTPUT_PARQUET, "*", "*.parquet"), hive_partitioning=True)
+                escribir_feature_store(salida, FEATURE_STORE, version, con, meses=meses + refrescados)
+            logger.info(f">>> Workflow A completado (incremental)")
+            return
+
+        df_base = df
+        if motor == 'tensor' and FE_VERIFICAR_TENSOR and not verificar_motores(df, atributos, FE_HISTORICO, con):
+            raise RuntimeError("El motor tensorial no coincide con el SQL en la muestra de clientes; "
+                               "correr con FE_MOTOR: \"sql\"")
+        if FE_BUCKETS > 0:
+            # Streaming: buckets de clientes en procesos separados, leyendo la
+            # salida intra-mes directamente del cache
+            calcular = lambda: feature_engineering_ventanas_por_buckets(
+                fuente=cache.archivo(clave),
+                salida=os.path.join(CACHE_DIR, "historico_buckets"),
+                columnas=atributos,
+                espec=FE_HISTORICO,
+                n_buckets=FE_BUCKETS,
+                n_procesos=FE_PROCESOS,
+                memory_limit=FE_MEMORIA_PROCESO
+            )
+        else:
+            calcular = lambda: feature_engineering_ventanas(
+                df=df,
+                columnas=atributos,
+                espec=FE_HISTORICO,
+                con=con,
+                motor=FE_MOTOR,
+                shards=FE_SHARDS,
+                hilos=FE_HILOS
+            )
+
+        # La tabla más ancha se escribe una sola vez: ya particionada por
+        # foto_mes como entrada del cache, y OUTPUT_PARQUET son hardlinks a ella
+        def calcular_particionado():
+            salida = calcular()
+            rel = con.read_parquet(os.path.join(salida, "*.parquet")) if isinstance(salida, str) else salida
+            destino = guardar_dataset_parquet(rel, os.path.join(CACHE_DIR, "historico_particionado"), con,
+                                              row_group_size=PARQUET_ROW_GROUP,
+                                              compresion=PARQUET_COMPRESION)
+            if isinstance(salida, str):
+                shutil.rmtree(salida, ignore_errors=True)
+            return destino
+
+        df, clave = cache.etapa(
+            "historico", clave, calcular_particionado,
+            parametros={'columnas': atributos, 'espec': FE_HISTORICO, 'motor': motor, 'particion': 'foto_mes'},
+            codigo=[obtener_columnas_validas, feature_engineering_ventanas, ventanas_tensor]
+        )
+        logger.info(f"Etapa completada: {len(df.columns)} columnas")
+        reportar_memoria(df, "fe histórico", con, cache.archivo(clave))
+
+        #8. Output en parquet particionado por foto_mes: la entrada del cache del histórico
+        publicar_dataset(cache.archivo(clave), OUTPUT_PARQUET)
+        #9. Feature store: un mes por partición, leído por main/testing/train_final
+        escribir_feature_store(df, FEATURE_STORE, version, con)
+
+        if FE_INCREMENTAL:
+            guardar_estado(df_base, atributos, FE_HISTORICO, FE_ESTADO, con, motor=motor, version=version)
 
     logger.info(f">>> Workflow A completado. Continuar con la siguiente etapa")
 
 if __name__ == "__main__":
+    configurar_logging()
     main()
\ No newline at end of file